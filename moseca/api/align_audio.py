@@ -3,72 +3,227 @@ import sys
 import librosa
 import soundfile as sf
 import numpy as np
+from moseca.api.service.cache import LRUCache
+from moseca.api.service.metrics import timed
 
 
-def align_audio(audio_file: str, tempo: int, output_dir: str, start_time: float = None, end_time: float = None):
+# Beat tracking runs on a mono signal at this sample rate, whatever the input rate is.
+# The FFT and hop lengths span the same time as librosa's defaults (2048 and 512) at
+# 44100 Hz, which the beats were tracked at before, so the onsets are found as early.
+ANALYSIS_SAMPLE_RATE = 11025
+ANALYSIS_N_FFT = 512
+ANALYSIS_HOP_LENGTH = 128
+
+
+def track_beats(y_mono: np.ndarray, sr: int, tempo: int) -> np.ndarray:
     """
-    Aligns the audio file so that it starts at the nearest downbeat,
-    or trims the audio based on provided start and end times aligned to downbeats.
+    Tracks beats on a downsampled copy of a mono signal.
 
     Parameters:
-    - audio_file (str): Path to the input audio file.
+    - y_mono (np.ndarray): Mono audio signal.
+    - sr (int): Sample rate of the signal.
     - tempo (float): Tempo in BPM.
-    - output_dir (str): Directory to save the aligned audio file.
-    - start_time (float, optional): Desired start time in seconds for trimming.
-    - end_time (float, optional): Desired end time in seconds for trimming.
 
     Returns:
-    - float: Number of seconds trimmed from the beginning.
+    - np.ndarray: Beat times in seconds.
     """
-    # Validate input parameters
-    if not os.path.isfile(audio_file):
-        print(f"Error: Audio file '{audio_file}' does not exist.")
-        return
+    with timed("beat_track"):
+        if sr > ANALYSIS_SAMPLE_RATE:
+            y_mono = librosa.resample(y_mono, orig_sr=sr, target_sr=ANALYSIS_SAMPLE_RATE, res_type='soxr_qq')
+            sr = ANALYSIS_SAMPLE_RATE
 
-    if tempo <= 0:
-        print("Error: Tempo must be a positive number.")
-        return
+        onset_envelope = librosa.onset.onset_strength(
+            y=y_mono, sr=sr, n_fft=ANALYSIS_N_FFT, hop_length=ANALYSIS_HOP_LENGTH
+        )
+        tempo_estimate, beat_frames = librosa.beat.beat_track(
+            onset_envelope=onset_envelope, sr=sr, hop_length=ANALYSIS_HOP_LENGTH, bpm=tempo, units='frames'
+        )
+        return librosa.frames_to_time(beat_frames, sr=sr, hop_length=ANALYSIS_HOP_LENGTH)
 
-    if not os.path.isdir(output_dir):
-        try:
-            os.makedirs(output_dir, exist_ok=True)
-            print(f"Created output directory at '{output_dir}'.")
-        except Exception as e:
-            print(f"Error: Cannot create output directory '{output_dir}'. {e}")
-            return
 
-    # Load audio file
-    print(f"Aligning Audio for {audio_file}...")
+# Measures of audio decoded before and after a requested excerpt for beat tracking
+WINDOW_MARGIN_MEASURES = 2
+
+# Measures decoded at the start of the file to find the first beat for excerpts
+HEAD_MEASURES = 4
+
+
+def get_audio_duration(audio_file: str) -> float:
+    """
+    Reads the duration of an audio file from its header when the format allows it.
+    """
     try:
-        y, sr = librosa.load(audio_file, sr=None)
-    except IOError:
-        print(f"Error: Cannot open audio file '{audio_file}'. Please check the file path.")
-        return
-    except Exception as e:
-        print(f"Error: {e}")
-        return
+        return sf.info(audio_file).duration
+    except Exception:
+        return librosa.get_duration(path=audio_file)
 
-    # Perform beat tracking to get beat times
-    tempo_estimate, beat_frames = librosa.beat.beat_track(y=y, sr=sr, bpm=tempo, units='frames')
-    beat_times = librosa.frames_to_time(beat_frames, sr=sr)
 
-    if len(beat_times) == 0:
-        print("Error: No beats found in the audio file.")
-        return
+def load_audio_window(audio_file: str, offset: float = 0.0, end: float = None):
+    """
+    Decodes part of an audio file at its native sample rate and channel layout.
 
-    # Calculate downbeat times (every 4 beats assuming 4/4 time signature)
-    downbeat_indices = np.arange(0, len(beat_times), 4)
-    downbeat_times = beat_times[downbeat_indices]
+    Formats supported by soundfile are read by seeking to the first frame, so only the
+    requested window is decoded. Other formats fall back to librosa's decoder.
 
-    # Total duration of the audio
-    total_duration = librosa.get_duration(y=y, sr=sr)
+    Parameters:
+    - audio_file (str): Path to the input audio file.
+    - offset (float): Start of the window in seconds.
+    - end (float, optional): End of the window in seconds, or None for the end of the file.
 
-    # Generate expected measure start times
+    Returns:
+    - tuple: The audio as a (channels, samples) or (samples,) array, and its sample rate.
+    """
+    with timed("decode"):
+        try:
+            with sf.SoundFile(audio_file) as f:
+                sr = f.samplerate
+                f.seek(min(int(offset * sr), f.frames))
+                frames = -1 if end is None else max(0, int((end - offset) * sr))
+                y = f.read(frames, dtype='float32', always_2d=True).T
+            return (y[0] if len(y) == 1 else y), sr
+        except RuntimeError:
+            duration = None if end is None else end - offset
+            return librosa.load(audio_file, sr=None, mono=False, offset=offset, duration=duration)
+
+
+# Beat grids keyed by (audio hash, tempo)
+beat_grid_cache = LRUCache(max_entries=int(os.environ.get("BEAT_GRID_CACHE_SIZE", 64)))
+
+
+def _analysis_window(total_duration, measure_duration, start_time, end_time):
+    """Returns the (start, end) seconds to analyze for an excerpt, end being None for the end of the file."""
+    if start_time is None:
+        return 0.0, None
+    margin = WINDOW_MARGIN_MEASURES * measure_duration
+    window_start = max(0.0, np.floor((min(start_time, total_duration) - margin) / measure_duration) * measure_duration)
+    window_end = None
+    if end_time is not None and start_time < end_time < total_duration - margin:
+        window_end = end_time + margin
+    return window_start, window_end
+
+
+def _grid_covers(grid, window_start, window_end):
+    window_end = grid['duration'] if window_end is None else window_end
+    return grid['analysis_start'] <= window_start and grid['analysis_end'] >= window_end
+
+
+def _analyze_window(audio_file, tempo, total_duration, window_start, window_end):
+    """Tracks beats in a window of the file and returns the beat grid and the decoded window."""
     beat_duration = 60.0 / tempo  # seconds per beat
     measure_duration = beat_duration * 4  # seconds per measure
+
+    y, sr = load_audio_window(audio_file, window_start, window_end)
+
+    # Perform beat tracking on a low-rate mono copy of the window to get beat times
+    beat_times = track_beats(librosa.to_mono(y), sr, tempo) + window_start
+
+    # Calculate downbeat times (every 4 beats assuming 4/4 time signature)
+    if window_start > 0 and len(beat_times) > 0:
+        # Count beats from the first beat of the file, like when the whole file is tracked
+        head, head_sr = load_audio_window(audio_file, 0.0, min(window_start, HEAD_MEASURES * measure_duration))
+        head_beats = track_beats(librosa.to_mono(head), head_sr, tempo)
+        first_beat_time = head_beats[0] if len(head_beats) else beat_times[0]
+        beat_numbers = np.round((beat_times - first_beat_time) / beat_duration).astype(int)
+        downbeat_times = beat_times[beat_numbers % 4 == 0]
+        if len(downbeat_times) == 0:
+            downbeat_times = beat_times[::4]
+    else:
+        downbeat_indices = np.arange(0, len(beat_times), 4)
+        downbeat_times = beat_times[downbeat_indices]
+
+    grid = _make_grid(tempo, total_duration, window_start, window_end, beat_times, downbeat_times)
+    return grid, y, sr
+
+
+def _make_grid(tempo, total_duration, window_start, window_end, beat_times, downbeat_times):
+    # Generate expected measure start times
+    measure_duration = 60.0 / tempo * 4
     num_measures = int(np.ceil(total_duration / measure_duration))
     measure_times = np.arange(0, num_measures * measure_duration, measure_duration)
 
+    return {
+        'tempo': tempo,
+        'duration': total_duration,
+        'analysis_start': window_start,
+        'analysis_end': total_duration if window_end is None else window_end,
+        'beat_times': beat_times,
+        'downbeat_times': downbeat_times,
+        'measure_times': measure_times,
+    }
+
+
+def get_beat_grid(audio_file: str, tempo: int, start_time: float = None, end_time: float = None,
+                  audio_hash: str = None, analysis_signal: np.ndarray = None):
+    """
+    Computes the beat grid of an audio file, or returns it from the cache.
+
+    Parameters:
+    - audio_file (str): Path to the input audio file.
+    - tempo (float): Tempo in BPM.
+    - start_time (float, optional): Start of the excerpt of interest, to only analyze around it.
+    - end_time (float, optional): End of the excerpt of interest.
+    - audio_hash (str, optional): Content hash of the file, used as the cache key with the tempo.
+    - analysis_signal (np.ndarray, optional): The whole file already decoded to mono at
+      ANALYSIS_SAMPLE_RATE, e.g. while it was downloaded, so the file is not decoded again.
+
+    Returns:
+    - dict: The tempo, duration, analyzed range, and the beat, downbeat and measure times in seconds.
+    """
+    return _beat_grid_with_audio(audio_file, tempo, start_time, end_time, audio_hash, analysis_signal)[0]
+
+
+def _beat_grid_with_audio(audio_file, tempo, start_time, end_time, audio_hash, analysis_signal=None):
+    """Like get_beat_grid, but also returns the decoded window (None on a cache hit)."""
+    if analysis_signal is not None:
+        total_duration = len(analysis_signal) / ANALYSIS_SAMPLE_RATE
+    else:
+        total_duration = get_audio_duration(audio_file)
+    measure_duration = 60.0 / tempo * 4
+    window_start, window_end = _analysis_window(total_duration, measure_duration, start_time, end_time)
+
+    if audio_hash is not None:
+        grid = beat_grid_cache.get((audio_hash, tempo))
+        if grid is not None and _grid_covers(grid, window_start, window_end):
+            return grid, None
+
+    if analysis_signal is not None:
+        # The whole file is already decoded for analysis, so track beats on all of it
+        beat_times = track_beats(analysis_signal, ANALYSIS_SAMPLE_RATE, tempo)
+        grid = _make_grid(tempo, total_duration, 0.0, None, beat_times, beat_times[::4])
+        if audio_hash is not None:
+            beat_grid_cache.put((audio_hash, tempo), grid)
+        return grid, None
+
+    grid, y, sr = _analyze_window(audio_file, tempo, total_duration, window_start, window_end)
+    if audio_hash is not None:
+        cached = beat_grid_cache.get((audio_hash, tempo))
+        if cached is None or _grid_covers(grid, cached['analysis_start'], cached['analysis_end']):
+            beat_grid_cache.put((audio_hash, tempo), grid)
+    return grid, (y, sr, window_start)
+
+
+def find_trim_points(grid, start_time: float = None, end_time: float = None):
+    """
+    Finds the downbeat-aligned start and end of the trimmed audio.
+
+    Parameters:
+    - grid (dict): Beat grid from get_beat_grid.
+    - start_time (float, optional): Desired start time in seconds for trimming.
+    - end_time (float, optional): Desired end time in seconds for trimming.
+
+    Returns:
+    - tuple: Trim start and end in seconds, the end being None for the end of the audio.
+    """
+    beat_times = grid['beat_times']
+    downbeat_times = grid['downbeat_times']
+    measure_times = grid['measure_times']
+    total_duration = grid['duration']
+    measure_duration = 60.0 / grid['tempo'] * 4
+
+    if len(beat_times) == 0:
+        print("Error: No beats found in the audio file.")
+        return
+
     if start_time is not None:
         # Ensure start_time is within audio duration
         if start_time > total_duration:
@@ -84,6 +239,7 @@ def align_audio(audio_file: str, tempo: int, output_dir: str, start_time: float
             trim_time = downbeat_times[0]
 
         # Handle end_time if specified
+        trim_end = None
         if end_time is not None:
             if end_time > total_duration:
                 print("Warning: End time exceeds audio duration. Trimming to the end of the audio.")
@@ -95,58 +251,156 @@ def align_audio(audio_file: str, tempo: int, output_dir: str, start_time: float
             # Find the nearest downbeat time to the nearest_measure_end
             onset_near_end = downbeat_times[np.argmin(np.abs(downbeat_times - nearest_measure_end))]
 
-            # Ensure end_sample is after trim_time
+            # Ensure the end is after trim_time
             if onset_near_end <= trim_time:
                 print("Warning: End time is before or at the trim time. Trimming to the end of the audio.")
-                end_sample = len(y)
             else:
-                end_sample = int(onset_near_end * sr)
-        else:
-            # No end_time specified, trim to the end
-            end_sample = len(y)
+                trim_end = onset_near_end
 
-        # Calculate sample indices
-        start_sample = int(trim_time * sr)
+        return trim_time, trim_end
 
-        # Trim the audio
-        y_aligned = y[start_sample:end_sample]
+    # Original behavior: align first measure to the beginning
+    if len(downbeat_times) == 0:
+        print("Error: No downbeats found in the audio file.")
+        return
 
-        # Calculate trimmed time in seconds
-        trimmed_time = trim_time
+    # Take the first downbeat time
+    first_downbeat_time = downbeat_times[0]
+
+    # Calculate how much to trim to align the first downbeat with the start
+    trim_time = first_downbeat_time
+
+    # Handle edge cases where trim_time might be very close to measure_duration due to floating point precision
+    epsilon = 1e-3  # tolerance
+    if np.isclose(trim_time, measure_duration, atol=epsilon):
+        trim_time = 0
+        print("WARNING: Trim Time Is Zero. Audio alignment might not be accurate! ⚠️")
+    elif trim_time > measure_duration:
+        # This should not happen, but added as a safeguard
+        trim_time = measure_duration
+        print("WARNING: Maximum Value Was Trimmed. Audio alignment might not be accurate! ⚠️")
+
+    return trim_time, None
+
+
+def processed_audio_path(audio_file: str, output_dir: str) -> str:
+    """
+    Returns the path align_audio saves the processed audio to, `processed_<file name>`
+    in output_dir. Containers soundfile cannot write, like WebM or M4A, are saved as WAV.
+    """
+    base_name, extension = os.path.splitext(os.path.basename(audio_file))
+    if extension[1:].upper() not in sf.available_formats():
+        extension = '.wav'
+    return os.path.join(output_dir, f"processed_{base_name}{extension}")
+
+
+def get_trim_points(audio_file: str, tempo: int, start_time: float = None, end_time: float = None,
+                    audio_hash: str = None):
+    """
+    Computes where align_audio would cut the audio, without decoding or writing the output.
+
+    Parameters:
+    - audio_file (str): Path to the input audio file.
+    - tempo (float): Tempo in BPM.
+    - start_time (float, optional): Desired start time in seconds for trimming.
+    - end_time (float, optional): Desired end time in seconds for trimming.
+    - audio_hash (str, optional): Content hash of the file, to reuse a cached beat grid.
+
+    Returns:
+    - tuple: Trim start and end in seconds, the end being None for the end of the audio.
+    """
+    if not os.path.isfile(audio_file):
+        print(f"Error: Audio file '{audio_file}' does not exist.")
+        return
+
+    if tempo <= 0:
+        print("Error: Tempo must be a positive number.")
+        return
+
+    try:
+        grid = get_beat_grid(audio_file, tempo, start_time, end_time, audio_hash)
+    except Exception as e:
+        print(f"Error: {e}")
+        return
+
+    return find_trim_points(grid, start_time, end_time)
 
-    else:
-        # Original behavior: align first measure to the beginning
-        if len(downbeat_times) == 0:
-            print("Error: No downbeats found in the audio file.")
-            return
 
-        # Take the first downbeat time
-        first_downbeat_time = downbeat_times[0]
+def align_audio(audio_file: str, tempo: int, output_dir: str, start_time: float = None, end_time: float = None,
+                audio_hash: str = None, analysis_signal: np.ndarray = None):
+    """
+    Aligns the audio file so that it starts at the nearest downbeat,
+    or trims the audio based on provided start and end times aligned to downbeats.
+    Beats are tracked on a low-rate mono copy, while the trimmed output keeps the
+    original sample rate and channels. When a start time is given, only the excerpt
+    and a margin of a couple of measures around it are decoded and analyzed.
+
+    Parameters:
+    - audio_file (str): Path to the input audio file.
+    - tempo (float): Tempo in BPM.
+    - output_dir (str): Directory to save the aligned audio file.
+    - start_time (float, optional): Desired start time in seconds for trimming.
+    - end_time (float, optional): Desired end time in seconds for trimming.
+    - audio_hash (str, optional): Content hash of the file, to reuse a cached beat grid.
+    - analysis_signal (np.ndarray, optional): The whole file decoded to mono at ANALYSIS_SAMPLE_RATE,
+      to track beats without decoding the file again.
+
+    Returns:
+    - float: Number of seconds trimmed from the beginning.
+    """
+    # Validate input parameters
+    if not os.path.isfile(audio_file):
+        print(f"Error: Audio file '{audio_file}' does not exist.")
+        return
+
+    if tempo <= 0:
+        print("Error: Tempo must be a positive number.")
+        return
 
-        # Calculate how much to trim to align the first downbeat with the start
-        trim_time = first_downbeat_time
+    if not os.path.isdir(output_dir):
+        try:
+            os.makedirs(output_dir, exist_ok=True)
+            print(f"Created output directory at '{output_dir}'.")
+        except Exception as e:
+            print(f"Error: Cannot create output directory '{output_dir}'. {e}")
+            return
+
+    # Get the beat grid, which decodes only the excerpt and a margin around it
+    print(f"Aligning Audio for {audio_file}...")
+    try:
+        grid, decoded = _beat_grid_with_audio(audio_file, tempo, start_time, end_time, audio_hash, analysis_signal)
+    except IOError:
+        print(f"Error: Cannot open audio file '{audio_file}'. Please check the file path.")
+        return
+    except Exception as e:
+        print(f"Error: {e}")
+        return
 
-        # Handle edge cases where trim_time might be very close to measure_duration due to floating point precision
-        epsilon = 1e-3  # tolerance
-        if np.isclose(trim_time, measure_duration, atol=epsilon):
-            trim_time = 0
-            print("WARNING: Trim Time Is Zero. Audio alignment might not be accurate! ⚠️")
-        elif trim_time > measure_duration:
-            # This should not happen, but added as a safeguard
-            trim_time = measure_duration
-            print("WARNING: Maximum Value Was Trimmed. Audio alignment might not be accurate! ⚠️")
+    trim_points = find_trim_points(grid, start_time, end_time)
+    if trim_points is None:
+        return
+    trim_time, trim_end = trim_points
 
-        # Calculate sample index to trim
-        sample_to_trim = int(trim_time * sr)
+    # Trim the audio, reusing the decoded window when it covers the trimmed range
+    try:
+        if decoded is not None and _grid_covers(grid, trim_time, trim_end):
+            y, sr, window_start = decoded
+            start_sample = int((trim_time - window_start) * sr)
+            end_sample = None if trim_end is None else int((trim_end - window_start) * sr)
+            y_aligned = y[..., start_sample:end_sample]
+        else:
+            y_aligned, sr = load_audio_window(audio_file, trim_time, trim_end)
+    except Exception as e:
+        print(f"Error: {e}")
+        return
 
-        # Trim the audio
-        y_aligned = y[sample_to_trim:]
-        trimmed_time = trim_time
+    # Calculate trimmed time in seconds
+    trimmed_time = trim_time
 
     # Save the aligned audio file
-    output_file = os.path.join(output_dir, f"processed_{os.path.basename(audio_file)}")
+    output_file = processed_audio_path(audio_file, output_dir)
     try:
-        sf.write(output_file, y_aligned, sr)
+        sf.write(output_file, y_aligned.T, sr)
         print(f"Aligned audio saved to '{output_file}'.")
     except IOError:
         print(f"Error: Cannot save audio file to '{output_file}'. Please check the output directory permissions.")
@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+from functools import partial
+
+from mido import MetaMessage
+
+from moseca.api.midi_events import MidiEvents
+from moseca.api.midi_pipeline import MidiPipeline
+
+
+def key_signature_events(events: MidiEvents, midi_key: str) -> MidiEvents:
+    key_meta = MetaMessage('key_signature', key=midi_key, time=0)
+    text_meta = MetaMessage('text', text=f"Key: {midi_key}", time=0)
+
+    # Insert the key signature at the beginning of the first track
+    if events.num_tracks != 0:
+        print(f"Appending key signature of {midi_key} to file")
+        return events.with_meta(events.array, [key_meta, text_meta], 0, 0)
+    else:
+        print("Error: Midi File has no Tracks!")
+        return events
+
+
+def append_key_signature(midi_path: str, midi_key: str):
+    # Save the modified MIDI to a temporary file
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.mid') as tmp_file:
+        temp_path = tmp_file.name
+    if MidiPipeline([partial(key_signature_events, midi_key=midi_key)]).run(midi_path, temp_path) is None:
+        print("Error: Unable to save to temporary file.")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return
+
+    # Replace the original MIDI file with the temporary file
+    try:
+        os.replace(temp_path, midi_path)
+        print(f"Successfully added key signature '{midi_key}' to '{midi_path}'.")
+    except OSError as e:
+        print(f"Error: Unable to overwrite the original MIDI file. {e}")
+        # Clean up the temporary file in case of failure
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('Usage: python append_key_signature.py input_midi_file.mid key')
+    else:
+        append_key_signature(sys.argv[1], sys.argv[2])
@@ -0,0 +1,338 @@
+import mmap
+import os
+import sys
+import soundfile as sf
+from moseca.api.align_audio import load_audio_window
+
+
+# Containers holding raw or losslessly compressed PCM, where samples can be copied exactly
+EXACT_CUT_FORMATS = {'WAV', 'WAVEX', 'W64', 'RF64', 'AIFF', 'CAF', 'FLAC'}
+
+# Containers cut on frame boundaries by copying the compressed stream
+FRAME_CUT_EXTENSIONS = {'.mp3'}
+
+# Frames copied per read when cutting PCM files
+BLOCK_FRAMES = 1 << 16
+
+
+def cut_exact(audio_file: str, output_file: str, trim_start: float, trim_end: float = None):
+    """
+    Copies the samples between trim_start and trim_end into a file with the same
+    format, subtype, sample rate and channels. Samples are read as integers for
+    integer subtypes, so the cut is bit-exact.
+
+    Returns:
+        tuple: The start and end of the cut in seconds, rounded to samples.
+    """
+    with sf.SoundFile(audio_file) as f:
+        dtype = {'FLOAT': 'float32', 'DOUBLE': 'float64'}.get(f.subtype, 'int32')
+        start = min(int(round(trim_start * f.samplerate)), f.frames)
+        stop = f.frames if trim_end is None else min(int(round(trim_end * f.samplerate)), f.frames)
+        f.seek(start)
+        with sf.SoundFile(output_file, 'w', samplerate=f.samplerate, channels=f.channels,
+                          format=f.format, subtype=f.subtype, endian=f.endian) as out:
+            remaining = max(0, stop - start)
+            while remaining > 0:
+                block = f.read(min(BLOCK_FRAMES, remaining), dtype=dtype, always_2d=True)
+                if len(block) == 0:
+                    break
+                out.write(block)
+                remaining -= len(block)
+    return start / f.samplerate, None if trim_end is None else stop / f.samplerate
+
+
+# Bitrates in kbps of Layer III by bitrate index, for MPEG-1 and for MPEG-2 and 2.5
+MP3_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# Sample rates by the version bits of the header (3: MPEG-1, 2: MPEG-2, 0: MPEG-2.5)
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+# Samples of delay added by MP3 decoders, which gapless decoders skip on top of the
+# encoder delay of the LAME header
+MP3_DECODER_DELAY = 529
+
+# Largest encoder delay and padding of a LAME header, 12 bits each
+MAX_LAME_DELAY = 4095
+
+# Encoder names starting a LAME header, as written by LAME and by FFmpeg
+LAME_TAGS = (b'LAME', b'Lavf', b'Lavc')
+# Frames a cut may start earlier by for the bit reservoir before falling back to re-encoding
+MAX_RESERVOIR_FRAMES = 8
+
+
+def _parse_mp3_header(data: bytes) -> dict:
+    """Parses a Layer III frame header, and returns None if the bytes are not one."""
+    if len(data) < 4:
+        return None
+    header = int.from_bytes(data[:4], 'big')
+    version = (header >> 19) & 3
+    bitrate_index = (header >> 12) & 15
+    sample_rate_index = (header >> 10) & 3
+    if (header >> 21) != 0x7FF or version == 1 or (header >> 17) & 3 != 1 \
+            or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    bitrate = MP3_BITRATES[1 if mpeg1 else 2][bitrate_index] * 1000
+    mono = (header >> 6) & 3 == 3
+    return {
+        'header': header,
+        'sample_rate': sample_rate,
+        'samples': 1152 if mpeg1 else 576,
+        'size': (144 if mpeg1 else 72) * bitrate // sample_rate + ((header >> 9) & 1),
+        # Bytes of the header, of its CRC and of the side information
+        'side_info_end': 4 + (0 if (header >> 16) & 1 else 2) + ((17 if mono else 32) if mpeg1 else (9 if mono else 17)),
+        'mpeg1': mpeg1,
+    }
+
+
+def _main_data_begin(data: bytes, header: dict) -> int:
+    """Bytes of main data the frame takes from the frames before it (the bit reservoir)."""
+    side_info = 4 + (0 if (header['header'] >> 16) & 1 else 2)
+    value = int.from_bytes(data[side_info:side_info + 2], 'big')
+    return value >> 7 if header['mpeg1'] else value >> 8
+
+
+def _id3v2_size(data: bytes) -> int:
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+
+def _parse_info_frame(frame: bytes, header: dict) -> dict:
+    """Returns the fields of a Xing/Info frame and of its LAME header, or None for an audio frame."""
+    offset = header['side_info_end']
+    tag = frame[offset:offset + 4]
+    if tag not in (b'Xing', b'Info'):
+        return None
+    flags = int.from_bytes(frame[offset + 4:offset + 8], 'big')
+    lame_offset = offset + 8 + (4 if flags & 1 else 0) + (4 if flags & 2 else 0) \
+        + (100 if flags & 4 else 0) + (4 if flags & 8 else 0)
+    quality = frame[lame_offset - 4:lame_offset] if flags & 8 else bytes(4)
+    info = {'tag': tag, 'quality': quality, 'lame': None, 'delay': 0, 'padding': 0}
+    lame = frame[lame_offset:lame_offset + 36]
+    if len(lame) == 36 and lame[:4] in LAME_TAGS:
+        delay_padding = int.from_bytes(lame[21:24], 'big')
+        info.update(lame=lame, delay=delay_padding >> 12, padding=delay_padding & 0xFFF)
+    return info
+
+
+def _crc16(data: bytes) -> int:
+    """CRC-16 with polynomial 0x8005, reflected, as in the LAME header."""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def _build_info_frame(first_header: dict, info: dict, frame_count: int, frame_offsets: list,
+                      audio_bytes: int, delay: int, padding: int) -> bytes:
+    """Builds a Xing/Info frame with a LAME header for the frames of a cut."""
+    side_info_end = first_header['side_info_end'] - (2 if not (first_header['header'] >> 16) & 1 else 0)
+    needed = side_info_end + 8 + 4 + 4 + 100 + 4 + 36
+    # Same header as the first audio frame, without CRC and padding, with the smallest bitrate that fits
+    base = (first_header['header'] | (1 << 16)) & ~(1 << 9) & ~(15 << 12)
+    for bitrate_index in range(1, 15):
+        header = _parse_mp3_header((base | (bitrate_index << 12)).to_bytes(4, 'big'))
+        if header['size'] >= needed:
+            break
+    size = header['size']
+    total_bytes = size + audio_bytes
+
+    # Byte position of every percent of the duration, in 256ths of the file
+    toc = bytes(
+        min(255, (size + frame_offsets[min(len(frame_offsets) - 1, frame_count * i // 100)]) * 256 // total_bytes)
+        for i in range(100)
+    )
+    lame = bytearray(info['lame'] if info and info['lame'] else b'LAME3.100'.ljust(36, b'\0'))
+    lame[21:24] = ((delay << 12) | padding).to_bytes(3, 'big')
+    lame[28:32] = total_bytes.to_bytes(4, 'big')
+    # The CRC of the audio data is not checked by decoders, and would mean reading all of it here
+    lame[32:34] = bytes(2)
+
+    frame = bytearray(header['header'].to_bytes(4, 'big'))
+    frame += bytes(side_info_end - 4)
+    frame += (info['tag'] if info else b'Info') + (15).to_bytes(4, 'big')
+    frame += frame_count.to_bytes(4, 'big') + total_bytes.to_bytes(4, 'big') + toc
+    frame += info['quality'] if info else bytes(4)
+    frame += lame[:34]
+    frame += _crc16(bytes(frame)).to_bytes(2, 'big')
+    return bytes(frame.ljust(size, b'\0'))
+
+
+def _scan_mp3(audio_file: str):
+    """
+    Returns the ID3v2 tag, the Info frame fields and the offset, size, main data begin and
+    main data size of every audio frame of an MP3 file.
+    """
+    with open(audio_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return _scan_mp3_data(data)
+
+
+def _scan_mp3_data(data) -> tuple:
+    offset = _id3v2_size(data[:10])
+    first = _parse_mp3_header(data[offset:offset + 4])
+    if first is None:
+        raise ValueError('No MP3 frame at the start of the audio data')
+
+    info = _parse_info_frame(data[offset:offset + first['size']], first)
+    id3 = bytes(data[:offset])
+    if info is not None:
+        offset += first['size']
+    frames = []
+    while offset < len(data):
+        header = _parse_mp3_header(data[offset:offset + 4])
+        # Stop at trailing tags, or at a frame of another stream
+        if header is None or header['sample_rate'] != first['sample_rate'] or offset + header['size'] > len(data):
+            break
+        frames.append((offset, header['size'], _main_data_begin(data[offset:offset + 8], header),
+                       header['size'] - header['side_info_end']))
+        offset += header['size']
+    if not frames:
+        raise ValueError('The MP3 file has no audio frames')
+    return id3, first, info, frames
+
+
+def _decodable(frames: list, first_frame: int, first_needed: int, max_main_data_begin: int) -> bool:
+    """Returns whether the frames from first_needed on only take bits from frames from first_frame on."""
+    available = 0
+    for index in range(first_frame, len(frames)):
+        _, _, main_data_begin, main_data_size = frames[index]
+        if index >= first_needed and main_data_begin > available:
+            return False
+        if available >= max_main_data_begin:
+            # No later frame can reach back before first_frame
+            return True
+        available += main_data_size
+    return True
+
+
+def cut_frames(audio_file: str, output_file: str, trim_start: float, trim_end: float = None):
+    """
+    Cuts an MP3 file by copying whole frames, without re-encoding, and writes a LAME header
+    whose encoder delay and padding make gapless decoders skip the samples outside the cut,
+    so the decoded audio starts and ends on the requested samples. A few frames before the
+    start are kept for the decoder to warm up, within the 12-bit delay of the header; when
+    the bit reservoir needs more of them, the cut starts earlier.
+
+    Returns:
+        tuple: The start and end of the decoded cut in seconds in the input, which differ from
+        the requested times when the cut is clamped to the audio or starts earlier for the
+        bit reservoir. The end is None when the audio is kept until the end.
+    """
+    id3, first, info, frames = _scan_mp3(audio_file)
+    samples, sample_rate = first['samples'], first['sample_rate']
+
+    # Positions in the decoder output of the input, where gapless decoding starts and ends
+    if info is not None and info['lame'] is not None:
+        valid_start = info['delay'] + MP3_DECODER_DELAY
+        valid_end = len(frames) * samples - info['padding'] + MP3_DECODER_DELAY
+    else:
+        valid_start, valid_end = 0, len(frames) * samples
+    start = min(max(valid_start + int(round(trim_start * sample_rate)), valid_start), valid_end)
+    end = valid_end if trim_end is None else \
+        min(max(valid_start + int(round(trim_end * sample_rate)), start), valid_end)
+
+    # Keep as many frames before the start as the header can skip. The frames the first
+    # samples are decoded from, and the one before them for the overlap of the transform,
+    # must not take bits from the bit reservoir of dropped frames: when they do, keep earlier
+    # frames and start the cut earlier, as the delay is limited
+    max_main_data_begin = 511 if first['mpeg1'] else 255
+    first_frame = max(0, -(-(start - MP3_DECODER_DELAY - MAX_LAME_DELAY) // samples))
+    for _ in range(MAX_RESERVOIR_FRAMES):
+        if first_frame == 0 or _decodable(frames, first_frame, max(0, start // samples - 1), max_main_data_begin):
+            break
+        first_frame -= 1
+        start = min(start, first_frame * samples + MP3_DECODER_DELAY + MAX_LAME_DELAY)
+    else:
+        raise ValueError("the bit reservoir reaches further back than the LAME header can skip")
+    delay = start - MP3_DECODER_DELAY - first_frame * samples
+    if delay < 0:
+        # Within the decoder delay of a file without gapless information
+        start -= delay
+        end = max(end, start)
+        delay = 0
+    last_frame = min(len(frames), max(first_frame + 1, -(-end // samples)))
+    kept = frames[first_frame:last_frame]
+    padding = min(MAX_LAME_DELAY, max(0, len(kept) * samples + MP3_DECODER_DELAY - (end - first_frame * samples)))
+
+    frame_offsets = [frame[0] - kept[0][0] for frame in kept]
+    audio_bytes = kept[-1][0] + kept[-1][1] - kept[0][0]
+    with open(audio_file, 'rb') as f, open(output_file, 'wb') as out:
+        out.write(id3)
+        out.write(_build_info_frame(first, info, len(kept), frame_offsets, audio_bytes, delay, padding))
+        f.seek(kept[0][0])
+        remaining = audio_bytes
+        while remaining > 0:
+            chunk = f.read(min(1 << 20, remaining))
+            if not chunk:
+                break
+            out.write(chunk)
+            remaining -= len(chunk)
+
+    return (start - valid_start) / sample_rate, None if trim_end is None else (end - valid_start) / sample_rate
+
+
+def cut_reencoded(audio_file: str, output_file: str, trim_start: float, trim_end: float = None):
+    """Decodes only the trimmed range and encodes it again, like align_audio does."""
+    y, sr = load_audio_window(audio_file, trim_start, trim_end)
+    sf.write(output_file, y.T, sr)
+
+
+def cut_audio(audio_file: str, output_file: str, trim_start: float, trim_end: float = None):
+    """
+    Cuts an audio file between two times, losslessly where the container allows it.
+
+    WAV, AIFF and FLAC files are cut exactly on samples. MP3 files are cut on frame
+    boundaries without re-encoding, with a LAME header making gapless decoders start and
+    end on the requested samples. Any other format is decoded and encoded again.
+
+    Parameters:
+    - audio_file (str): Path to the input audio file.
+    - output_file (str): Path of the cut audio file, with the same extension as the input.
+    - trim_start (float): Start of the cut in seconds.
+    - trim_end (float, optional): End of the cut in seconds, or None for the end of the file.
+
+    Returns:
+    - tuple: How the file was cut, 'exact', 'frame' or 'reencoded', and the start and end
+      in seconds where the decoded cut lands in the input, the end being None for the end
+      of the file. None on error.
+    """
+    try:
+        audio_format = sf.info(audio_file).format
+    except Exception:
+        audio_format = None
+
+    try:
+        if audio_format in EXACT_CUT_FORMATS:
+            return ('exact', *cut_exact(audio_file, output_file, trim_start, trim_end))
+
+        if os.path.splitext(audio_file)[1].lower() in FRAME_CUT_EXTENSIONS:
+            try:
+                return ('frame', *cut_frames(audio_file, output_file, trim_start, trim_end))
+            except (OSError, ValueError) as e:
+                print(f"Warning: Cannot cut '{audio_file}' without re-encoding, re-encoding instead. {e}")
+
+        cut_reencoded(audio_file, output_file, trim_start, trim_end)
+        return 'reencoded', trim_start, trim_end
+    except IOError:
+        print(f"Error: Cannot save audio file to '{output_file}'. Please check the output directory permissions.")
+    except Exception as e:
+        print(f"Error: {e}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or len(sys.argv) > 5:
+        print('Usage: python audio_cut.py input_audio_file output_audio_file trim_start [trim_end]')
+    else:
+        cut = cut_audio(sys.argv[1], sys.argv[2], float(sys.argv[3]),
+                        float(sys.argv[4]) if len(sys.argv) > 4 else None)
+        if cut is not None:
+            mode, start, end = cut
+            print(f"Cut audio saved to '{sys.argv[2]}' ({mode}, from {start:.6f}s"
+                  f"{f' to {end:.6f}s' if end is not None else ''}).")
@@ -0,0 +1,169 @@
+"""
+Serves a job broker over HTTP, so that API nodes and workers on other hosts can share it
+through HTTPBroker. The broker itself is a SQLite database on the disk of this host.
+
+Every request must carry the token in an "Authorization: Bearer" header, since the jobs
+are pickled and run by the workers.
+
+Usage: JOB_BROKER_TOKEN=... python -m moseca.api.broker_server --broker sqlite:///data/jobs.db
+           [--host 0.0.0.0] [--port 8100]
+
+API nodes and workers then use JOB_BROKER=http://<host>:8100 with the same JOB_BROKER_TOKEN.
+"""
+import argparse
+import asyncio
+import base64
+import hmac
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+
+from moseca.api.service.broker import (
+    DEFAULT_LEASE_SECONDS, Broker, broker_from_url, read_job_archive, write_job_archive
+)
+
+# Kinds of files of a job
+FILE_KINDS = ("input", "output")
+
+
+class ClaimRequest(BaseModel):
+    worker_id: str
+    job_types: Optional[List[str]] = None
+    lease_seconds: float = DEFAULT_LEASE_SECONDS
+
+
+class FailRequest(BaseModel):
+    error: str
+
+
+async def _receive_archive(request: Request, directory: Path):
+    """Saves the tar body of a request to a directory, and returns its values and files by name."""
+    archive_path = directory / "body.tar"
+    with open(archive_path, "wb") as f:
+        async for chunk in request.stream():
+            f.write(chunk)
+
+    def read():
+        with open(archive_path, "rb") as f:
+            values, names = read_job_archive(f, lambda name: directory / "files" / name)
+        return values, {name: str(directory / "files" / name) for name in names}
+
+    try:
+        return await asyncio.to_thread(read)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid job archive: {e}")
+
+
+def create_broker_app(broker: Broker, token: str) -> FastAPI:
+    """
+    Creates the HTTP API of a broker, answering the requests of HTTPBroker.
+
+    Args:
+        broker (Broker): The broker to serve, usually a SQLiteBroker.
+        token (str): The token every request must carry.
+    """
+    if not token:
+        raise ValueError("The broker server needs a token")
+
+    def authorize(request: Request):
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            raise HTTPException(status_code=401, detail="Invalid token")
+
+    app = FastAPI(dependencies=[Depends(authorize)])
+
+    @app.post("/jobs")
+    async def enqueue(job_type: str, request: Request):
+        directory = Path(tempfile.mkdtemp(prefix="broker-"))
+        try:
+            values, files = await _receive_archive(request, directory)
+            if "payload" not in values:
+                raise HTTPException(status_code=400, detail="The job has no payload")
+            job_id = await asyncio.to_thread(broker.enqueue, job_type, values["payload"], files)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return {"job_id": job_id}
+
+    @app.post("/claim")
+    async def claim(body: ClaimRequest):
+        claimed = await asyncio.to_thread(broker.claim, body.worker_id, body.job_types, body.lease_seconds)
+        if claimed is None:
+            return {"job": None}
+        job_id, job_type, payload = claimed
+        return {"job": {"job_id": job_id, "job_type": job_type, "payload": base64.b64encode(payload).decode()}}
+
+    @app.get("/jobs/{job_id}/files/{kind}")
+    async def download_files(job_id: str, kind: str):
+        if kind not in FILE_KINDS:
+            raise HTTPException(status_code=404, detail=f"Unknown file kind: {kind}")
+        directory = Path(tempfile.mkdtemp(prefix="broker-"))
+
+        def pack():
+            names = broker.download_files(job_id, kind, lambda name: directory / "files" / name)
+            with open(directory / "files.tar", "wb") as f:
+                write_job_archive(f, {}, {name: str(directory / "files" / name) for name in names})
+
+        try:
+            await asyncio.to_thread(pack)
+        except BaseException:
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        return FileResponse(
+            directory / "files.tar", media_type="application/x-tar",
+            background=BackgroundTask(shutil.rmtree, directory, ignore_errors=True),
+        )
+
+    @app.post("/jobs/{job_id}/complete")
+    async def complete(job_id: str, request: Request):
+        directory = Path(tempfile.mkdtemp(prefix="broker-"))
+        try:
+            values, files = await _receive_archive(request, directory)
+            await asyncio.to_thread(broker.complete, job_id, values.get("result"), files)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        return {}
+
+    @app.post("/jobs/{job_id}/fail")
+    async def fail(job_id: str, body: FailRequest):
+        await asyncio.to_thread(broker.fail, job_id, body.error)
+        return {}
+
+    @app.get("/jobs/{job_id}")
+    async def poll(job_id: str):
+        status, result, error = await asyncio.to_thread(broker.poll, job_id)
+        return {
+            "status": status,
+            "result": None if result is None else base64.b64encode(result).decode(),
+            "error": error,
+        }
+
+    @app.delete("/jobs/{job_id}")
+    async def delete(job_id: str):
+        await asyncio.to_thread(broker.delete, job_id)
+        return {}
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve a job broker to API nodes and workers on other hosts.")
+    parser.add_argument("--broker", default="sqlite:///data/jobs.db", help="Broker URL, like sqlite:///data/jobs.db.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    token = os.environ.get("JOB_BROKER_TOKEN")
+    if not token:
+        parser.error("set JOB_BROKER_TOKEN, which the API nodes and workers must send")
+    if not args.broker.startswith("sqlite:///"):
+        parser.error("the served broker must be a SQLite broker, like sqlite:///data/jobs.db")
+
+    uvicorn.run(create_broker_app(broker_from_url(args.broker), token), host=args.host, port=args.port)
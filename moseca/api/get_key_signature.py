@@ -6,71 +6,166 @@ import numpy as np
 import os
 import sys
 
-def detect_key(file_path):
+# Krumhansl-Schmuckler key profiles
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38,
+                          4.09, 2.52, 5.19, 2.39, 3.66,
+                          2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60,
+                          3.53, 2.54, 4.75, 3.98, 2.69,
+                          3.34, 3.17])
+
+PITCH_CLASSES = ['C', 'C#', 'D', 'Eb', 'E', 'F',
+                 'F#', 'G', 'Ab', 'A', 'Bb', 'B']
+
+# Fast mode analysis settings
+FAST_SAMPLE_RATE = 11025
+FAST_N_FFT = 2048
+FAST_HOP_LENGTH = 1024
+
+
+class KeyDetectionError(Exception):
+    """Raised when the audio of a file cannot be read or analyzed for its key."""
+
+
+def _zscore(x, axis=-1):
+    x = x - x.mean(axis=axis, keepdims=True)
+    std = x.std(axis=axis, keepdims=True)
+    return x / np.where(std > 0, std, 1.0)
+
+
+# Rows 0-11 are the major profile rotated to each tonic, rows 12-23 the minor profile.
+# Correlating chroma shifted by -i against a profile is the same as correlating the
+# unshifted chroma against the profile rotated by +i, so every key is one row here.
+KEY_TEMPLATES = _zscore(np.stack(
+    [np.roll(MAJOR_PROFILE, i) for i in range(12)] + [np.roll(MINOR_PROFILE, i) for i in range(12)]
+))
+
+
+def key_correlations(chroma_avg):
     """
-    Analyzes an audio file and determines its musical key.
+    Computes the Pearson correlation of a 12-bin chroma vector against all 24 keys at once.
 
     Parameters:
-        file_path (str): Path to the audio file.
+        chroma_avg (np.ndarray): Average chroma energy per pitch class.
 
     Returns:
-        dict: A dictionary containing the detected key, scale, and strength.
+        np.ndarray: 24 correlations, major keys C..B followed by minor keys C..B.
     """
+    return KEY_TEMPLATES @ _zscore(np.asarray(chroma_avg, dtype=float)) / 12
+
+
+def _key_result(correlations):
+    order = np.argsort(correlations)
+    best, runner_up = order[-1], order[-2]
+    return {
+        'key': PITCH_CLASSES[best % 12],
+        'mode': 'Major' if best < 12 else 'Minor',
+        'strength': float(correlations[best]),
+        'margin': float(correlations[best] - correlations[runner_up]),
+    }
+
+
+def _spread_order(count):
+    """Orders window indices so that every prefix is spread evenly across the track."""
+    bits = max(1, int(np.ceil(np.log2(max(count, 2)))))
+
+    def bit_reverse(i):
+        return int(format(i, f'0{bits}b')[::-1], 2)
+
+    return sorted(range(count), key=bit_reverse)
+
+
+def _load_audio(file_path, **kwargs):
     try:
-        # Load the audio file
-        y, sr = librosa.load(file_path)
-    except FileNotFoundError:
-        print(f"Error: The file '{file_path}' was not found.", file=sys.stderr)
-        sys.exit(1)
+        return librosa.load(file_path, **kwargs)
+    except FileNotFoundError as e:
+        raise KeyDetectionError(f"The file '{file_path}' was not found.") from e
     except librosa.util.exceptions.ParameterError as e:
-        print(f"Error loading audio file: {e}", file=sys.stderr)
-        sys.exit(1)
+        raise KeyDetectionError(f"Error loading audio file: {e}") from e
     except Exception as e:
-        print(f"An unexpected error occurred while loading the audio file: {e}", file=sys.stderr)
-        sys.exit(1)
+        raise KeyDetectionError(f"An unexpected error occurred while loading the audio file: {e}") from e
+
+
+def _detect_key_fast(file_path, analysis_budget, window_duration, stable_windows):
+    try:
+        total_duration = librosa.get_duration(path=file_path)
+    except Exception as e:
+        raise KeyDetectionError(f"An unexpected error occurred while reading the audio file: {e}") from e
+
+    if total_duration <= 0:
+        raise KeyDetectionError(f"The file '{file_path}' contains no audio.")
+
+    # Spread the analysis budget over evenly spaced windows across the track
+    window_duration = min(window_duration, total_duration)
+    num_windows = max(1, min(int(analysis_budget // window_duration),
+                             int(total_duration // window_duration)))
+    window_starts = np.linspace(0, max(total_duration - window_duration, 0), num_windows)
+
+    chroma_sum = np.zeros(12)
+    frame_count = 0
+    best_key, stable_count = None, 0
+    result = None
+    for window_idx in _spread_order(num_windows):
+        y, sr = _load_audio(file_path, sr=FAST_SAMPLE_RATE,
+                            offset=float(window_starts[window_idx]), duration=window_duration)
+        if len(y) == 0:
+            continue
+
+        # STFT chroma at a low sample rate is far cheaper than a full resolution CQT
+        chroma = librosa.feature.chroma_stft(y=y, sr=sr, n_fft=FAST_N_FFT,
+                                             hop_length=FAST_HOP_LENGTH)
+        chroma_sum += chroma.sum(axis=1)
+        frame_count += chroma.shape[1]
+
+        result = _key_result(key_correlations(chroma_sum / frame_count))
+        key = (result['key'], result['mode'])
+        stable_count = stable_count + 1 if key == best_key else 1
+        best_key = key
+
+        # Stop early once the top key has held for enough consecutive windows
+        if stable_count >= stable_windows:
+            break
+
+    if result is None:
+        raise KeyDetectionError(f"No audio could be analyzed in '{file_path}'.")
+
+    return result
+
+
+def detect_key(file_path, fast=False, analysis_budget=60.0, window_duration=5.0, stable_windows=4):
+    """
+    Analyzes an audio file and determines its musical key.
+
+    Parameters:
+        file_path (str): Path to the audio file.
+        fast (bool): Analyze a subset of windows with STFT chroma instead of the whole track.
+        analysis_budget (float): Maximum seconds of audio to analyze in fast mode.
+        window_duration (float): Length in seconds of each analysis window in fast mode.
+        stable_windows (int): Stop in fast mode once the top key is unchanged for this many windows.
+
+    Returns:
+        dict: A dictionary containing the detected key, scale, strength and the margin
+              between the strongest and second strongest key.
+
+    Raises:
+        KeyDetectionError: If the audio cannot be read or contains nothing to analyze.
+    """
+    if fast:
+        return _detect_key_fast(file_path, analysis_budget, window_duration, stable_windows)
+
+    # Load the audio file
+    y, sr = _load_audio(file_path)
 
     # Compute chromagram using constant-Q transform
     chroma = librosa.feature.chroma_cqt(y=y, sr=sr)
     chroma_avg = np.mean(chroma, axis=1)
 
-    # Define key profiles (Krumhansl-Schmuckler)
-    major_profile = np.array([6.35, 2.23, 3.48, 2.33, 4.38,
-                              4.09, 2.52, 5.19, 2.39, 3.66,
-                              2.29, 2.88])
-    minor_profile = np.array([6.33, 2.68, 3.52, 5.38, 2.60,
-                              3.53, 2.54, 4.75, 3.98, 2.69,
-                              3.34, 3.17])
-
-    # Normalize profiles
-    major_profile /= major_profile.sum()
-    minor_profile /= minor_profile.sum()
-    chroma_avg /= chroma_avg.sum()
-
-    correlations = []
-    for i in range(12):
-        # Circular shift chroma
-        chroma_shifted = np.roll(chroma_avg, -i)
-        # Compute Pearson correlation coefficients
-        major_corr = np.corrcoef(chroma_shifted, major_profile)[0, 1]
-        minor_corr = np.corrcoef(chroma_shifted, minor_profile)[0, 1]
-        # Determine whether major or minor correlation is stronger
-        if major_corr > minor_corr:
-            correlations.append((i, 'Major', major_corr))
-        else:
-            correlations.append((i, 'Minor', minor_corr))
-
-    # Select the key with the highest correlation
-    key_idx, mode, strength = max(correlations, key=lambda x: x[2])
-    pitch_classes = ['C', 'C#', 'D', 'Eb', 'E', 'F',
-                     'F#', 'G', 'Ab', 'A', 'Bb', 'B']
-    key = pitch_classes[key_idx]
-
-    return {'key': key, 'mode': mode, 'strength': strength}
+    return _key_result(key_correlations(chroma_avg))
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print('Usage: python align_audio.py input_audio_file.wav')
+    if len(sys.argv) not in (2, 3) or (len(sys.argv) == 3 and sys.argv[2] != '--fast'):
+        print('Usage: python get_key_signature.py input_audio_file.wav [--fast]')
     else:
         input_file = sys.argv[1]
         # Check if the file exists
@@ -85,5 +180,10 @@ if __name__ == '__main__':
                 f"Warning: The file extension is not among the commonly supported formats ({', '.join(supported_formats)}). Proceeding with detection.",
                 file=sys.stderr)
 
-        key_info = detect_key(input_file)
-        print(f"Key: {key_info['key']}, Mode: {key_info['mode']}, Strength: {key_info['strength']:.2f}")
+        try:
+            key_info = detect_key(input_file, fast=len(sys.argv) == 3)
+        except KeyDetectionError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        print(f"Key: {key_info['key']}, Mode: {key_info['mode']}, Strength: {key_info['strength']:.2f}, "
+              f"Margin: {key_info['margin']:.2f}")
@@ -1,44 +1,150 @@
 from fastapi import FastAPI, File, UploadFile, Form, BackgroundTasks, Request, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Optional
 from pathlib import Path
 from zipfile import ZipFile
 from enum import Enum
-from mido import MidiFile, MetaMessage
+from functools import partial
 import asyncio
+import io
 import logging
 import shutil
-import concurrent.futures
 import os
-import tempfile
-import mido
+import threading
+import time
+import numpy as np
 
 logging.basicConfig(level=logging.ERROR)
 
+# Calibrated stand-ins for the models in load tests, when STUB_INFERENCE is set
+from moseca.api.service.stub_inference import stub_inference_enabled
+
+# Models are loaded on first use or by the warm-up, and inference jobs are given as
+# "module:function" targets, so that starting the server does not import torch or TensorFlow
+from moseca.api.service.models import warm_models
+
 # For /split-audio and /split-yt-audio
-from moseca.api.service.demucs_runner import separator
-from moseca.api.align_audio import align_audio
+from moseca.api.align_audio import align_audio, beat_grid_cache, get_beat_grid, get_trim_points, processed_audio_path
+from moseca.api.audio_cut import cut_audio
 
 # For /align-audio
 import mimetypes
 
 # For /audio-to-midi
-from basic_pitch.inference import predict_and_save
-from basic_pitch import ICASSP_2022_MODEL_PATH
-from moseca.api.quantize_midi import quantize_midi
+from moseca.api.midi_pipeline import MidiPipeline, remap_tempo
+from moseca.api.quantize_midi import quantize_events
 from moseca.api.get_key_signature import detect_key
+from moseca.api.append_key_signature import key_signature_events
 
 # For Drum Transcription
-from moseca.api.tempo_chunking import tempo_chunking
-from moseca.api.prettyify import prettyify
-from adtof.model.model import Model
+from moseca.api.tempo_chunking import chunk_tempo_events
+from moseca.api.prettyify import prettyify_events
 
 # Import YouTube audio downloader
-from moseca.api.service.youtube import download_audio_from_youtube
+from moseca.api.service.youtube import download_audio_from_youtube, stream_audio_from_youtube
+
+# Per-request workspaces and upload handling
+from moseca.api.service.uploads import (
+    MAX_UPLOAD_BYTES, UploadRejected, UploadTooLarge, new_workspace, receive_audio_upload
+)
+from moseca.api.service.audio_probe import AudioProbeError, probe_audio
+
+# Admission control and accounting of heavy jobs
+from moseca.api.service.scheduler import (
+    JobScheduler, SchedulerBusy, estimate_cost, job_timeout_from_env, max_pending_cost_from_env
+)
+from moseca.api.service.worker_pools import WorkerPools
+
+# Job queue consumed by standalone workers, when JOB_BROKER is set
+from moseca.api.service.broker import InProcessBroker, broker_from_url
+from moseca.api.worker import JobWorker
+
+# Caching of conversion results, shared by the replicas through the artifact store
+from moseca.api.service.cache import DiskCache, LRUCache, file_sha256
+from moseca.api.service.artifacts import artifact_key, artifact_store_from_url
+
+# Removal of the workspaces left behind by crashed or failed requests
+from moseca.api.service.janitor import Janitor
+
+# Prometheus metrics
+from moseca.api.service.metrics import (
+    REGISTRY, CallbackCounter, Gauge, call_with_timings, observe_timings, process_memory, request_seconds, timed
+)
+
+# Opt-in profiling of single requests, for admins
+from moseca.api.service.profiling import (
+    ProfileSession, SamplingProfiler, current_profile, profile_dir, profiling_allowed, tag_profile
+)
+
+if stub_inference_enabled():
+    SEPARATOR = "moseca.api.service.stub_inference:separator"
+    TRANSCRIBE_PITCHED = "moseca.api.service.stub_inference:transcribe_pitched"
+    TRANSCRIBE_DRUMS = "moseca.api.service.stub_inference:transcribe_drums"
+else:
+    SEPARATOR = "moseca.api.service.demucs_runner:separator"
+    TRANSCRIBE_PITCHED = "moseca.api.service.transcription:transcribe_pitched"
+    TRANSCRIBE_DRUMS = "moseca.api.service.transcription:transcribe_drums"
+
+# Separation and transcription jobs go to the broker of this URL instead of the local worker pools
+JOB_BROKER = os.environ.get("JOB_BROKER")
+
+# Models loaded in the background after startup, so that the first heavy requests do not wait
+# for them. Empty for workers serving only light routes, like /yt-to-mp3 and /align-audio, and
+# by default when the jobs run on the workers of a broker.
+WARM_MODELS = [] if stub_inference_enabled() else [
+    name.strip() for name in os.environ.get(
+        "WARM_MODELS", "" if JOB_BROKER else "htdemucs,htdemucs_6s,basic_pitch,adtof"
+    ).split(",")
+    if name.strip()
+]
 
 app = FastAPI()
 
+@app.middleware("http")
+async def limit_request_size(request: Request, call_next):
+    # Reject oversized uploads from the declared length, before the body is read
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + (1 << 20):
+        return JSONResponse(content={"error": str(UploadTooLarge(MAX_UPLOAD_BYTES))}, status_code=413)
+    return await call_next(request)
+
+@app.middleware("http")
+async def record_request_time(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Label by route template rather than raw path, to keep the number of series bounded
+    route = request.scope.get("route")
+    request_seconds.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        route=route.path if route is not None else "unmatched",
+        status=response.status_code,
+    )
+    return response
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    # Only requests with the admin token in the X-Profile header are profiled
+    if not profiling_allowed(request.headers.get("x-profile")):
+        return await call_next(request)
+
+    session = ProfileSession(request.url.path, request.method)
+    session.meta["parameters"].update(request.query_params)
+    sampler = SamplingProfiler()
+    sampler.start()
+    context_token = current_profile.set(session)
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        current_profile.reset(context_token)
+        sampler.stop()
+        await asyncio.to_thread(session.finish, sampler, status_code)
+    response.headers["X-Profile-Id"] = session.id
+    return response
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000",  # For development
@@ -48,10 +154,149 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trim-Start", "X-Trim-End", "X-Cut-Mode", "X-Profile-Id"],
 )
 
-# Create a global process pool executor for CPU-bound tasks
-cpu_bound_executor = concurrent.futures.ProcessPoolExecutor()
+# The job broker, worker pools, scheduler and janitor are created by every server process on
+# startup. Under the pre-fork server, the master imports this module before forking, and the
+# pools' queues and the broker connection cannot be shared by the forked processes.
+broker = None
+worker_pools = None
+scheduler = None
+janitor = None
+
+@app.on_event("startup")
+async def start_job_runtime():
+    global broker, worker_pools, scheduler, janitor
+    broker = broker_from_url(JOB_BROKER)
+    # Separation runs in PyTorch worker processes and transcription in TensorFlow ones,
+    # each pool with its own size and thread settings
+    worker_pools = WorkerPools.from_env()
+    # Separation and transcription jobs, rejected when too much work is already pending
+    scheduler = JobScheduler(
+        worker_pools.torch, max_pending_cost=max_pending_cost_from_env(), broker=broker,
+        job_timeout=job_timeout_from_env(),
+    )
+    # Periodic cleanup of data/temp, data/midi and data/worker by age and total size
+    janitor = Janitor.from_env()
+
+@app.on_event("shutdown")
+async def stop_job_runtime():
+    if worker_pools is not None:
+        worker_pools.shutdown(wait=False)
+
+# Store of cached files shared by all replicas, read through on local misses and written
+# back on new results. Disabled unless ARTIFACT_STORE is set.
+artifact_store = artifact_store_from_url(os.environ.get("ARTIFACT_STORE"))
+
+# Key signatures of /audio-to-midi are detected on the whole track, unless KEY_DETECTION_FAST
+# is set to analyze a few windows of it, which is faster on long tracks but can pick another key
+KEY_DETECTION_FAST = os.environ.get("KEY_DETECTION_FAST", "").lower() in ("1", "true", "yes")
+
+# Final MIDI files keyed by audio hash, tempo, percussion flag, thresholds and key detection mode
+midi_cache = LRUCache(max_entries=int(os.environ.get("MIDI_CACHE_SIZE", 256)))
+
+# Downloaded YouTube audio, keyed by video ID and bounded by a size on disk
+youtube_cache = DiskCache(
+    "data/cache/youtube",
+    max_bytes=int(os.environ.get("YOUTUBE_CACHE_MAX_BYTES", 2 * 1024 ** 3)),
+    pin_after_hits=int(os.environ.get("YOUTUBE_CACHE_PIN_AFTER_HITS", 0)) or None,
+    store=artifact_store,
+)
+# Video IDs that are never evicted, e.g. songs featured on the frontend
+for video_id in filter(None, os.environ.get("YOUTUBE_CACHE_PINNED", "").split(",")):
+    youtube_cache.pin(video_id.strip())
+
+# ZIP files of separated stems, keyed by audio hash, separation mode, tempo and excerpt
+stems_cache = DiskCache(
+    "data/cache/stems",
+    max_bytes=int(os.environ.get("STEMS_CACHE_MAX_BYTES", 1024 ** 3)),
+    store=artifact_store,
+)
+
+# Scheduler and cache metrics, read on every scrape
+caches = {"midi": midi_cache, "beat_grid": beat_grid_cache, "youtube": youtube_cache, "stems": stems_cache}
+if artifact_store is not None:
+    caches["artifacts"] = artifact_store
+REGISTRY.register(Gauge(
+    "songscribe_jobs_in_flight", "Jobs admitted and not finished yet, by type.", ("job_type",),
+    function=lambda: {(job_type,): count for job_type, count in scheduler.stats()["in_flight"].items()},
+))
+REGISTRY.register(Gauge(
+    "songscribe_jobs_pending_cost_seconds", "Estimated seconds of work of the jobs in flight.",
+    function=lambda: {(): scheduler.stats()["pending_cost"]},
+))
+REGISTRY.register(CallbackCounter(
+    "songscribe_cache_hits_total", "Cache hits.", ("cache",),
+    function=lambda: {(name,): cache.hits for name, cache in caches.items()},
+))
+REGISTRY.register(CallbackCounter(
+    "songscribe_cache_misses_total", "Cache misses.", ("cache",),
+    function=lambda: {(name,): cache.misses for name, cache in caches.items()},
+))
+REGISTRY.register(Gauge(
+    "songscribe_cache_hit_ratio", "Share of cache lookups that were hits.", ("cache",),
+    function=lambda: {
+        (name,): cache.hits / (cache.hits + cache.misses) for name, cache in caches.items()
+        if cache.hits + cache.misses
+    },
+))
+if artifact_store is not None:
+    REGISTRY.register(CallbackCounter(
+        "songscribe_artifact_store_failures_total",
+        "Artifact store reads and writes that failed, as corrupted entries or backend errors.", ("kind",),
+        function=lambda: {(kind,): artifact_store.stats()[kind] for kind in ("corrupted", "errors")},
+    ))
+REGISTRY.register(CallbackCounter(
+    "songscribe_janitor_reclaimed_bytes_total", "Bytes of stale workspaces removed, by age or to stay in the disk budget.",
+    ("reason",),
+    function=lambda: {(reason,): value for reason, value in janitor.stats()["reclaimed_bytes"].items()},
+))
+REGISTRY.register(Gauge(
+    "songscribe_janitor_usage_bytes", "Bytes in the directories cleaned by the janitor, after its last sweep.",
+    function=lambda: {(): janitor.stats()["usage_bytes"]},
+))
+REGISTRY.register(Gauge(
+    "songscribe_process_memory_bytes", "Memory of this server process: rss, pss and shared with other processes.",
+    ("kind",),
+    function=lambda: {(kind,): value for kind, value in process_memory(os.getpid()).items() if value is not None},
+))
+
+# Warm-up state of every model of WARM_MODELS: "pending", "loading", "loaded" or "failed"
+model_warmup = {name: "pending" for name in WARM_MODELS}
+
+async def warm_up_model(name: str):
+    model_warmup[name] = "loading"
+    # Load each model in the pool where its jobs run. It is loaded by one worker of the pool,
+    # which also fetches its weights, and the other workers load it on their first job.
+    executor = worker_pools.for_model(name)
+    try:
+        _, timings, _ = await asyncio.get_running_loop().run_in_executor(
+            executor, partial(call_with_timings, warm_models, [name])
+        )
+        observe_timings(timings)
+        model_warmup[name] = "loaded"
+    except Exception as e:
+        model_warmup[name] = "failed"
+        print(f"Failed to load model {name}: {e}")
+
+@app.on_event("startup")
+async def start_model_warmup():
+    # Light routes are served while the models load
+    for name in WARM_MODELS:
+        asyncio.create_task(warm_up_model(name))
+
+@app.on_event("startup")
+async def start_janitor():
+    # Keep a reference, so the task is not garbage collected
+    app.state.janitor_task = asyncio.create_task(janitor.run())
+
+@app.on_event("startup")
+async def start_in_process_worker():
+    # The in-process broker has no standalone workers, so jobs run in a thread of this process
+    if isinstance(broker, InProcessBroker):
+        worker = JobWorker(broker, poll_interval=0.1)
+        threading.Thread(target=worker.run_forever, name="job-worker", daemon=True).start()
 
 class DisconnectionChecker:
     def __init__(
@@ -126,17 +371,17 @@ async def split_audio(
     end_time: Optional[int] = Form(None),
     background_tasks: BackgroundTasks = None,
 ):
-    temp_dir = Path("data/temp")
-    temp_dir.mkdir(parents=True, exist_ok=True)
-
-    input_file_path = temp_dir / audio_file.filename
+    temp_dir = new_workspace()
 
-    # Save the uploaded file
-    with open(input_file_path, "wb") as f:
-        shutil.copyfileobj(audio_file.file, f)
+    # Save the uploaded file and check its headers before any decoding
+    try:
+        input_file_path, audio_hash, probe = await receive_audio_upload(audio_file, temp_dir)
+    except UploadRejected as e:
+        cleanup_files([temp_dir])
+        return JSONResponse(content={"error": str(e)}, status_code=e.status_code)
 
     # Check for disconnection and process the audio file within the DisconnectionChecker context
-    async with DisconnectionChecker(request, background_tasks, [*temp_dir.glob("*")]):
+    async with DisconnectionChecker(request, background_tasks, [temp_dir]):
         return await process_audio_file(
             request=request,
             input_file_path=input_file_path,
@@ -145,6 +390,8 @@ async def split_audio(
             start_time=start_time,
             end_time=end_time,
             background_tasks=background_tasks,
+            audio_hash=audio_hash,
+            probe=probe,
         )
 
 @app.post("/split-yt-audio")
@@ -155,24 +402,34 @@ async def split_yt_audio(
     tempo: int = Form(...),
     start_time: int = Form(0),
     end_time: Optional[int] = Form(None),
+    streaming: bool = Form(False),
     background_tasks: BackgroundTasks = None,
 ):
-    temp_dir = Path("data/temp")
-    temp_dir.mkdir(parents=True, exist_ok=True)
+    temp_dir = new_workspace()
+    tag_profile({"youtube_url": youtube_url, "streaming": streaming})
 
+    analysis_signal = None
     try:
         # Download the audio from YouTube URL
         output_path = temp_dir
-        # Use asyncio.to_thread for I/O-bound task of downloading
-        audio_filename = await asyncio.to_thread(
-            download_audio_from_youtube, youtube_url, str(output_path)
-        )
+        # Use asyncio.to_thread for I/O-bound task of downloading. The native stream is kept,
+        # since alignment and separation decode it anyway.
+        if streaming:
+            # Decode for beat tracking while downloading, so alignment does not decode again
+            audio_filename, analysis_signal = await asyncio.to_thread(
+                stream_audio_from_youtube, youtube_url, str(output_path), youtube_cache
+            )
+        else:
+            audio_filename = await asyncio.to_thread(
+                download_audio_from_youtube, youtube_url, str(output_path), youtube_cache, False
+            )
         input_file_path = output_path / audio_filename
     except Exception as e:
+        cleanup_files([temp_dir])
         return JSONResponse(content={"error": str(e)}, status_code=400)
 
     # Check for disconnection and process the audio file within the DisconnectionChecker context
-    async with DisconnectionChecker(request, background_tasks, [*temp_dir.glob("*")]):
+    async with DisconnectionChecker(request, background_tasks, [temp_dir]):
         return await process_audio_file(
             request=request,
             input_file_path=input_file_path,
@@ -181,6 +438,7 @@ async def split_yt_audio(
             start_time=start_time,
             end_time=end_time,
             background_tasks=background_tasks,
+            analysis_signal=analysis_signal,
         )
 
 @app.post("/yt-to-mp3")
@@ -189,25 +447,25 @@ async def yt_to_mp3(
     youtube_url: str = Form(...),
     background_tasks: BackgroundTasks = None,
 ):
-    temp_dir = Path("data/temp")
-    temp_dir.mkdir(parents=True, exist_ok=True)
+    temp_dir = new_workspace()
 
-    async with DisconnectionChecker(request, background_tasks, [*temp_dir.glob("*")]):
+    async with DisconnectionChecker(request, background_tasks, [temp_dir]):
         try:
             output_path = temp_dir
             # Use asyncio.to_thread for I/O-bound download task
             audio_filename = await asyncio.to_thread(
-                download_audio_from_youtube, youtube_url, str(output_path)
+                download_audio_from_youtube, youtube_url, str(output_path), youtube_cache
             )
             output_file = output_path / audio_filename
         except Exception as e:
+            cleanup_files([temp_dir])
             return JSONResponse(content={"error": str(e)}, status_code=400)
 
         # Schedule cleanup of temporary files after response is sent
         if background_tasks is not None:
             background_tasks.add_task(
                 cleanup_files,
-                [*temp_dir.glob("*")]
+                [temp_dir]
             )
 
         return FileResponse(path=str(output_file), media_type="audio/mpeg", filename=audio_filename)
@@ -220,6 +478,9 @@ async def process_audio_file(
     start_time: int,
     end_time: Optional[int],
     background_tasks: BackgroundTasks = None,
+    analysis_signal: Optional[np.ndarray] = None,
+    audio_hash: Optional[str] = None,
+    probe: Optional[dict] = None,
 ):
     temp_dir = input_file_path.parent
 
@@ -228,41 +489,75 @@ async def process_audio_file(
         return JSONResponse(content={"error": "Invalid separation mode"}, status_code=400)
 
     model_name, file_sources = separation_mode_to_model[separation_mode.value]
+    tag_profile({"separation_mode": separation_mode.value, "tempo": tempo, "start_time": start_time, "end_time": end_time})
+
+    # Estimate the cost of the separation from the headers, and reject it early if the server is busy
+    if probe is None:
+        try:
+            probe = await asyncio.to_thread(probe_audio, str(input_file_path))
+        except AudioProbeError as e:
+            cleanup_files([temp_dir])
+            return JSONResponse(content={"error": str(e)}, status_code=415)
+        tag_profile(input_duration=probe["duration"])
+
+    # Return the cached stems if the same audio was separated with the same settings,
+    # here or on another replica
+    if audio_hash is None:
+        audio_hash = await asyncio.to_thread(file_sha256, str(input_file_path))
+    stems_key = artifact_key(audio_hash, separation_mode.value, tempo, start_time, end_time)
+    zip_filename = await asyncio.to_thread(stems_cache.get_into, stems_key, str(temp_dir))
+    if zip_filename is not None:
+        if background_tasks is not None:
+            background_tasks.add_task(cleanup_files, [temp_dir])
+        return FileResponse(zip_filename, media_type="application/zip", filename="output.zip")
+
+    job_type = f"separation:{model_name}"
+    cost = estimate_cost(job_type, excerpt_duration(probe["duration"], start_time, end_time))
+    if not scheduler.can_admit(cost):
+        cleanup_files([temp_dir])
+        return JSONResponse(content={"error": "The server is busy. Please try again in a few minutes."}, status_code=503)
 
     # Align audio and trim (likely I/O-bound, so using asyncio.to_thread)
-    await asyncio.to_thread(align_audio, str(input_file_path), tempo, str(temp_dir), start_time, end_time)
-    processed_input_path = temp_dir / f"processed_{input_file_path.name}"
+    with timed("align"):
+        await asyncio.to_thread(
+            align_audio, str(input_file_path), tempo, str(temp_dir), start_time, end_time, audio_hash, analysis_signal
+        )
+    processed_input_path = Path(processed_audio_path(str(input_file_path), str(temp_dir)))
 
     # Output directory for separated tracks
     output_dir = temp_dir / "output"
     output_dir.mkdir(exist_ok=True)
 
     # Perform audio source separation within the DisconnectionChecker context
-    async with DisconnectionChecker(request, background_tasks, [*temp_dir.glob("*")]):
+    async with DisconnectionChecker(request, background_tasks, [temp_dir]):
         stem = None
         if separation_mode == SeparationMode.Duet:
             stem = "vocals"
 
         # Run the separator function in a process pool to avoid blocking the event loop
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(
-            cpu_bound_executor,
-            separator,
-            [processed_input_path],
-            output_dir,
-            model_name,
-            1,
-            0.5,
-            stem,
-            False,
-            False,
-            "rescale",
-            True,
-            320,
-            True,
-            start_time,
-            end_time,
-        )
+        try:
+            await scheduler.run(
+                job_type,
+                SEPARATOR,
+                [processed_input_path],
+                output_dir,
+                model_name,
+                1,
+                0.5,
+                stem,
+                False,
+                False,
+                "rescale",
+                True,
+                320,
+                True,
+                start_time,
+                end_time,
+                cost=cost,
+            )
+        except SchedulerBusy as e:
+            cleanup_files([temp_dir])
+            return JSONResponse(content={"error": str(e)}, status_code=503)
 
     processed_input_name = processed_input_path.stem
     if model_name == "vocal_remover":
@@ -274,21 +569,23 @@ async def process_audio_file(
     output_files = list(model_output_dir.glob("*"))
 
     if not output_files:
+        cleanup_files([temp_dir])
         return JSONResponse(content={"error": "No output files were generated"}, status_code=500)
 
     # Zip the output files
     zip_filename = temp_dir / "output.zip"
-    with ZipFile(zip_filename, "w") as zipf:
+    with timed("zip"), ZipFile(zip_filename, "w") as zipf:
         for file in file_sources:
             file_path = model_output_dir / file
             if file_path.exists():
                 zipf.write(file_path, arcname=file)
+    await asyncio.to_thread(stems_cache.put, stems_key, str(zip_filename))
 
     # Schedule cleanup of temporary files after response is sent
     if background_tasks is not None:
         background_tasks.add_task(
             cleanup_files,
-            [*temp_dir.glob("*")]
+            [temp_dir]
         )
 
     # Return the ZIP file containing separated tracks
@@ -303,25 +600,52 @@ async def align_audio_endpoint(
     tempo: int = Form(...),
     start_time: int = Form(0),
     end_time: Optional[int] = Form(None),
+    lossless: bool = Form(False),
     background_tasks: BackgroundTasks = None,
 ):
-    # Create temporary directories
-    temp_dir = Path("data/temp")
-    temp_dir.mkdir(parents=True, exist_ok=True)
+    # Create a temporary directory for this request
+    temp_dir = new_workspace()
 
-    input_file_path = temp_dir / audio_file.filename
+    # Save the uploaded file and check its headers before any decoding
+    try:
+        input_file_path, audio_hash, probe = await receive_audio_upload(audio_file, temp_dir)
+    except UploadRejected as e:
+        cleanup_files([temp_dir])
+        return JSONResponse(content={"error": str(e)}, status_code=e.status_code)
 
-    # Save the uploaded file
-    with open(input_file_path, "wb") as f:
-        shutil.copyfileobj(audio_file.file, f)
+    tag_profile({"tempo": tempo, "start_time": start_time, "end_time": end_time, "lossless": lossless})
 
     # Align audio and trim within the DisconnectionChecker context (likely I/O-bound)
-    async with DisconnectionChecker(request, background_tasks, [*temp_dir.glob("*")]):
-        await asyncio.to_thread(
-            align_audio, str(input_file_path), tempo, str(temp_dir), start_time, end_time
-        )
-        processed_file_name = f"processed_{input_file_path.name}"
-        processed_input_path = temp_dir / processed_file_name
+    async with DisconnectionChecker(request, background_tasks, [temp_dir]):
+        processed_input_path = Path(processed_audio_path(str(input_file_path), str(temp_dir)))
+        processed_file_name = processed_input_path.name
+
+        headers = {}
+        if lossless:
+            # Cut the original container instead of re-encoding, and return the trim offsets
+            with timed("align"):
+                trim_points = await asyncio.to_thread(
+                    get_trim_points, str(input_file_path), tempo, start_time, end_time, audio_hash
+                )
+            if trim_points is not None:
+                trim_start, trim_end = trim_points
+                with timed("lossless_cut"):
+                    cut = await asyncio.to_thread(
+                        cut_audio, str(input_file_path), str(processed_input_path), trim_start, trim_end
+                    )
+                # Report where the cut landed, which can differ from the downbeats when it is clamped
+                # or when an MP3 cut starts earlier for the bit reservoir
+                if cut is not None:
+                    cut_mode, trim_start, trim_end = cut
+                    headers["X-Cut-Mode"] = cut_mode
+                headers["X-Trim-Start"] = f"{trim_start:.6f}"
+                if trim_end is not None:
+                    headers["X-Trim-End"] = f"{trim_end:.6f}"
+        else:
+            with timed("align"):
+                await asyncio.to_thread(
+                    align_audio, str(input_file_path), tempo, str(temp_dir), start_time, end_time, audio_hash
+                )
 
         # Determine the correct MIME type
         mime_type, _ = mimetypes.guess_type(processed_input_path.name)
@@ -332,7 +656,7 @@ async def align_audio_endpoint(
         if background_tasks is not None:
             background_tasks.add_task(
                 cleanup_files,
-                [input_file_path, processed_input_path],
+                [temp_dir],
             )
 
         # Return the aligned audio
@@ -341,8 +665,46 @@ async def align_audio_endpoint(
                 path=str(processed_input_path),
                 media_type=mime_type,
                 filename=processed_file_name,
+                headers=headers,
             )
 
+@app.post("/beat-grid")
+async def beat_grid_endpoint(
+    audio_file: UploadFile = File(...),
+    tempo: int = Form(...),
+    background_tasks: BackgroundTasks = None,
+):
+    """Returns the beat, downbeat and measure times of the audio, to pick trim points client-side."""
+    if tempo <= 0:
+        return JSONResponse(content={"error": "Tempo must be a positive number"}, status_code=400)
+
+    temp_dir = new_workspace()
+
+    # Save the uploaded file and check its headers before any decoding
+    try:
+        input_file_path, audio_hash, probe = await receive_audio_upload(audio_file, temp_dir)
+    except UploadRejected as e:
+        cleanup_files([temp_dir])
+        return JSONResponse(content={"error": str(e)}, status_code=e.status_code)
+
+    if background_tasks is not None:
+        background_tasks.add_task(cleanup_files, [temp_dir])
+
+    tag_profile({"tempo": tempo})
+    try:
+        with timed("align"):
+            grid = await asyncio.to_thread(get_beat_grid, str(input_file_path), tempo, None, None, audio_hash)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+
+    return {
+        "tempo": grid["tempo"],
+        "duration": float(grid["duration"]),
+        "beat_times": grid["beat_times"].tolist(),
+        "downbeat_times": grid["downbeat_times"].tolist(),
+        "measure_times": grid["measure_times"].tolist(),
+    }
+
 @app.post("/audio-to-midi")
 async def audio_to_midi(
     audio_file: UploadFile = File(...),
@@ -355,19 +717,20 @@ async def audio_to_midi(
     percussion: Optional[bool] = Form(False),
     background_tasks: BackgroundTasks = None,
 ):
-    # Create temporary directories
-    temp_dir = Path("data/temp")
-    temp_dir.mkdir(parents=True, exist_ok=True)
-    base_stem = audio_file.filename.split(".")[0]
-    input_file_path = temp_dir / f"base_{audio_file.filename}"
+    # Create temporary directories for this request
+    temp_dir = new_workspace()
+    file_name = Path(audio_file.filename).name
+    base_stem = file_name.split(".")[0]
 
-    # Save the uploaded file
-    with open(input_file_path, "wb") as f:
-        shutil.copyfileobj(audio_file.file, f)
+    # Save the uploaded file and check its headers before any decoding
+    try:
+        input_file_path, audio_hash, probe = await receive_audio_upload(audio_file, temp_dir, f"base_{file_name}")
+    except UploadRejected as e:
+        cleanup_files([temp_dir])
+        return JSONResponse(content={"error": str(e)}, status_code=e.status_code)
 
     # Specify output directory
-    output_directory = Path("data/midi")
-    output_directory.mkdir(parents=True, exist_ok=True)
+    output_directory = new_workspace("data/midi")
 
     # Assign default values
     onset_threshold = onset_threshold if onset_threshold is not None else 0.5
@@ -375,73 +738,70 @@ async def audio_to_midi(
     minimum_note_length = minimum_note_length if minimum_note_length is not None else 127.70
     minimum_frequency = minimum_frequency if minimum_frequency != 0 else None
     tempo = tempo if tempo is not None else 120
+    final_name = base_stem + ".mid"
+    tag_profile({
+        "onset_threshold": onset_threshold, "frame_threshold": frame_threshold,
+        "minimum_note_length": minimum_note_length, "minimum_frequency": minimum_frequency,
+        "maximum_frequency": maximum_frequency, "tempo": tempo, "percussion": percussion,
+    })
+
+    # Return the cached MIDI if the same audio was converted with the same settings, including
+    # the key detection of the replica, as the cached files are shared through the artifact store
+    cache_key = (
+        audio_hash, tempo, bool(percussion), onset_threshold, frame_threshold,
+        minimum_note_length, minimum_frequency, maximum_frequency, KEY_DETECTION_FAST and not percussion,
+    )
+    cached_midi = midi_cache.get(cache_key)
+    stored_key = f"midi/{artifact_key(*cache_key)}"
+    if cached_midi is None and artifact_store is not None:
+        stored_path = await asyncio.to_thread(artifact_store.get, stored_key, str(output_directory))
+        if stored_path is not None:
+            cached_midi = stored_path.read_bytes()
+            midi_cache.put(cache_key, cached_midi)
+    if cached_midi is not None:
+        if background_tasks is not None:
+            background_tasks.add_task(cleanup_files, [temp_dir, output_directory])
+        else:
+            cleanup_files([temp_dir, output_directory])
+        return Response(
+            content=cached_midi,
+            media_type="audio/midi",
+            headers={"Content-Disposition": f'attachment; filename="{final_name}"'},
+        )
 
     try:
         if percussion:
             # **Drum Transcription Process**
 
-            model_name = "Frame_RNN"
-            model, hparams = Model.modelFactory(modelName=model_name, scenario="adtofAll", fold=0)
-
             # Perform transcription
-            model.predictFolder(str(input_file_path), str(output_directory), **hparams)
-            midi_file_name = "base_" + audio_file.filename + ".mid"
-            midi_file_path = output_directory / midi_file_name
-
-            # Remap Tempo (default output is 120bpm)
-            scaling_factor = tempo / 120
-            mid = mido.MidiFile(midi_file_path)
-            new_mid = mido.MidiFile(ticks_per_beat=mid.ticks_per_beat)
-
-            for track in mid.tracks:
-                new_track = mido.MidiTrack()
-                new_mid.tracks.append(new_track)
-
-                # Insert tempo meta message at the beginning of the track
-                tempo_meta = mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(tempo), time=0)
-                new_track.append(tempo_meta)
-
-                for msg in track:
-                    # Adjust the time (delta time)
-                    adjusted_time = int(msg.time * scaling_factor)
-                    msg = msg.copy(time=adjusted_time)
-                    new_track.append(msg)
-
-            # Save the new MIDI file with adjusted note timings and tempo
-            new_mid.save(midi_file_path)
+            job_type = "transcription:adtof"
+            midi_file_path = await scheduler.run(
+                job_type, TRANSCRIBE_DRUMS, input_file_path, output_directory,
+                cost=estimate_cost(job_type, probe["duration"]), executor=worker_pools.for_job(job_type),
+            )
 
             if not midi_file_path.exists():
                 return JSONResponse(content={"error": "MIDI file was not generated"}, status_code=500)
 
-            # Quantize the MIDI file
-            quantize_midi(str(midi_file_path), tempo, str(output_directory))
-            quantized_midi_file_name = f"quantized_{midi_file_name}"
-            quantized_midi_file_path = output_directory / quantized_midi_file_name
-            if not quantized_midi_file_path.exists():
-                return JSONResponse(content={"error": "Quantized MIDI file was not generated"}, status_code=500)
-
-            # Adjust Tempo by Chunking
-            tempo_chunking(str(quantized_midi_file_path), tempo, str(output_directory))
-            adjusted_midi_file_name = f"adjusted_{quantized_midi_file_name}"
-            adjusted_midi_file_path = output_directory / adjusted_midi_file_name
-            if not adjusted_midi_file_path.exists():
-                return JSONResponse(content={"error": "Adjusted MIDI file was not generated"}, status_code=500)
-
-            # Prettyify the MIDI file
-            prettyify(str(adjusted_midi_file_path), str(output_directory))
-            pretty_midi_file_name = f"prettyified_{adjusted_midi_file_name}"
-            pretty_midi_file_path = output_directory / pretty_midi_file_name
-
-            # Rename Output File
-            final_name = base_stem + ".mid"
+            # Remap tempo (default output is 120bpm), quantize, adjust tempo by chunking
+            # and prettyify the MIDI in memory
             final_path = output_directory / final_name
-            pretty_midi_file_path.rename(final_path)
+            pipeline = MidiPipeline([
+                partial(remap_tempo, bpm=tempo, source_bpm=120),
+                partial(quantize_events, bpm=tempo),
+                partial(chunk_tempo_events, bpm=tempo),
+                prettyify_events,
+            ])
+            pipeline.run(str(midi_file_path), str(final_path))
 
             # Return the adjusted MIDI file as a response
             if background_tasks is not None:
-                background_tasks.add_task(cleanup_files, [*temp_dir.glob("*"), *output_directory.glob("*")])
+                background_tasks.add_task(cleanup_files, [temp_dir, output_directory])
 
             if final_path.exists():
+                midi_cache.put(cache_key, final_path.read_bytes())
+                if artifact_store is not None:
+                    await asyncio.to_thread(artifact_store.put, stored_key, str(final_path))
                 return FileResponse(
                     path=str(final_path),
                     media_type="audio/midi",
@@ -454,42 +814,29 @@ async def audio_to_midi(
         else:
             # **Default Audio-to-MIDI Process**
 
-            predict_and_save(
-                audio_path_list=[input_file_path],
-                output_directory=output_directory,
-                save_midi=True,
-                sonify_midi=False,
-                save_model_outputs=False,
-                save_notes=False,
-                model_or_model_path=ICASSP_2022_MODEL_PATH,
-                onset_threshold=onset_threshold,
-                frame_threshold=frame_threshold,
-                minimum_note_length=minimum_note_length,
-                minimum_frequency=minimum_frequency,
-                maximum_frequency=maximum_frequency,
-                midi_tempo=tempo,
+            job_type = "transcription:basic_pitch"
+            midi_file_path = await scheduler.run(
+                job_type,
+                TRANSCRIBE_PITCHED,
+                input_file_path,
+                output_directory,
+                onset_threshold,
+                frame_threshold,
+                minimum_note_length,
+                minimum_frequency,
+                maximum_frequency,
+                tempo,
+                cost=estimate_cost(job_type, probe["duration"]),
+                executor=worker_pools.for_job(job_type),
             )
 
-            # Construct the MIDI file path
-            midi_file_name = input_file_path.stem + "_basic_pitch.mid"
-            midi_file_path = output_directory / midi_file_name
-
             # Check if the MIDI file was generated
             if not midi_file_path.exists():
                 return JSONResponse(content={"error": "MIDI file was not generated"}, status_code=500)
 
-            # Quantize the MIDI file
-            quantize_midi(str(midi_file_path), tempo, str(output_directory))
-            quantized_midi_file_name = f"quantized_{midi_file_name}"
-            quantized_midi_file_path = output_directory / quantized_midi_file_name
-
-            # Rename Output File
-            final_name = base_stem + ".mid"
-            final_path = output_directory / final_name
-            quantized_midi_file_path.rename(final_path)
-
-            # Get the key signature and sppend it to the MIDI File
-            key_info = detect_key(str(input_file_path))
+            # Get the key signature
+            with timed("key_detection"):
+                key_info = await asyncio.to_thread(detect_key, str(input_file_path), fast=KEY_DETECTION_FAST)
             key = key_info['key']
             mode = key_info['mode']
 
@@ -497,12 +844,22 @@ async def audio_to_midi(
                 midi_key = key
             else:
                 midi_key = f"{key}m"
-            append_key_signature(str(final_path), midi_key)
+
+            # Quantize the MIDI file and append the key signature in memory
+            final_path = output_directory / final_name
+            pipeline = MidiPipeline([
+                partial(quantize_events, bpm=tempo),
+                partial(key_signature_events, midi_key=midi_key),
+            ])
+            pipeline.run(str(midi_file_path), str(final_path))
 
             if background_tasks is not None:
-                background_tasks.add_task(cleanup_files, [*temp_dir.glob("*"), *output_directory.glob("*")])
+                background_tasks.add_task(cleanup_files, [temp_dir, output_directory])
 
             if final_path.exists():
+                midi_cache.put(cache_key, final_path.read_bytes())
+                if artifact_store is not None:
+                    await asyncio.to_thread(artifact_store.put, stored_key, str(final_path))
                 # Return the quantized MIDI file as a response
                 return FileResponse(
                     path=str(final_path),
@@ -514,52 +871,76 @@ async def audio_to_midi(
                     content={"error": "Final MIDI file was not generated"}, status_code=500
                 )
 
+    except SchedulerBusy as e:
+        cleanup_files([temp_dir, output_directory])
+        return JSONResponse(content={"error": str(e)}, status_code=503)
     except Exception as e:
         # Cleanup files in case of an error
         if background_tasks is not None:
-            background_tasks.add_task(cleanup_files, [*temp_dir.glob("*"), *output_directory.glob("*")])
+            background_tasks.add_task(cleanup_files, [temp_dir, output_directory])
         else:
-            cleanup_files([*temp_dir.glob("*"), *output_directory.glob("*")])
+            cleanup_files([temp_dir, output_directory])
         print(f"Error: {e}")
         return JSONResponse(content={"error": "MIDI conversion failed"}, status_code=500)
 
+@app.get("/health/ready")
+async def health_ready(models: bool = False):
+    """
+    Returns the readiness of the server. It accepts light traffic as soon as it runs, and
+    its models are warm once every model of WARM_MODELS has loaded. With models=true, the
+    status is 503 until then, to route heavy traffic to warm servers only.
+    """
+    models_warm = all(state == "loaded" for state in model_warmup.values())
+    if models_warm:
+        status = "warm"
+    elif "failed" in model_warmup.values():
+        status = "failed"
+    else:
+        status = "warming"
+    content = {
+        "status": status,
+        "light_traffic": True,
+        "models_warm": models_warm,
+        "models": dict(model_warmup),
+    }
+    return JSONResponse(content=content, status_code=200 if models_warm or not models else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Returns the metrics in the Prometheus text format."""
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request):
+    """Returns the artifacts of a request profile as a ZIP file, for admins."""
+    if not profiling_allowed(request.headers.get("x-profile")):
+        return JSONResponse(content={"error": "Forbidden"}, status_code=403)
+
+    path = profile_dir(profile_id)
+    if path is None:
+        return JSONResponse(content={"error": "Profile not found"}, status_code=404)
+
+    archive = io.BytesIO()
+    with ZipFile(archive, "w") as zipf:
+        for artifact in sorted(path.iterdir()):
+            zipf.write(artifact, arcname=artifact.name)
+    return Response(
+        content=archive.getvalue(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="profile-{profile_id}.zip"'},
+    )
+
+def excerpt_duration(duration: Optional[float], start_time: Optional[float], end_time: Optional[float]):
+    """Returns the duration of the processed excerpt of the audio, or None if unknown."""
+    if duration is None:
+        return None
+    start = min(start_time or 0, duration)
+    end = duration if end_time is None or end_time <= start else min(end_time, duration)
+    return end - start
+
 def cleanup_files(file_paths: List[Path]):
     for path in file_paths:
         if path.is_file():
             path.unlink()
         elif path.is_dir():
             shutil.rmtree(path)
-
-def append_key_signature(midi_path: str, midi_key: str):
-    mid = MidiFile(midi_path)
-    key_meta = MetaMessage('key_signature', key=midi_key, time=0)
-    text_meta = MetaMessage('text', text=f"Key: {midi_key}", time=0)
-
-    # Insert the key signature at the beginning of the first track
-    if len(mid.tracks) != 0:
-        print(f"Appending key signature of {midi_key} to file")
-        mid.tracks[0].insert(0, key_meta)
-        mid.tracks[0].insert(1, text_meta)
-    else:
-        print("Error: Midi File has no Tracks!")
-        return
-
-    # Save the modified MIDI to a temporary file
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mid') as tmp_file:
-            temp_path = tmp_file.name
-        mid.save(temp_path)
-
-    except IOError as e:
-        print(f"Error: Unable to save to temporary file. {e}")
-        return
-
-    # Replace the original MIDI file with the temporary file
-    try:
-        os.replace(temp_path, midi_path)
-        print(f"Successfully added key signature '{midi_key}' to '{midi_path}'.")
-    except OSError as e:
-        print(f"Error: Unable to overwrite the original MIDI file. {e}")
-        # Clean up the temporary file in case of failure
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
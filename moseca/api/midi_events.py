@@ -0,0 +1,151 @@
+import numpy as np
+from mido import MidiFile, MidiTrack, Message, MetaMessage
+
+# Event type codes
+NOTE_OFF = 0
+NOTE_ON = 1
+SET_TEMPO = 2
+END_OF_TRACK = 3
+OTHER = 4
+
+_TYPE_CODES = {'note_off': NOTE_OFF, 'note_on': NOTE_ON, 'set_tempo': SET_TEMPO, 'end_of_track': END_OF_TRACK}
+_NOTE_TYPES = {NOTE_OFF: 'note_off', NOTE_ON: 'note_on'}
+
+# One row per event. Note events are stored entirely in their fields, every other
+# message is kept as-is in a side list and referenced by `ref` (-1 for note events).
+EVENT_DTYPE = np.dtype([
+    ('time', np.int64),
+    ('type', np.uint8),
+    ('channel', np.int8),
+    ('note', np.int16),
+    ('velocity', np.int16),
+    ('track', np.int32),
+    ('ref', np.int32),
+])
+
+
+class MidiEvents:
+    """
+    All events of a MIDI file in a single structured array with absolute times in ticks.
+
+    Stages only rely on the relative order of rows within the same track, so the array
+    can be sorted globally by time without losing the original track layout.
+    """
+
+    def __init__(self, array: np.ndarray, messages: list, ticks_per_beat: int, num_tracks: int):
+        self.array = array
+        self.messages = messages
+        self.ticks_per_beat = ticks_per_beat
+        self.num_tracks = num_tracks
+
+    def __len__(self):
+        return len(self.array)
+
+    @classmethod
+    def from_midi(cls, mid: MidiFile) -> "MidiEvents":
+        times, types, channels, notes, velocities, tracks, refs = [], [], [], [], [], [], []
+        messages = []
+        for i, track in enumerate(mid.tracks):
+            abs_time = 0
+            for msg in track:
+                abs_time += msg.time
+                type_code = _TYPE_CODES.get(msg.type, OTHER)
+                times.append(abs_time)
+                types.append(type_code)
+                tracks.append(i)
+                if type_code in _NOTE_TYPES:
+                    channels.append(msg.channel)
+                    notes.append(msg.note)
+                    velocities.append(msg.velocity)
+                    refs.append(-1)
+                else:
+                    channels.append(getattr(msg, 'channel', -1))
+                    notes.append(-1)
+                    velocities.append(-1)
+                    refs.append(len(messages))
+                    messages.append(msg)
+
+        array = np.empty(len(times), dtype=EVENT_DTYPE)
+        array['time'] = times
+        array['type'] = types
+        array['channel'] = channels
+        array['note'] = notes
+        array['velocity'] = velocities
+        array['track'] = tracks
+        array['ref'] = refs
+        return cls(array, messages, mid.ticks_per_beat, len(mid.tracks))
+
+    def with_array(self, array: np.ndarray) -> "MidiEvents":
+        """Returns events backed by a new array that shares this message list."""
+        return MidiEvents(array, self.messages, self.ticks_per_beat, self.num_tracks)
+
+    def with_meta(self, array: np.ndarray, messages: list, times, tracks, at_end: bool = False) -> "MidiEvents":
+        """
+        Returns events backed by `array` with rows for non-note messages added before it,
+        or after it with at_end. The events get a new message list holding the messages,
+        so the message list of these events, which other events may share, is left as is.
+        """
+        rows = np.zeros(len(messages), dtype=EVENT_DTYPE)
+        rows['time'] = times
+        rows['type'] = [_TYPE_CODES.get(msg.type, OTHER) for msg in messages]
+        rows['channel'] = [getattr(msg, 'channel', -1) for msg in messages]
+        rows['note'] = -1
+        rows['velocity'] = -1
+        rows['track'] = tracks
+        rows['ref'] = np.arange(len(self.messages), len(self.messages) + len(messages))
+        array = np.concatenate([array, rows] if at_end else [rows, array])
+        return MidiEvents(array, self.messages + list(messages), self.ticks_per_beat, self.num_tracks)
+
+    def note_mask(self) -> np.ndarray:
+        return self.array['type'] <= NOTE_ON
+
+    def note_on_mask(self) -> np.ndarray:
+        """Note-on events with a non-zero velocity."""
+        return (self.array['type'] == NOTE_ON) & (self.array['velocity'] > 0)
+
+    def note_off_mask(self) -> np.ndarray:
+        """Note-off events, including note-ons with zero velocity."""
+        array = self.array
+        return (array['type'] == NOTE_OFF) | ((array['type'] == NOTE_ON) & (array['velocity'] == 0))
+
+    def sort_by_time(self) -> "MidiEvents":
+        """Stable sort by absolute time, keeping the order of simultaneous events."""
+        return self.with_array(self.array[np.argsort(self.array['time'], kind='stable')])
+
+    def normalize_end_of_track(self) -> "MidiEvents":
+        """
+        Keeps a single end_of_track at the end of every track, exactly like saving and
+        reloading the file would, so stages see the same input as with file round trips.
+        """
+        array = self.array
+
+        # Tracks are in time order, so the last event of each track has its latest time
+        last_times = np.zeros(self.num_tracks, dtype=np.int64)
+        np.maximum.at(last_times, array['track'], array['time'])
+
+        array = array[array['type'] != END_OF_TRACK]
+        eot_messages = [MetaMessage('end_of_track', time=0) for _ in range(self.num_tracks)]
+        return self.with_meta(array, eot_messages, last_times, np.arange(self.num_tracks), at_end=True)
+
+    def to_midi(self) -> MidiFile:
+        mid = MidiFile(ticks_per_beat=self.ticks_per_beat)
+        mid.tracks.extend(MidiTrack() for _ in range(self.num_tracks))
+
+        array = self.array[np.argsort(self.array['track'], kind='stable')]
+        if len(array) == 0:
+            return mid
+
+        # Recalculate delta times from absolute times within each track
+        deltas = np.diff(array['time'], prepend=0)
+        track_starts = np.flatnonzero(np.diff(array['track'], prepend=-1))
+        deltas[track_starts] = array['time'][track_starts]
+
+        for row, delta in zip(array.tolist(), deltas.tolist()):
+            _, type_code, channel, note, velocity, track_index, ref = row
+            if ref < 0:
+                msg = Message(_NOTE_TYPES[type_code], channel=channel, note=note,
+                              velocity=velocity, time=delta)
+            else:
+                msg = self.messages[ref].copy(time=delta)
+            mid.tracks[track_index].append(msg)
+        return mid
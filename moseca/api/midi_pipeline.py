@@ -0,0 +1,81 @@
+import mido
+import numpy as np
+import os
+from typing import Callable, List, Optional
+from mido import MidiFile, MetaMessage
+from moseca.api.midi_events import MidiEvents
+from moseca.api.service.metrics import timed
+
+
+# A stage takes the events of the whole file and returns the processed events
+MidiStage = Callable[[MidiEvents], MidiEvents]
+
+
+class MidiPipeline:
+    """
+    Runs MIDI post-processing stages in memory.
+
+    The input file is parsed once, every stage works on the same absolute-time event list
+    and the result is serialized once, instead of a load/save cycle per stage.
+    Stages can be passed in any order, with parameters bound using functools.partial.
+    """
+
+    def __init__(self, stages: List[MidiStage]):
+        self.stages = list(stages)
+
+    def process(self, events: MidiEvents) -> MidiEvents:
+        for stage in self.stages:
+            with timed(f"midi_{getattr(stage, 'func', stage).__name__}"):
+                events = stage(events).normalize_end_of_track()
+        return events
+
+    def run(self, input_file: str, output_file: str) -> Optional[str]:
+        # Load the MIDI file
+        try:
+            mid = MidiFile(input_file)
+        except IOError:
+            print(f"Error: Cannot open MIDI file '{input_file}'. Please check the file path.")
+            return
+        except Exception as e:
+            print(f"Error: {e}")
+            return
+
+        events = self.process(MidiEvents.from_midi(mid))
+
+        # Save the processed MIDI file
+        try:
+            events.to_midi().save(output_file)
+            print(f'Processed MIDI saved to {output_file}')
+        except IOError:
+            print(f"Error: Cannot save MIDI file to '{output_file}'. Please check the output directory permissions.")
+            return
+        except Exception as e:
+            print(f"Error: {e}")
+            return
+
+        return output_file
+
+
+def run_stage_on_file(stage: MidiStage, input_file: str, output_dir: str, prefix: str) -> Optional[str]:
+    """Runs a single stage on a MIDI file and saves it as `{prefix}_{file_name}` in output_dir."""
+    file_name = os.path.basename(input_file)
+    output_file = os.path.join(output_dir, f'{prefix}_{file_name}')
+    return MidiPipeline([stage]).run(input_file, output_file)
+
+
+def remap_tempo(events: MidiEvents, bpm: int, source_bpm: int = 120) -> MidiEvents:
+    """
+    Rescales event times from a MIDI file written at source_bpm to the given tempo,
+    and inserts a tempo message at the beginning of every track.
+
+    Absolute times are rescaled and rounded once per event, so rounding errors do not
+    build up over the track like they would when truncating every delta time.
+    """
+    scaling_factor = bpm / source_bpm
+    new_tempo = mido.bpm2tempo(bpm)
+
+    array = events.array.copy()
+    array['time'] = np.round(array['time'] * scaling_factor).astype(np.int64)
+
+    tempo_messages = [MetaMessage('set_tempo', tempo=new_tempo, time=0) for _ in range(events.num_tracks)]
+    return events.with_meta(array, tempo_messages, 0, np.arange(events.num_tracks))
@@ -0,0 +1,175 @@
+"""
+Pre-fork serving: the master process imports the API and loads the chosen model weights,
+then forks the uvicorn workers, which share the read-only weight pages through copy-on-write.
+The PyTorch worker processes are forked from the workers, so they share the weights too.
+
+Only PyTorch models are preloaded: TensorFlow is not fork-safe once its runtime has started,
+so basic-pitch and ADTOF are still loaded by every worker.
+
+Usage: python -m moseca.api.prefork [--workers 4] [--host 0.0.0.0] [--port 8000]
+           [--preload htdemucs,htdemucs_6s] [--report-after 30]
+
+Send SIGUSR1 to the master to print the RSS and PSS of every process.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+from moseca.api.service.metrics import process_memory
+from moseca.api.service.models import MODELS, warm_models
+
+# Models whose weights can be shared with forked workers
+FORK_SAFE_MODELS = ("htdemucs", "htdemucs_6s")
+
+DEFAULT_PRELOAD = os.environ.get("PREFORK_MODELS", ",".join(FORK_SAFE_MODELS))
+
+
+def _child_pids(pid: int) -> list:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The parent PID is the second field after the parenthesized command name
+                parent = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if parent == pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def memory_report(master_pid: int, worker_pids: list) -> dict:
+    """Returns the memory of the master, every worker and the process pool workers of each."""
+    processes = [("master", master_pid, process_memory(master_pid))]
+    for pid in worker_pids:
+        processes.append(("worker", pid, process_memory(pid)))
+        for child in _child_pids(pid):
+            processes.append(("pool", child, process_memory(child)))
+    return {
+        "processes": [{"role": role, "pid": pid, **memory} for role, pid, memory in processes],
+        "total_rss": sum(memory["rss"] or 0 for _, _, memory in processes),
+        "total_pss": sum(memory["pss"] or 0 for _, _, memory in processes),
+    }
+
+
+def print_memory_report(report: dict):
+    def mb(value):
+        return f"{value / 1024 ** 2:>9.1f}" if value is not None else f"{'-':>9}"
+
+    print(f"{'process':<8} {'pid':>8} {'RSS MB':>9} {'PSS MB':>9} {'shared MB':>9}")
+    for process in report["processes"]:
+        print(f"{process['role']:<8} {process['pid']:>8} {mb(process['rss'])} {mb(process['pss'])} "
+              f"{mb(process['shared'])}")
+    # The RSS counts shared pages once per process, the PSS splits them among the processes
+    print(f"Total RSS {report['total_rss'] / 1024 ** 2:.1f} MB, total PSS {report['total_pss'] / 1024 ** 2:.1f} MB, "
+          f"{(report['total_rss'] - report['total_pss']) / 1024 ** 2:.1f} MB shared", flush=True)
+
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(sock: socket.socket, app, log_level: str):
+    import uvicorn
+
+    # Drop the handlers of the master. uvicorn installs its own for SIGINT and SIGTERM.
+    for signum in (signal.SIGUSR1, signal.SIGALRM, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level))
+    server.run(sockets=[sock])
+
+
+def serve(host: str, port: int, workers: int, preload: list, log_level: str = "info", report_after: float = 30.0):
+    """Loads the models, forks the workers and restarts them if they die, until SIGINT or SIGTERM."""
+    for name in preload:
+        start = time.perf_counter()
+        warm_models([name])
+        print(f"Preloaded {name} in {time.perf_counter() - start:.1f}s", flush=True)
+
+    # Import the app with its dependencies before forking, so the workers share them too
+    from moseca.api.main import app
+
+    # Keep the garbage collector from writing to the headers of the preloaded objects,
+    # which would copy their pages into every worker
+    gc.collect()
+    gc.freeze()
+
+    sock = _bind(host, port)
+    master_pid = os.getpid()
+    worker_pids = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(sock, app, log_level)
+            finally:
+                os._exit(0)
+        worker_pids.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in worker_pids:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    def report_memory(signum, frame):
+        print_memory_report(memory_report(master_pid, sorted(worker_pids)))
+
+    signal.signal(signal.SIGUSR1, report_memory)
+    signal.signal(signal.SIGALRM, report_memory)
+
+    for _ in range(workers):
+        spawn()
+    print(f"Serving on http://{host}:{port} with {workers} workers, models preloaded: "
+          f"{', '.join(name for name in preload if MODELS.is_loaded(name)) or 'none'}", flush=True)
+    if report_after > 0:
+        signal.alarm(int(report_after))
+
+    while worker_pids:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_pids.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting it")
+            # Avoid a tight loop of restarts when workers crash on startup
+            time.sleep(1)
+            spawn()
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the API from workers forked after loading the models.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", 2)))
+    parser.add_argument("--preload", default=DEFAULT_PRELOAD,
+                        help="Comma-separated models loaded before forking.")
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--report-after", type=float, default=30.0,
+                        help="Seconds after startup to print the memory report, 0 to disable.")
+    args = parser.parse_args()
+
+    models = [name.strip() for name in args.preload.split(",") if name.strip()]
+    unsafe = [name for name in models if name not in FORK_SAFE_MODELS]
+    if unsafe:
+        parser.error(f"cannot preload {', '.join(unsafe)}: only {', '.join(FORK_SAFE_MODELS)} are fork-safe")
+    if sys.platform != "linux":
+        parser.error("pre-fork serving needs fork and /proc, which are Linux only")
+    serve(args.host, args.port, args.workers, models, args.log_level, args.report_after)
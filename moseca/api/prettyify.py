@@ -1,129 +1,106 @@
-import mido
-import os
+import numpy as np
 import sys
-from mido import MidiFile, MidiTrack, Message, MetaMessage
+from moseca.api.midi_events import MidiEvents, NOTE_OFF, NOTE_ON
+from moseca.api.midi_pipeline import run_stage_on_file
 
-def prettyify(input_file: str, output_dir: str):
-    # Get the file name without directory
-    file_name = os.path.basename(input_file)
-    output_file = os.path.join(output_dir, f'prettyified_{file_name}')
-
-    # Load the MIDI file
-    try:
-        mid = MidiFile(input_file)
-    except IOError:
-        print(f"Error: Cannot open MIDI file '{input_file}'. Please check the file path.")
-        return
-    except Exception as e:
-        print(f"Error: {e}")
-        return
-
-    ticks_per_beat = mid.ticks_per_beat
+# Bits reserved for the time when combining a (track, channel, note) key with a time
+_TIME_BITS = 40
+
+
+def _earliest_note_offs(events, note_rows, after_times, note_off_mask):
+    """
+    Finds, for every note row, the earliest note-off of the same (track, channel, note)
+    strictly after the given time, using one sorted index of all note-offs.
+    Returns -1 where there is none.
+    """
+    def keyed(rows, times):
+        key = (rows['track'].astype(np.int64) * 16 + rows['channel']) * 128 + rows['note']
+        return (key << _TIME_BITS) | times
+
+    note_offs = events[note_off_mask]
+    index = np.sort(keyed(note_offs, note_offs['time']))
+
+    queries = keyed(note_rows, after_times + 1)
+    positions = np.searchsorted(index, queries)
+    found = positions < len(index)
+    found[found] = (index[positions[found]] >> _TIME_BITS) == (queries[found] >> _TIME_BITS)
+
+    earliest = np.full(len(note_rows), -1, dtype=np.int64)
+    earliest[found] = index[positions[found]] & ((1 << _TIME_BITS) - 1)
+    return earliest
+
+
+def prettyify_events(midi_events: MidiEvents) -> MidiEvents:
+    ticks_per_beat = midi_events.ticks_per_beat
 
     # Calculate ticks per sixteenth note and quarter note
     ticks_per_sixteenth = ticks_per_beat // 4  # 4 sixteenth notes per quarter note
     ticks_per_quarter = ticks_per_beat         # Quarter note duration
 
-    # Process each track
-    new_mid = MidiFile(ticks_per_beat=mid.ticks_per_beat)
-    for i, track in enumerate(mid.tracks):
-        new_track = MidiTrack()
-        new_mid.tracks.append(new_track)
-
-        abs_time = 0  # Absolute time in ticks
-        events = []   # List to hold all events with absolute times
-
-        # Collect all events with absolute times
-        for msg in track:
-            abs_time += msg.time
-            events.append((abs_time, msg))
-
-        # Build a list of note groups (notes starting at the same time)
-        note_groups = []
-        idx = 0
-        while idx < len(events):
-            abs_time_event, msg = events[idx]
-            if msg.type == 'note_on' and msg.velocity > 0:
-                # Start a new group
-                current_group = []
-                group_start_time = abs_time_event
-
-                # Collect all notes starting at the same time
-                while idx < len(events):
-                    event_time, event_msg = events[idx]
-                    if event_time != group_start_time:
-                        break
-                    if event_msg.type == 'note_on' and event_msg.velocity > 0:
-                        current_group.append((event_time, event_msg))
-                    idx += 1
-                note_groups.append((group_start_time, current_group))
-            else:
-                idx += 1
-
-        # Adjust durations for each note group
-        adjusted_events = []
-        for group_idx, (group_start_time, group_notes) in enumerate(note_groups):
-            # Find the start time of the next note group
-            if group_idx + 1 < len(note_groups):
-                next_group_start_time = note_groups[group_idx + 1][0]
-                rest_duration = next_group_start_time - group_start_time
-            else:
-                # If this is the last group, find the earliest note_off among the notes
-                rest_duration = None
-                earliest_note_off_time = None
-                for idx in range(len(events)):
-                    event_time, event_msg = events[idx]
-                    if event_time > group_start_time and ((event_msg.type == 'note_off') or (event_msg.type == 'note_on' and event_msg.velocity == 0)):
-                        if any(event_msg.note == note_msg.note and event_msg.channel == note_msg.channel for _, note_msg in group_notes):
-                            if earliest_note_off_time is None or event_time < earliest_note_off_time:
-                                earliest_note_off_time = event_time
-                if earliest_note_off_time is not None:
-                    rest_duration = earliest_note_off_time - group_start_time
-                else:
-                    rest_duration = ticks_per_quarter  # Default to maximum duration
-
-            # Desired duration is until the next note group or maximum quarter note
-            if rest_duration <= ticks_per_quarter:
-                desired_duration = rest_duration
-            else:
-                desired_duration = ticks_per_quarter
-
-            # Clamp the duration between minimum and maximum values
-            desired_duration = max(ticks_per_sixteenth, min(desired_duration, ticks_per_quarter))
-
-            # Add note_on events for all notes in the group
-            for note_time, note_msg in group_notes:
-                adjusted_events.append((group_start_time, note_msg.copy(time=0)))
-
-            # Add note_off events for all notes in the group at the adjusted time
-            adjusted_note_off_time = group_start_time + desired_duration
-            for note_time, note_msg in group_notes:
-                adjusted_events.append((adjusted_note_off_time, Message('note_off', note=note_msg.note, velocity=0, time=0, channel=note_msg.channel)))
-
-        # Add non-note events (e.g., control changes, tempo changes)
-        for abs_time_event, msg in events:
-            if not (msg.type in ['note_on', 'note_off'] and hasattr(msg, 'note')):
-                adjusted_events.append((abs_time_event, msg))
-
-        # Sort adjusted events by absolute time and event type
-        adjusted_events.sort(key=lambda x: (x[0], 0 if x[1].type == 'note_off' else 1))
-
-        # Recalculate delta times and add to new track
-        prev_time = 0
-        for abs_time_event, msg in adjusted_events:
-            delta_time = abs_time_event - prev_time
-            prev_time = abs_time_event
-            new_msg = msg.copy(time=delta_time)
-            new_track.append(new_msg)
-
-    # Save the adjusted MIDI file
-    try:
-        new_mid.save(output_file)
-        print(f'Prettyified MIDI saved to {output_file}')
-    except IOError:
-        print(f"Error: Cannot save MIDI file to '{output_file}'. Please check the output directory permissions.")
-    except Exception as e:
-        print(f"Error: {e}")
+    # Process all tracks at once, keeping the order of events within each track
+    events = midi_events.array[np.argsort(midi_events.array['track'], kind='stable')]
+    if len(events) == 0:
+        return midi_events
+    tracks = events['track']
+    times = events['time']
+    is_note = events['type'] <= NOTE_ON
+    is_note_on = (events['type'] == NOTE_ON) & (events['velocity'] > 0)
+    is_note_off = (events['type'] == NOTE_OFF) | ((events['type'] == NOTE_ON) & (events['velocity'] == 0))
+
+    # Note groups are the notes starting at the same time: every run of consecutive
+    # events with the same time that contains note_on events forms one group
+    run_ids = np.cumsum((np.diff(times, prepend=times[0] - 1) != 0) | (np.diff(tracks, prepend=-1) != 0))
+    note_ons = events[is_note_on]
+    group_ids = np.cumsum(np.diff(run_ids[is_note_on], prepend=-1) != 0) - 1
+    group_firsts = np.flatnonzero(np.diff(group_ids, prepend=-1))
+    group_start_times = note_ons['time'][group_firsts]
+    group_tracks = note_ons['track'][group_firsts]
+
+    # The rest duration is the distance to the start of the next note group in the track
+    is_last_group = np.append(group_tracks[1:] != group_tracks[:-1], True)[:len(group_tracks)]
+    rest_durations = np.append(group_start_times[1:], 0) - group_start_times
+
+    # For the last group of a track, use the earliest note_off among its notes instead,
+    # or default to the maximum duration
+    last_group_notes = is_last_group[group_ids]
+    earliest_note_offs = _earliest_note_offs(
+        events, note_ons[last_group_notes], note_ons['time'][last_group_notes], is_note_off
+    )
+    last_rests = np.full(len(group_start_times), np.iinfo(np.int64).max)
+    has_note_off = earliest_note_offs >= 0
+    np.minimum.at(last_rests, group_ids[last_group_notes][has_note_off], earliest_note_offs[has_note_off])
+    last_rests = np.where(last_rests == np.iinfo(np.int64).max, ticks_per_quarter, last_rests - group_start_times)
+    rest_durations = np.where(is_last_group, last_rests, rest_durations)
+
+    # Desired duration is until the next note group, clamped between a 16th and a quarter note
+    desired_durations = np.clip(rest_durations, ticks_per_sixteenth, ticks_per_quarter)
+
+    # Add note_off events for all notes in the group at the adjusted time
+    note_offs = note_ons.copy()
+    note_offs['time'] = note_ons['time'] + desired_durations[group_ids]
+    note_offs['type'] = NOTE_OFF
+    note_offs['velocity'] = 0
+
+    # Add non-note events (e.g., control changes, tempo changes)
+    others = events[~is_note]
+    adjusted_events = np.concatenate([note_ons, note_offs, others])
+
+    # Within a track, each group's note_ons come before its note_offs, followed by the
+    # other events, and ties in the sort below keep that order
+    num_notes = len(note_ons)
+    group_keys = np.concatenate([group_ids, group_ids, np.full(len(others), len(group_start_times))])
+    kinds = np.repeat([0, 1, 2], [num_notes, num_notes, len(others)])
+    insertion_order = np.empty(len(adjusted_events), dtype=np.int64)
+    insertion_order[np.lexsort((np.arange(len(adjusted_events)), kinds, group_keys))] = np.arange(len(adjusted_events))
+
+    # Sort adjusted events by absolute time and event type
+    order = np.lexsort((insertion_order, adjusted_events['type'] != NOTE_OFF,
+                        adjusted_events['time'], adjusted_events['track']))
+    return midi_events.with_array(adjusted_events[order])
+
+
+def prettyify(input_file: str, output_dir: str):
+    return run_stage_on_file(prettyify_events, input_file, output_dir, 'prettyified')
 
 
 if __name__ == '__main__':
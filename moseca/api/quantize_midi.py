@@ -1,25 +1,13 @@
-from pathlib import Path
+from functools import partial
 import mido
-import os
+import numpy as np
 import sys
-from mido import MidiFile, MidiTrack, Message, MetaMessage
+from mido import MetaMessage
+from moseca.api.midi_events import MidiEvents, NOTE_ON, SET_TEMPO
+from moseca.api.midi_pipeline import run_stage_on_file
 
-def quantize_midi(input_file: str, bpm: int, output_dir: str):
-    # Get the file name without directory
-    file_name = os.path.basename(input_file)
-    output_file = os.path.join(output_dir, f'quantized_{file_name}')
-
-    # Load the MIDI file
-    try:
-        mid = MidiFile(input_file)
-    except IOError:
-        print(f"Error: Cannot open MIDI file '{input_file}'. Please check the file path.")
-        return
-    except Exception as e:
-        print(f"Error: {e}")
-        return
-
-    ticks_per_beat = mid.ticks_per_beat
+def quantize_events(events: MidiEvents, bpm: int) -> MidiEvents:
+    ticks_per_beat = events.ticks_per_beat
 
     # Calculate ticks per 16th note
     ticks_per_16th = ticks_per_beat // 4  # 4 sixteenth notes per quarter note
@@ -27,57 +15,26 @@ def quantize_midi(input_file: str, bpm: int, output_dir: str):
     # Calculate the new tempo (microseconds per beat)
     new_tempo = mido.bpm2tempo(bpm)
 
-    # Create a new MidiFile for output
-    quantized_mid = MidiFile(ticks_per_beat=mid.ticks_per_beat)
-
-    # Process each track
-    for i, track in enumerate(mid.tracks):
-        quantized_track = MidiTrack()
-        quantized_mid.tracks.append(quantized_track)
+    # Drop existing tempo messages
+    array = events.array[events.array['type'] != SET_TEMPO].copy()
 
-        abs_time = 0  # Absolute time in ticks
-        events = []  # List to hold all events with absolute times
+    # Quantize note timings for all notes, other messages (e.g., control changes) keep their time
+    note_mask = array['type'] <= NOTE_ON
+    array['time'][note_mask] = np.round(array['time'][note_mask] / ticks_per_16th).astype(np.int64) * ticks_per_16th
 
-        # Collect all events and calculate absolute times
-        for msg in track:
-            abs_time += msg.time
-            if not (msg.is_meta and msg.type == 'set_tempo'):
-                events.append((abs_time, msg))
-
-        # Insert new tempo message at the beginning of the first track
-        if i == 0:
-            quantized_track.append(MetaMessage('set_tempo', tempo=new_tempo, time=0))
+    # Insert new tempo message at the beginning of the first track
+    if events.num_tracks > 0:
+        quantized = events.with_meta(array, [MetaMessage('set_tempo', tempo=new_tempo, time=0)], 0, 0)
+    else:
+        quantized = events.with_array(array)
 
-        # Quantize note timings for all notes
-        quantized_events = []
-        for abs_time_event, msg in events:
-            if msg.type in ['note_on', 'note_off']:
-                # Quantize note events
-                quantized_time = round(abs_time_event / ticks_per_16th) * ticks_per_16th
-                quantized_events.append((quantized_time, msg))
-            else:
-                # Other messages (e.g., control changes)
-                quantized_events.append((abs_time_event, msg))
+    # Sort all events by quantized time
+    return quantized.sort_by_time()
 
-        # Sort all events by quantized_time
-        quantized_events.sort(key=lambda x: x[0])
 
-        # Recalculate delta times and append to the quantized track
-        prev_time = 0
-        for abs_time_event, msg in quantized_events:
-            delta_time = abs_time_event - prev_time
-            prev_time = abs_time_event
-            new_msg = msg.copy(time=delta_time)
-            quantized_track.append(new_msg)
+def quantize_midi(input_file: str, bpm: int, output_dir: str):
+    return run_stage_on_file(partial(quantize_events, bpm=bpm), input_file, output_dir, 'quantized')
 
-    # Save the quantized MIDI file
-    try:
-        quantized_mid.save(output_file)
-        print(f'Quantized MIDI saved to {output_file}')
-    except IOError:
-        print(f"Error: Cannot save MIDI file to '{output_file}'. Please check the output directory permissions.")
-    except Exception as e:
-        print(f"Error: {e}")
 
 if __name__ == '__main__':
     if len(sys.argv) != 3:
@@ -0,0 +1,307 @@
+import abc
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+from urllib.parse import urlparse
+
+_CHUNK_SIZE = 1 << 20
+
+
+def artifact_key(*parts) -> str:
+    """Hashes the parts of a cache key into a key usable in file and object names."""
+    return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+class ArtifactCorrupted(Exception):
+    """Raised when the content of an artifact does not match its recorded digest."""
+
+
+class ArtifactStore(abc.ABC):
+    """
+    Content-addressed store of files shared by the API replicas. The content of a file is
+    stored once as a blob named by its SHA-256 digest, and each key points to a blob through
+    a small record holding the digest, size and file name. Files are streamed in chunks both
+    ways, and their digest and size are checked on every read.
+
+    Errors of the backend are logged and reported as misses, so the caches keep working
+    without the store.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.uploads = 0
+        self.corrupted = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    # Backend operations
+
+    @abc.abstractmethod
+    def _read_record(self, key: str) -> Optional[dict]:
+        """Returns the record of a key, or None if the key is not stored."""
+
+    @abc.abstractmethod
+    def _write_record(self, key: str, record: dict):
+        """Stores the record of a key, replacing any previous one."""
+
+    @abc.abstractmethod
+    def _has_blob(self, digest: str) -> bool:
+        """Returns whether a blob with the digest is stored."""
+
+    @abc.abstractmethod
+    def _upload_blob(self, digest: str, f: BinaryIO, size: int):
+        """Stores the content of an open file as the blob of the digest."""
+
+    @abc.abstractmethod
+    def _read_blob(self, digest: str) -> Iterator[bytes]:
+        """Yields the content of the blob of the digest in chunks."""
+
+    @abc.abstractmethod
+    def _delete_blob(self, digest: str):
+        """Removes the blob of the digest, if it is stored."""
+
+    # Public interface
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def put(self, key: str, path: str, filename: Optional[str] = None) -> Optional[str]:
+        """
+        Stores a file under a key, uploading its content unless a blob with the same digest exists.
+
+        Args:
+            key (str): Key of the artifact, like "midi/<artifact_key(...)>".
+            path (str): Path to the file.
+            filename (str, optional): Name of the file when it is read back. Defaults to its current name.
+
+        Returns:
+            str: The SHA-256 digest of the file, or None if it could not be stored.
+        """
+        try:
+            # Hash first, since the blob is named by its digest
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            digest = digest.hexdigest()
+            size = os.path.getsize(path)
+            if not self._has_blob(digest):
+                with open(path, "rb") as f:
+                    self._upload_blob(digest, f, size)
+                self._count("uploads")
+            self._write_record(key, {"sha256": digest, "size": size, "name": filename or os.path.basename(path)})
+            return digest
+        except Exception as e:
+            self._count("errors")
+            print(f"Error storing artifact {key}: {e}")
+            return None
+
+    def get(self, key: str, directory: str) -> Optional[Path]:
+        """
+        Downloads the file of a key into a directory and checks its digest and size.
+
+        Args:
+            key (str): Key of the artifact.
+            directory (str): Directory to write the file to, under its stored name.
+
+        Returns:
+            Path: The path of the downloaded file, or None on a miss or a corrupted artifact.
+        """
+        try:
+            record = self._read_record(key)
+            if record is None:
+                self._count("misses")
+                return None
+            destination = Path(directory) / os.path.basename(record["name"])
+            tmp_path = destination.with_name(f".{destination.name}.{uuid.uuid4().hex}.tmp")
+            try:
+                digest = hashlib.sha256()
+                size = 0
+                with open(tmp_path, "wb") as f:
+                    for chunk in self._read_blob(record["sha256"]):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        f.write(chunk)
+                if digest.hexdigest() != record["sha256"] or size != record["size"]:
+                    raise ArtifactCorrupted(
+                        f"expected {record['sha256']} ({record['size']} bytes), got {digest.hexdigest()} ({size} bytes)"
+                    )
+                os.replace(tmp_path, destination)
+            finally:
+                if tmp_path.exists():
+                    tmp_path.unlink()
+            self._count("hits")
+            return destination
+        except ArtifactCorrupted as e:
+            self._count("corrupted")
+            self._count("misses")
+            print(f"Corrupted artifact {key}, removing its blob: {e}")
+            try:
+                self._delete_blob(record["sha256"])
+            except Exception:
+                pass
+            return None
+        except Exception as e:
+            self._count("errors")
+            self._count("misses")
+            print(f"Error reading artifact {key}: {e}")
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "uploads": self.uploads,
+                "corrupted": self.corrupted,
+                "errors": self.errors,
+            }
+
+
+def _record_name(key: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_./-]", "_", key).strip("/").replace("..", "_")
+
+
+class LocalArtifactStore(ArtifactStore):
+    """Artifact store in a directory, e.g. on a volume shared by the replicas of a host or over NFS."""
+
+    def __init__(self, root: str):
+        super().__init__()
+        self.root = Path(root)
+        (self.root / "blobs").mkdir(parents=True, exist_ok=True)
+        (self.root / "refs").mkdir(parents=True, exist_ok=True)
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.root / "blobs" / digest[:2] / digest
+
+    def _replace(self, path: Path, write):
+        """Writes a file through a temporary file, so readers never see it partially written."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def _read_record(self, key: str) -> Optional[dict]:
+        try:
+            with open(self.root / "refs" / f"{_record_name(key)}.json") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_record(self, key: str, record: dict):
+        self._replace(self.root / "refs" / f"{_record_name(key)}.json", lambda f: f.write(json.dumps(record).encode()))
+
+    def _has_blob(self, digest: str) -> bool:
+        return self._blob_path(digest).exists()
+
+    def _upload_blob(self, digest: str, f: BinaryIO, size: int):
+        self._replace(self._blob_path(digest), lambda out: shutil.copyfileobj(f, out, _CHUNK_SIZE))
+
+    def _read_blob(self, digest: str) -> Iterator[bytes]:
+        with open(self._blob_path(digest), "rb") as f:
+            yield from iter(lambda: f.read(_CHUNK_SIZE), b"")
+
+    def _delete_blob(self, digest: str):
+        self._blob_path(digest).unlink(missing_ok=True)
+
+
+class S3ArtifactStore(ArtifactStore):
+    """
+    Artifact store in an S3-compatible bucket, such as MinIO. Blobs are uploaded with
+    multipart uploads and downloaded chunk by chunk, and carry their digest as metadata.
+
+    Any client with the boto3 S3 client methods used here can be passed instead of boto3,
+    which is then not needed.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None, client=None):
+        super().__init__()
+        if client is None:
+            try:
+                import boto3
+            except ImportError as e:
+                raise ImportError("The S3 artifact store needs boto3: pip install boto3") from e
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _object_key(self, *parts: str) -> str:
+        return "/".join(filter(None, (self.prefix, *parts)))
+
+    def _blob_key(self, digest: str) -> str:
+        return self._object_key("blobs", digest[:2], digest)
+
+    @staticmethod
+    def _is_not_found(e: Exception) -> bool:
+        error = getattr(e, "response", {}).get("Error", {})
+        return str(error.get("Code")) in ("404", "NoSuchKey", "NotFound")
+
+    def _read_record(self, key: str) -> Optional[dict]:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._object_key("refs", f"{_record_name(key)}.json"))
+        except Exception as e:
+            if self._is_not_found(e):
+                return None
+            raise
+        return json.loads(response["Body"].read())
+
+    def _write_record(self, key: str, record: dict):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self._object_key("refs", f"{_record_name(key)}.json"),
+            Body=json.dumps(record).encode(),
+            ContentType="application/json",
+        )
+
+    def _has_blob(self, digest: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._blob_key(digest))
+        except Exception as e:
+            if self._is_not_found(e):
+                return False
+            raise
+        return True
+
+    def _upload_blob(self, digest: str, f: BinaryIO, size: int):
+        self.client.upload_fileobj(f, self.bucket, self._blob_key(digest), ExtraArgs={"Metadata": {"sha256": digest}})
+
+    def _read_blob(self, digest: str) -> Iterator[bytes]:
+        response = self.client.get_object(Bucket=self.bucket, Key=self._blob_key(digest))
+        yield from response["Body"].iter_chunks(_CHUNK_SIZE)
+
+    def _delete_blob(self, digest: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._blob_key(digest))
+
+
+def artifact_store_from_url(url: Optional[str]) -> Optional[ArtifactStore]:
+    """
+    Creates the artifact store of a URL: a directory path or file:///path for a local
+    store, or s3://bucket/prefix for an S3-compatible one, whose endpoint is read from
+    ARTIFACT_STORE_ENDPOINT_URL (e.g. a MinIO server). Returns None when no URL is set.
+    """
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "s3":
+        return S3ArtifactStore(
+            parsed.netloc, parsed.path, endpoint_url=os.environ.get("ARTIFACT_STORE_ENDPOINT_URL") or None
+        )
+    if parsed.scheme == "file":
+        return LocalArtifactStore(parsed.path)
+    if parsed.scheme == "":
+        return LocalArtifactStore(url)
+    raise ValueError(f"Unsupported artifact store URL: {url}")
@@ -0,0 +1,88 @@
+import json
+import os
+import subprocess
+
+import soundfile as sf
+
+# Longest accepted audio in seconds, the same limit as for YouTube downloads
+MAX_AUDIO_SECONDS = float(os.environ.get("MAX_AUDIO_SECONDS", 360))
+
+
+class AudioProbeError(ValueError):
+    """Raised when a file is not audio that can be processed."""
+
+
+class AudioTooLong(AudioProbeError):
+    """Raised when audio is longer than the maximum duration."""
+
+
+def _probe_with_ffprobe(audio_file: str) -> dict:
+    command = ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+               '-show_entries', 'stream=codec_name,sample_rate,channels,duration:format=format_name,duration',
+               '-of', 'json', audio_file]
+    try:
+        result = subprocess.run(command, check=True, capture_output=True, text=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise AudioProbeError(f"Cannot read audio file '{os.path.basename(audio_file)}'.") from e
+
+    info = json.loads(result.stdout or '{}')
+    streams = info.get('streams') or []
+    if not streams:
+        raise AudioProbeError(f"No audio stream in '{os.path.basename(audio_file)}'.")
+    stream = streams[0]
+    duration = stream.get('duration') or info.get('format', {}).get('duration')
+    return {
+        'duration': float(duration) if duration is not None else None,
+        'samplerate': int(stream.get('sample_rate', 0)),
+        'channels': int(stream.get('channels', 0)),
+        'codec': stream.get('codec_name'),
+        'format': info.get('format', {}).get('format_name'),
+    }
+
+
+def probe_audio(audio_file: str) -> dict:
+    """
+    Reads the duration, sample rate, channel count and codec of an audio file from its
+    headers, without decoding the audio. Formats soundfile cannot read (like M4A or WebM)
+    are probed with ffprobe.
+
+    Args:
+        audio_file (str): Path to the audio file.
+
+    Returns:
+        dict: 'duration' in seconds (None if the container does not store it),
+        'samplerate', 'channels', 'codec' and 'format'.
+
+    Raises:
+        AudioProbeError: If the file cannot be read as audio.
+    """
+    try:
+        info = sf.info(audio_file)
+    except Exception:
+        return _probe_with_ffprobe(audio_file)
+
+    if info.frames <= 0 or info.samplerate <= 0:
+        raise AudioProbeError(f"No audio in '{os.path.basename(audio_file)}'.")
+    return {
+        'duration': info.duration,
+        'samplerate': info.samplerate,
+        'channels': info.channels,
+        'codec': info.subtype,
+        'format': info.format,
+    }
+
+
+def check_audio(audio_file: str, max_seconds: float = MAX_AUDIO_SECONDS) -> dict:
+    """
+    Probes an audio file and checks that it is not longer than max_seconds.
+
+    Raises:
+        AudioProbeError: If the file cannot be read as audio.
+        AudioTooLong: If the audio is longer than max_seconds.
+    """
+    probe = probe_audio(audio_file)
+    if probe['duration'] is not None and probe['duration'] > max_seconds:
+        raise AudioTooLong(
+            f"Song is too long. Please use a song no longer than {max_seconds / 60:g} minutes."
+        )
+    return probe
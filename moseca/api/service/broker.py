@@ -0,0 +1,555 @@
+import abc
+import asyncio
+import base64
+import io
+import json
+import os
+import pickle
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+from pathlib import Path, PurePosixPath
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+
+# Seconds a worker holds a job before another worker may take it over, if it dies
+DEFAULT_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 3600))
+
+# Runs of a job, including takeovers after lost workers, before it fails
+MAX_ATTEMPTS = 3
+
+# Seconds between two checks of the status of a job by the API
+POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 0.5))
+
+_CHUNK_SIZE = 1 << 20
+
+
+class JobFailed(Exception):
+    """Raised when a job failed on a worker."""
+
+
+class JobInput:
+    """An input file of a job, uploaded with it and downloaded by the worker."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class JobOutputDir:
+    """An output directory of a job, whose files the worker uploads when the job is done."""
+
+    def __init__(self, index: int):
+        self.index = index
+
+
+class JobOutputPath:
+    """A path inside an output directory, in the result of a job."""
+
+    def __init__(self, index: int, relative: str):
+        self.index = index
+        self.relative = relative
+
+
+def pack_arguments(args: tuple, kwargs: dict) -> Tuple[tuple, dict, Dict[str, str], Dict[int, Path]]:
+    """
+    Replaces the local paths in the arguments of a job: files become JobInput uploaded
+    with the job, and directories become JobOutputDir filled from the job outputs.
+
+    Returns:
+        Tuple: The packed args and kwargs, the input files by name and the output
+        directories by index.
+    """
+    inputs = {}
+    output_dirs = {}
+
+    def pack(value):
+        if isinstance(value, (list, tuple)):
+            return type(value)(pack(item) for item in value)
+        if isinstance(value, Path):
+            if value.is_file():
+                name = f"{len(inputs)}/{value.name}"
+                inputs[name] = str(value)
+                return JobInput(name)
+            if value.is_dir():
+                index = len(output_dirs)
+                output_dirs[index] = value
+                return JobOutputDir(index)
+        return value
+
+    return pack(args), {key: pack(value) for key, value in kwargs.items()}, inputs, output_dirs
+
+
+def unpack_result(value, output_dirs: Dict[int, Path]):
+    """Maps the JobOutputPath values of a job result to the local output directories."""
+    if isinstance(value, (list, tuple)):
+        return type(value)(unpack_result(item, output_dirs) for item in value)
+    if isinstance(value, JobOutputPath):
+        return output_dirs[value.index] / value.relative
+    return value
+
+
+class Broker(abc.ABC):
+    """
+    Queue of jobs shared by the API nodes, which enqueue jobs and wait for their results,
+    and the workers, which claim jobs, run them and publish their outputs.
+
+    Jobs are pickled, so the API nodes and workers must trust each other.
+    """
+
+    @abc.abstractmethod
+    def enqueue(self, job_type: str, payload: bytes, input_files: Dict[str, str]) -> str:
+        """Queues a job with its input files by name, and returns the job ID."""
+
+    @abc.abstractmethod
+    def claim(self, worker_id: str, job_types: Optional[List[str]] = None,
+              lease_seconds: float = DEFAULT_LEASE_SECONDS) -> Optional[Tuple[str, str, bytes]]:
+        """Takes the oldest queued job of the given types, and returns (job ID, job type, payload)."""
+
+    @abc.abstractmethod
+    def download_files(self, job_id: str, kind: str, path_for: Callable[[str], Path]) -> List[str]:
+        """Writes the "input" or "output" files of a job to path_for(name), and returns their names."""
+
+    @abc.abstractmethod
+    def complete(self, job_id: str, result: bytes, output_files: Dict[str, str]):
+        """Publishes the result and the output files of a job."""
+
+    @abc.abstractmethod
+    def fail(self, job_id: str, error: str):
+        """Marks a job as failed with an error message."""
+
+    @abc.abstractmethod
+    def poll(self, job_id: str) -> Tuple[str, Optional[bytes], Optional[str]]:
+        """Returns the status ("queued", "running", "done", "failed" or "missing"), result and error of a job."""
+
+    @abc.abstractmethod
+    def delete(self, job_id: str):
+        """Removes a job and its files, e.g. once the API has its result."""
+
+
+class InProcessBroker(Broker):
+    """A broker in the memory of a single process, for tests and local development."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def enqueue(self, job_type, payload, input_files):
+        job_id = uuid.uuid4().hex
+        files = {}
+        for name, path in input_files.items():
+            with open(path, "rb") as f:
+                files[("input", name)] = f.read()
+        with self._lock:
+            self._files[job_id] = files
+            self._jobs[job_id] = {
+                "job_type": job_type, "payload": payload, "status": "queued", "attempts": 0,
+                "lease_until": None, "result": None, "error": None, "created_at": time.time(),
+            }
+        return job_id
+
+    def claim(self, worker_id, job_types=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+        now = time.time()
+        with self._lock:
+            for job_id, job in sorted(self._jobs.items(), key=lambda item: item[1]["created_at"]):
+                if job_types is not None and job["job_type"] not in job_types:
+                    continue
+                expired = job["status"] == "running" and job["lease_until"] < now
+                if expired and job["attempts"] >= MAX_ATTEMPTS:
+                    job.update(status="failed", error="The job was lost by its workers")
+                elif job["status"] == "queued" or expired:
+                    job.update(status="running", lease_until=now + lease_seconds, attempts=job["attempts"] + 1)
+                    return job_id, job["job_type"], job["payload"]
+        return None
+
+    def download_files(self, job_id, kind, path_for):
+        with self._lock:
+            files = dict(self._files.get(job_id, {}))
+        names = []
+        for (file_kind, name), data in sorted(files.items()):
+            if file_kind != kind:
+                continue
+            path = path_for(name)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(data)
+            names.append(name)
+        return names
+
+    def complete(self, job_id, result, output_files):
+        files = {}
+        for name, path in output_files.items():
+            with open(path, "rb") as f:
+                files[("output", name)] = f.read()
+        with self._lock:
+            if job_id in self._jobs:
+                self._files[job_id].update(files)
+                self._jobs[job_id].update(status="done", result=result)
+
+    def fail(self, job_id, error):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(status="failed", error=error)
+
+    def poll(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return "missing", None, None
+            return job["status"], job["result"], job["error"]
+
+    def delete(self, job_id):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._files.pop(job_id, None)
+
+
+class SQLiteBroker(Broker):
+    """
+    A broker in a SQLite database, shared by the API and worker processes of a single host.
+    Files are streamed in and out of the database in chunks.
+
+    The database uses write-ahead logging, which needs shared memory between the processes,
+    and SQLite locking is unreliable on network filesystems, so the database must be on a
+    local disk and not on a volume shared by several hosts.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, job_type TEXT, payload BLOB, "
+                "status TEXT, attempts INTEGER, worker TEXT, lease_until REAL, result BLOB, error TEXT, "
+                "created_at REAL, updated_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, created_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files (job_id TEXT, kind TEXT, name TEXT, data BLOB, "
+                "PRIMARY KEY (job_id, kind, name))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode, with explicit transactions where needed
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _write_file(self, conn: sqlite3.Connection, job_id: str, kind: str, name: str, path: str):
+        size = os.path.getsize(path)
+        cursor = conn.execute(
+            "INSERT OR REPLACE INTO files (job_id, kind, name, data) VALUES (?, ?, ?, zeroblob(?))",
+            (job_id, kind, name, size),
+        )
+        with open(path, "rb") as f:
+            if hasattr(conn, "blobopen"):
+                with conn.blobopen("files", "data", cursor.lastrowid) as blob:
+                    for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                        blob.write(chunk)
+            else:
+                # Python before 3.11 has no incremental blob I/O
+                conn.execute("UPDATE files SET data = ? WHERE rowid = ?", (f.read(), cursor.lastrowid))
+
+    def enqueue(self, job_type, payload, input_files):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            for name, path in input_files.items():
+                self._write_file(conn, job_id, "input", name, path)
+            conn.execute(
+                "INSERT INTO jobs (id, job_type, payload, status, attempts, created_at, updated_at) "
+                "VALUES (?, ?, ?, 'queued', 0, ?, ?)",
+                (job_id, job_type, payload, now, now),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return job_id
+
+    def claim(self, worker_id, job_types=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+        now = time.time()
+        type_filter, parameters = "", []
+        if job_types is not None:
+            type_filter = f" AND job_type IN ({','.join('?' * len(job_types))})"
+            parameters = list(job_types)
+        conn = self._connect()
+        try:
+            # Take the write lock first, so two workers never claim the same job
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'The job was lost by its workers', updated_at = ? "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, MAX_ATTEMPTS),
+            )
+            row = conn.execute(
+                "SELECT id, job_type, payload FROM jobs WHERE (status = 'queued' OR "
+                f"(status = 'running' AND lease_until < ?)){type_filter} ORDER BY created_at LIMIT 1",
+                [now] + parameters,
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE id = ?",
+                    (worker_id, now + lease_seconds, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return tuple(row) if row is not None else None
+
+    def download_files(self, job_id, kind, path_for):
+        conn = self._connect()
+        names = []
+        try:
+            rows = conn.execute(
+                "SELECT rowid, name FROM files WHERE job_id = ? AND kind = ? ORDER BY name", (job_id, kind)
+            ).fetchall()
+            for rowid, name in rows:
+                path = path_for(name)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                with open(path, "wb") as f:
+                    if hasattr(conn, "blobopen"):
+                        with conn.blobopen("files", "data", rowid, readonly=True) as blob:
+                            for chunk in iter(lambda: blob.read(_CHUNK_SIZE), b""):
+                                f.write(chunk)
+                    else:
+                        f.write(conn.execute("SELECT data FROM files WHERE rowid = ?", (rowid,)).fetchone()[0])
+                names.append(name)
+        finally:
+            conn.close()
+        return names
+
+    def complete(self, job_id, result, output_files):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            # The job may have been deleted, e.g. when the client disconnected
+            if conn.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)).fetchone() is not None:
+                for name, path in output_files.items():
+                    self._write_file(conn, job_id, "output", name, path)
+                conn.execute(
+                    "UPDATE jobs SET status = 'done', result = ?, updated_at = ? WHERE id = ?",
+                    (result, time.time(), job_id),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def fail(self, job_id, error):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                (error, time.time(), job_id),
+            )
+        finally:
+            conn.close()
+
+    def poll(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT status, result, error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return tuple(row) if row is not None else ("missing", None, None)
+
+    def delete(self, job_id):
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            conn.execute("DELETE FROM files WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+
+def write_job_archive(f: BinaryIO, values: Dict[str, bytes], files: Dict[str, str]):
+    """
+    Writes values and files to an uncompressed tar stream, the body of the requests of the
+    HTTP broker that carry files. Values are stored under their name and files under
+    "files/<name>".
+    """
+    with tarfile.open(fileobj=f, mode="w|") as archive:
+        for name, data in values.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+        for name, path in files.items():
+            info = tarfile.TarInfo(f"files/{name}")
+            info.size = os.path.getsize(path)
+            with open(path, "rb") as file:
+                archive.addfile(info, file)
+
+
+def read_job_archive(f: BinaryIO, path_for: Callable[[str], Path]) -> Tuple[Dict[str, bytes], List[str]]:
+    """
+    Reads a tar stream written by write_job_archive, writing its files to path_for(name).
+
+    Returns:
+        Tuple: The values by name, and the names of the files.
+
+    Raises:
+        ValueError: If the archive holds anything but regular files with relative names.
+    """
+    values, names = {}, []
+    with tarfile.open(fileobj=f, mode="r|") as archive:
+        for member in archive:
+            parts = PurePosixPath(member.name).parts
+            if not member.isfile() or member.name.startswith("/") or ".." in parts:
+                raise ValueError(f"Unexpected entry in a job archive: {member.name}")
+            source = archive.extractfile(member)
+            if parts[0] != "files":
+                values[member.name] = source.read()
+                continue
+            name = "/".join(parts[1:])
+            path = path_for(name)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "wb") as out:
+                shutil.copyfileobj(source, out, _CHUNK_SIZE)
+            names.append(name)
+    return values, names
+
+
+class HTTPBroker(Broker):
+    """
+    Client of a broker served over HTTP by moseca.api.broker_server, for API nodes and
+    workers on other hosts than the broker. Files are streamed in both directions as tar
+    archives, and every request carries the token of the server.
+    """
+
+    def __init__(self, url: str, token: Optional[str] = None, timeout: float = 60):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, body=None, content_type: str = "application/json",
+                 length: Optional[int] = None):
+        headers = {}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if body is not None:
+            headers["Content-Type"] = content_type
+            if length is not None:
+                headers["Content-Length"] = str(length)
+        request = urllib.request.Request(f"{self.url}{path}", data=body, headers=headers, method=method)
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _json(self, method: str, path: str, data: Optional[dict] = None):
+        body = None if data is None else json.dumps(data).encode()
+        with self._request(method, path, body) as response:
+            return json.load(response)
+
+    def _send_archive(self, path: str, values: Dict[str, bytes], files: Dict[str, str]):
+        with tempfile.TemporaryFile() as f:
+            write_job_archive(f, values, files)
+            length = f.tell()
+            f.seek(0)
+            with self._request("POST", path, f, "application/x-tar", length) as response:
+                return json.load(response)
+
+    def enqueue(self, job_type, payload, input_files):
+        query = urllib.parse.urlencode({"job_type": job_type})
+        return self._send_archive(f"/jobs?{query}", {"payload": payload}, input_files)["job_id"]
+
+    def claim(self, worker_id, job_types=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+        job = self._json("POST", "/claim", {
+            "worker_id": worker_id, "job_types": job_types, "lease_seconds": lease_seconds,
+        })["job"]
+        if job is None:
+            return None
+        return job["job_id"], job["job_type"], base64.b64decode(job["payload"])
+
+    def download_files(self, job_id, kind, path_for):
+        with self._request("GET", f"/jobs/{job_id}/files/{kind}") as response:
+            return read_job_archive(response, path_for)[1]
+
+    def complete(self, job_id, result, output_files):
+        self._send_archive(f"/jobs/{job_id}/complete", {"result": result}, output_files)
+
+    def fail(self, job_id, error):
+        self._json("POST", f"/jobs/{job_id}/fail", {"error": error})
+
+    def poll(self, job_id):
+        job = self._json("GET", f"/jobs/{job_id}")
+        result = None if job["result"] is None else base64.b64decode(job["result"])
+        return job["status"], result, job["error"]
+
+    def delete(self, job_id):
+        self._json("DELETE", f"/jobs/{job_id}")
+
+
+def broker_from_url(url: Optional[str]) -> Optional[Broker]:
+    """
+    Returns the broker of a JOB_BROKER setting: "memory" for an in-process broker,
+    "sqlite:///path/to/jobs.db" for a SQLite broker on this host, "http://host:port" for
+    a broker server on another host, with the token read from JOB_BROKER_TOKEN, or None
+    when jobs run locally.
+    """
+    if not url:
+        return None
+    if url == "memory":
+        return InProcessBroker()
+    if url.startswith("sqlite:///"):
+        return SQLiteBroker(url[len("sqlite:///"):])
+    if url.startswith(("http://", "https://")):
+        return HTTPBroker(url, os.environ.get("JOB_BROKER_TOKEN"))
+    raise ValueError(f"Unsupported job broker: {url}")
+
+
+async def run_remote(broker: Broker, job_type: str, target: str, args: tuple, kwargs: dict,
+                     poll_interval: float = POLL_INTERVAL, timeout: Optional[float] = None):
+    """
+    Enqueues a job for the workers and waits for it. Input files in the arguments are uploaded
+    with the job, and the outputs of the job are downloaded into the local output directories.
+
+    Returns:
+        Tuple: The result of the job, its stage timings and the time it started at, like
+        call_with_timings.
+
+    Raises:
+        JobFailed: If the job failed on the worker, or did not finish within `timeout` seconds,
+        e.g. because no worker runs its type. The job is then removed from the broker.
+    """
+    packed_args, packed_kwargs, inputs, output_dirs = pack_arguments(args, kwargs)
+    payload = pickle.dumps({"target": target, "args": packed_args, "kwargs": packed_kwargs})
+    job_id = await asyncio.to_thread(broker.enqueue, job_type, payload, inputs)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            status, result, error = await asyncio.to_thread(broker.poll, job_id)
+            if status == "done":
+                break
+            if status in ("failed", "missing"):
+                raise JobFailed(error or f"Job {job_id} disappeared")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise JobFailed(f"Job {job_id} did not finish within {timeout:g} seconds while {status}")
+            await asyncio.sleep(poll_interval)
+
+        # Outputs are named "<output directory index>/<relative path>"
+        def output_path(name):
+            index, relative = name.split("/", 1)
+            return output_dirs[int(index)] / relative
+
+        await asyncio.to_thread(broker.download_files, job_id, "output", output_path)
+        value, timings, started_at = pickle.loads(result)
+        return unpack_result(value, output_dirs), timings, started_at
+    finally:
+        await asyncio.to_thread(broker.delete, job_id)
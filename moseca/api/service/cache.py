@@ -0,0 +1,326 @@
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Hashable, Optional
+
+if TYPE_CHECKING:
+    from moseca.api.service.artifacts import ArtifactStore
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Computes the SHA-256 hex digest of a file without reading it into memory at once.
+
+    Args:
+        path (str): Path to the file.
+        chunk_size (int): Number of bytes to read at a time.
+
+    Returns:
+        str: The hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(path: str, directory: str) -> str:
+    """Hard links a file into a directory, copying it on another filesystem, and returns its name."""
+    destination = os.path.join(directory, os.path.basename(path))
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(path, destination)
+    except OSError:
+        shutil.copyfile(path, destination)
+    return os.path.basename(destination)
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory cache holding at most `max_entries` items, evicting the least
+    recently used item first. Hits and misses are counted for metrics.
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class DiskCache:
+    """
+    Thread- and process-safe cache of files on disk, bounded by a total size in bytes. Each
+    entry is stored as `directory/<key>/<file name>`, so entries survive restarts, and the
+    least recently used unpinned entries are evicted first when the budget is exceeded.
+
+    The directory is the source of truth, so that the server processes sharing it share
+    the budget: entries are added and evicted under a file lock, after indexing the
+    directory again, and the access order is kept in the modification times of the files.
+
+    Entries can be pinned explicitly, or automatically once they reached `pin_after_hits`
+    hits, to keep popular items cached. Pinned entries still count towards the budget.
+    Pins are held by each process, so they only protect an entry from the evictions of
+    processes that pinned it too, as with the pins set from the configuration.
+
+    With an artifact store, local misses are read through from the store, and new entries
+    are written back to it under `namespace`, so that other replicas can use them.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, pin_after_hits: Optional[int] = None,
+                 store: Optional["ArtifactStore"] = None, namespace: Optional[str] = None):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.pin_after_hits = pin_after_hits
+        self.store = store
+        self.namespace = namespace or self.directory.name
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self.evictions = 0
+        self._hit_counts = {}
+        self._pinned = set()
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock_path = self.directory / ".lock"
+        self._entries = self._scan()  # key -> (path, size)
+
+    @staticmethod
+    def _entry_dir_name(key: str) -> str:
+        return re.sub(r"[^A-Za-z0-9_.-]", "_", str(key))
+
+    @contextmanager
+    def _locked(self):
+        """Holds the lock of the threads of this process and the file lock of the directory."""
+        with self._lock, open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _entry_file(entry_dir: Path) -> Optional[Path]:
+        """Returns the file of an entry directory, or None if it holds no single file."""
+        try:
+            files = [path for path in entry_dir.iterdir() if path.is_file() and not path.name.startswith(".")]
+        except OSError:
+            return None
+        return files[0] if len(files) == 1 else None
+
+    def _scan(self) -> OrderedDict:
+        """Indexes the entries on disk, least recently used first."""
+        entries = []
+        for entry_dir in self.directory.iterdir():
+            # Skip the lock, and the copies and downloads in progress
+            if entry_dir.name.startswith(".") or not entry_dir.is_dir():
+                continue
+            path = self._entry_file(entry_dir)
+            if path is None:
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, entry_dir.name, path, stat.st_size))
+        return OrderedDict((key, (path, size)) for _, key, path, size in sorted(entries))
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(size for _, size in self._entries.values())
+
+    def _lookup(self, key: str) -> Optional[Path]:
+        """Returns the path of a local entry and counts the hit or miss, with the thread lock held."""
+        # Look on disk, since the entry may have been added or evicted by another process
+        path = self._entry_file(self.directory / key)
+        if path is not None:
+            try:
+                # Keep the access order across processes and restarts
+                os.utime(path)
+                size = path.stat().st_size
+            except OSError:
+                path = None
+        if path is None:
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries[key] = (path, size)
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self._hit_counts[key] = self._hit_counts.get(key, 0) + 1
+        if self.pin_after_hits is not None and self._hit_counts[key] >= self.pin_after_hits:
+            self._pinned.add(key)
+        return path
+
+    def get(self, key: str) -> Optional[Path]:
+        """
+        Returns the path of the cached file, or None on a miss. Another process may evict
+        the entry at any time, so use get_into to copy it out.
+        """
+        key = self._entry_dir_name(key)
+        with self._lock:
+            path = self._lookup(key)
+        if path is not None or self.store is None:
+            return path
+        return self._read_through(key)
+
+    def get_into(self, key: str, directory: str) -> Optional[Path]:
+        """
+        Hard links or copies the cached file into a directory, under the lock that evictions
+        take, so the entry cannot be evicted in between.
+
+        Returns:
+            Path: The path of the file in the directory, or None on a miss.
+        """
+        key = self._entry_dir_name(key)
+        with self._locked():
+            path = self._lookup(key)
+            if path is not None:
+                return Path(directory) / link_or_copy(str(path), directory)
+        if self.store is None or self._read_through(key) is None:
+            return None
+        with self._locked():
+            # Another process may have evicted the downloaded entry already
+            path = self._entry_file(self.directory / key)
+            if path is None:
+                return None
+            return Path(directory) / link_or_copy(str(path), directory)
+
+    def _read_through(self, key: str) -> Optional[Path]:
+        """Downloads a missing entry from the artifact store into the cache."""
+        download_dir = self.directory / f".{key}.{uuid.uuid4().hex}.download"
+        download_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            downloaded = self.store.get(f"{self.namespace}/{key}", str(download_dir))
+            if downloaded is None:
+                return None
+            path = self._add(key, str(downloaded), downloaded.name, move=True)
+            if path is not None:
+                with self._lock:
+                    self.store_hits += 1
+            return path
+        finally:
+            shutil.rmtree(download_dir, ignore_errors=True)
+
+    def put(self, key: str, source_path: str, filename: Optional[str] = None) -> Optional[Path]:
+        """
+        Copies a file into the cache and evicts old entries to stay within the budget. With
+        an artifact store, the file is written back to it too.
+
+        Returns:
+            Path: The path of the cached copy, or None if the file is larger than the budget.
+        """
+        key = self._entry_dir_name(key)
+        if self.store is not None:
+            self.store.put(f"{self.namespace}/{key}", source_path, filename)
+        return self._add(key, source_path, filename)
+
+    def _add(self, key: str, source_path: str, filename: Optional[str] = None, move: bool = False) -> Optional[Path]:
+        size = os.path.getsize(source_path)
+        if size > self.max_bytes:
+            return None
+
+        # Copy next to the entries rather than into the entry, which another process may evict meanwhile
+        entry_dir = self.directory / key
+        path = entry_dir / (filename or os.path.basename(source_path))
+        tmp_path = self.directory / f".{key}.{uuid.uuid4().hex}.tmp"
+        try:
+            if move:
+                shutil.move(source_path, tmp_path)
+            else:
+                shutil.copyfile(source_path, tmp_path)
+            with self._locked():
+                entry_dir.mkdir(parents=True, exist_ok=True)
+                for stale in entry_dir.iterdir():
+                    if stale != path:
+                        stale.unlink(missing_ok=True)
+                os.replace(tmp_path, path)
+                self._entries = self._scan()
+                self._entries.move_to_end(key)
+                self._evict()
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return path
+
+    def _evict(self):
+        total = self.size_bytes
+        for key in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if key in self._pinned:
+                continue
+            _, size = self._entries.pop(key)
+            shutil.rmtree(self.directory / key, ignore_errors=True)
+            self._hit_counts.pop(key, None)
+            self.evictions += 1
+            total -= size
+
+    def pin(self, key: str):
+        """Keeps an entry cached regardless of how recently it was used."""
+        with self._lock:
+            self._pinned.add(self._entry_dir_name(key))
+
+    def unpin(self, key: str):
+        with self._locked():
+            self._pinned.discard(self._entry_dir_name(key))
+            self._entries = self._scan()
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "pinned": len(self._pinned),
+                "hits": self.hits,
+                "misses": self.misses,
+                "store_hits": self.store_hits,
+                "evictions": self.evictions,
+            }
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return self._entry_dir_name(key) in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
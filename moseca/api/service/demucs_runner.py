@@ -1,5 +1,6 @@
 import argparse
 import sys
+from functools import partial
 from pathlib import Path
 from typing import List
 import os
@@ -8,9 +9,12 @@ import torch as th
 
 from demucs.apply import apply_model, BagOfModels
 from demucs.audio import save_audio
-from demucs.pretrained import get_model_from_args, ModelLoadingError
+from demucs.pretrained import ModelLoadingError
 from demucs.separate import load_track
 
+from moseca.api.service.metrics import timed
+from moseca.api.service.models import MODELS, load_demucs_model
+
 
 def separator(
     tracks: List[Path],
@@ -53,8 +57,9 @@ def separator(
         jobs = 1
     else:
         # Number of jobs. This can increase memory usage but will be much faster when
-        # multiple cores are available.
-        jobs = os.cpu_count()
+        # multiple cores are available. The worker pools give each process its share of
+        # the cores through the thread count of PyTorch, so use that rather than every core.
+        jobs = th.get_num_threads()
 
     device = "cuda" if th.cuda.is_available() else "cpu"
 
@@ -79,8 +84,11 @@ def separator(
     args.name = model
     args.repo = None
 
+    # Models stay loaded in the worker process for the next jobs
+    if args.name not in MODELS:
+        MODELS.register(args.name, partial(load_demucs_model, args.name), stage="demucs_model_load")
     try:
-        model = get_model_from_args(args)
+        model = MODELS.get(args.name)
     except ModelLoadingError as error:
         fatal(error.args[0])
 
@@ -128,20 +136,22 @@ def separator(
         if verbose:
             print(f"Separating track {track}")
 
-        wav = load_track(track, model.audio_channels, model.samplerate)
+        with timed("decode"):
+            wav = load_track(track, model.audio_channels, model.samplerate)
 
         ref = wav.mean(0)
         wav = (wav - ref.mean()) / ref.std()
-        sources = apply_model(
-            model,
-            wav[None],
-            device=args.device,
-            shifts=args.shifts,
-            split=args.split,
-            overlap=args.overlap,
-            progress=verbose,
-            num_workers=args.jobs,
-        )[0]
+        with timed("demucs_inference"):
+            sources = apply_model(
+                model,
+                wav[None],
+                device=args.device,
+                shifts=args.shifts,
+                split=args.split,
+                overlap=args.overlap,
+                progress=verbose,
+                num_workers=args.jobs,
+            )[0]
         sources = sources * ref.std() + ref.mean()
 
         ext = "mp3" if args.mp3 else "wav"
@@ -165,7 +175,8 @@ def separator(
                     ext=ext,
                 )
                 stem_path.parent.mkdir(parents=True, exist_ok=True)
-                save_audio(source, str(stem_path), **kwargs)
+                with timed("stem_encode"):
+                    save_audio(source, str(stem_path), **kwargs)
         else:
             sources = list(sources)
             stem_path = out_dir / args.filename.format(
@@ -176,7 +187,8 @@ def separator(
             )
             stem_path.parent.mkdir(parents=True, exist_ok=True)
             index = model.sources.index(args.stem)
-            save_audio(sources.pop(index), str(stem_path), **kwargs)
+            with timed("stem_encode"):
+                save_audio(sources.pop(index), str(stem_path), **kwargs)
             # After popping the stem, the selected stem is no longer in the list 'sources'
             other_stem = th.zeros_like(sources[0])
             for src in sources:
@@ -188,4 +200,5 @@ def separator(
                 ext=ext,
             )
             stem_path.parent.mkdir(parents=True, exist_ok=True)
-            save_audio(other_stem, str(stem_path), **kwargs)
+            with timed("stem_encode"):
+                save_audio(other_stem, str(stem_path), **kwargs)
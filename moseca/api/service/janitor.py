@@ -0,0 +1,158 @@
+import asyncio
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+
+def _last_change(stat: os.stat_result) -> float:
+    # The change time is updated when a file is hard linked or moved into a workspace, while
+    # the modification time of a linked cache entry can be much older than the workspace
+    return max(stat.st_mtime, stat.st_ctime)
+
+
+def _tree_usage(path: Path):
+    """Returns the size in bytes of a file or directory tree, and the last time anything in it changed."""
+    stat = path.lstat()
+    if not path.is_dir() or path.is_symlink():
+        return stat.st_size, _last_change(stat)
+    size = 0
+    changed = _last_change(stat)
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            try:
+                stat = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if name in filenames:
+                size += stat.st_size
+            changed = max(changed, _last_change(stat))
+    return size, changed
+
+
+def _remove(path: Path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+class Janitor:
+    """
+    Periodically removes the request workspaces left behind in the data directories, e.g.
+    by crashed processes or requests that failed before their cleanup was scheduled.
+
+    Workspaces are judged as a whole, by the last change of any entry in them, so files hard
+    linked from the caches with an old modification time do not make a live workspace stale.
+    Each sweep removes the workspaces unchanged for `max_age_seconds`, then, if the
+    directories still hold more than `max_bytes`, the least recently changed ones. Workspaces
+    changed in the last `min_age_seconds` are never removed for the budget, since they may
+    belong to requests in progress, in this process or another one. Entries named in the
+    sample allow-list of the helpers are kept.
+    """
+
+    def __init__(self, directories: List[str], max_age_seconds: float, max_bytes: Optional[int] = None,
+                 min_age_seconds: float = 900, interval_seconds: float = 300):
+        self.directories = [Path(directory) for directory in directories]
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self.min_age_seconds = min_age_seconds
+        self.interval_seconds = interval_seconds
+        self.reclaimed_bytes = {"age": 0, "budget": 0}
+        self.removed_workspaces = 0
+        self.usage_bytes = 0
+        self.sweeps = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Janitor":
+        """
+        Reads the directories from JANITOR_DIRECTORIES (default data/temp, data/midi and
+        data/worker), the age limit from JANITOR_MAX_AGE_SECONDS (default 3600), the disk
+        budget from JANITOR_MAX_BYTES (default 10 GB, 0 to disable), and the seconds between
+        sweeps from JANITOR_INTERVAL_SECONDS (default 300).
+        """
+        directories = os.environ.get("JANITOR_DIRECTORIES", "data/temp,data/midi,data/worker")
+        return cls(
+            directories=[directory.strip() for directory in directories.split(",") if directory.strip()],
+            max_age_seconds=float(os.environ.get("JANITOR_MAX_AGE_SECONDS", 3600)),
+            max_bytes=int(os.environ.get("JANITOR_MAX_BYTES", 10 * 1024 ** 3)) or None,
+            min_age_seconds=float(os.environ.get("JANITOR_MIN_AGE_SECONDS", 900)),
+            interval_seconds=float(os.environ.get("JANITOR_INTERVAL_SECONDS", 300)),
+        )
+
+    def _workspaces(self, protected: set) -> List[tuple]:
+        """Returns the (last change, size, path) of every entry of the directories that is not protected."""
+        workspaces = []
+        for directory in self.directories:
+            if not directory.is_dir():
+                continue
+            for path in directory.iterdir():
+                if path.name in protected or path.name.split(".")[0] in protected:
+                    continue
+                try:
+                    size, changed = _tree_usage(path)
+                except OSError:
+                    continue
+                workspaces.append((changed, size, path))
+        return sorted(workspaces, key=lambda workspace: workspace[0])
+
+    def sweep(self) -> int:
+        """Runs one cleanup of every directory and returns the bytes freed."""
+        # The helpers pull in matplotlib and pydub, so they are only imported by the janitor
+        from moseca.utils.helpers import _get_files_to_not_delete
+
+        workspaces = self._workspaces(set(_get_files_to_not_delete()))
+        now = time.time()
+        freed = {"age": 0, "budget": 0}
+        removed = 0
+        remaining = []
+        for changed, size, path in workspaces:
+            if changed < now - self.max_age_seconds:
+                _remove(path)
+                freed["age"] += size
+                removed += 1
+            else:
+                remaining.append((changed, size, path))
+
+        usage = sum(size for _, size, _ in remaining)
+        if self.max_bytes is not None:
+            for changed, size, path in remaining:
+                if usage <= self.max_bytes or changed >= now - self.min_age_seconds:
+                    break
+                _remove(path)
+                freed["budget"] += size
+                removed += 1
+                usage -= size
+            if usage > self.max_bytes:
+                print(f"Janitor: {usage} bytes in use after the sweep, over the budget of {self.max_bytes}")
+
+        with self._lock:
+            for reason, value in freed.items():
+                self.reclaimed_bytes[reason] += value
+            self.removed_workspaces += removed
+            self.usage_bytes = usage
+            self.sweeps += 1
+        return freed["age"] + freed["budget"]
+
+    async def run(self):
+        """Sweeps every `interval_seconds` in a thread, until cancelled."""
+        while True:
+            try:
+                freed = await asyncio.to_thread(self.sweep)
+                if freed:
+                    print(f"Janitor reclaimed {freed} bytes")
+            except Exception as e:
+                print(f"Janitor sweep failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "reclaimed_bytes": dict(self.reclaimed_bytes),
+                "removed_workspaces": self.removed_workspaces,
+                "usage_bytes": self.usage_bytes,
+                "sweeps": self.sweeps,
+            }
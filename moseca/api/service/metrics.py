@@ -0,0 +1,233 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Histogram buckets in seconds, from quick header reads to full separations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> List[Tuple[str, tuple, tuple, float]]:
+        """Returns (suffix, extra label names, label values, value) tuples."""
+        with self._lock:
+            return [("", (), key, value) for key, value in sorted(self._values.items())]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, extra_names, values, value in self.samples():
+            labels = _format_labels(self.label_names + extra_names, values)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """A gauge set directly, or read from `function` returning {label values: value} on every scrape."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                 function: Optional[Callable[[], Dict[tuple, float]]] = None):
+        super().__init__(name, documentation, label_names)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        values = self.function()
+        return [("", (), tuple(str(v) for v in key), value) for key, value in sorted(values.items())]
+
+
+class CallbackCounter(Gauge):
+    """A counter kept elsewhere, like the hit counts of a cache, read on every scrape."""
+
+    type_name = "counter"
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", ("le",), key + (_format_value(bound),), cumulative))
+            samples.append(("_sum", (), key, total))
+            samples.append(("_count", (), key, cumulative))
+        return samples
+
+
+class Registry:
+    """A set of metrics rendered together in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+stage_seconds = REGISTRY.register(Histogram(
+    "songscribe_stage_seconds", "Time spent in each processing stage.", ("stage",)
+))
+queue_wait_seconds = REGISTRY.register(Histogram(
+    "songscribe_job_queue_wait_seconds", "Time jobs waited for a worker.", ("job_type",)
+))
+request_seconds = REGISTRY.register(Histogram(
+    "songscribe_request_seconds", "Time spent handling requests.", ("method", "route", "status")
+))
+
+# Stage timings of the job running in the current thread, when it runs through call_with_timings
+_local = threading.local()
+
+
+def record_stage(stage: str, seconds: float):
+    """Records the duration of a stage, or collects it for the parent process inside jobs."""
+    collected = getattr(_local, "timings", None)
+    if collected is not None:
+        collected.append((stage, seconds))
+    else:
+        stage_seconds.observe(seconds, stage=stage)
+
+
+@contextmanager
+def timed(stage: str):
+    """Times the enclosed block as a stage in songscribe_stage_seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def call_with_timings(fn: Callable, *args, **kwargs):
+    """
+    Runs a job and collects the stage timings recorded while it runs, so that jobs in
+    worker processes can report them to the metrics of the server process.
+
+    Returns:
+        Tuple: The result of the job, the list of (stage, seconds) timings, and the
+        wall-clock time the job started at.
+    """
+    started_at = time.time()
+    _local.timings = []
+    try:
+        result = fn(*args, **kwargs)
+        return result, _local.timings, started_at
+    finally:
+        _local.timings = None
+
+
+def observe_timings(timings: List[Tuple[str, float]]):
+    for stage, seconds in timings:
+        stage_seconds.observe(seconds, stage=stage)
+
+
+def _read_proc_fields(path: str) -> dict:
+    """Reads the "Key:   value kB" lines of a /proc file."""
+    fields = {}
+    with open(path) as f:
+        for line in f:
+            key, separator, value = line.partition(":")
+            if separator and key.replace("_", "").isalnum() and not key[0].isdigit():
+                fields[key] = value.strip()
+    return fields
+
+
+def process_memory(pid: int) -> dict:
+    """
+    Returns the memory of a process in bytes, from /proc on Linux: 'rss', 'pss' (shared
+    pages divided among the processes sharing them) and 'shared' (pages shared with others).
+    Values that cannot be read are None.
+    """
+    try:
+        fields = _read_proc_fields(f"/proc/{pid}/smaps_rollup")
+    except OSError:
+        # Kernels before 4.14 have no smaps_rollup, but still report the RSS
+        try:
+            fields = {"Rss": _read_proc_fields(f"/proc/{pid}/status")["VmRSS"]}
+        except (OSError, KeyError):
+            fields = {}
+
+    def to_bytes(key):
+        return int(fields[key].split()[0]) * 1024 if key in fields else None
+
+    shared = None
+    if "Shared_Clean" in fields and "Shared_Dirty" in fields:
+        shared = to_bytes("Shared_Clean") + to_bytes("Shared_Dirty")
+    return {"rss": to_bytes("Rss"), "pss": to_bytes("Pss"), "shared": shared}
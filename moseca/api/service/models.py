@@ -0,0 +1,117 @@
+import importlib
+import threading
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from moseca.api.service.metrics import timed
+
+
+def load_demucs_model(name: str):
+    from demucs.pretrained import get_model
+    return get_model(name=name, repo=None)
+
+
+def _load_basic_pitch():
+    from basic_pitch import ICASSP_2022_MODEL_PATH
+    from basic_pitch.inference import Model
+    return Model(ICASSP_2022_MODEL_PATH)
+
+
+def _load_adtof():
+    from adtof.model.model import Model
+    # Returns the model and the hyperparameters to predict with
+    return Model.modelFactory(modelName="Frame_RNN", scenario="adtofAll", fold=0)
+
+
+class ModelRegistry:
+    """
+    Models loaded on first use and kept for the lifetime of the process. Every process
+    has its own registry, so models used by jobs in worker processes are loaded there.
+
+    Loading is serialized per model: concurrent callers of `get` wait for the first load
+    instead of loading the same model twice. Failed loads are not cached.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._failed = set()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader: Callable[[], Any], stage: Optional[str] = None):
+        """
+        Registers how to load a model.
+
+        Args:
+            name (str): The model name, like "htdemucs".
+            loader (Callable): Loads and returns the model. Heavy imports go inside it.
+            stage (str, optional): The metrics stage timing the load, "<name>_model_load" by default.
+        """
+        with self._lock:
+            self._loaders[name] = (loader, stage or f"{name}_model_load")
+            self._locks.setdefault(name, threading.Lock())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._loaders
+
+    def get(self, name: str) -> Any:
+        """Returns the model, loading it on first use. Raises KeyError for unregistered names."""
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        loader, stage = self._loaders[name]
+        with self._locks[name]:
+            if name not in self._models:
+                try:
+                    with timed(stage):
+                        self._models[name] = loader()
+                except Exception:
+                    self._failed.add(name)
+                    raise
+                self._failed.discard(name)
+            return self._models[name]
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def status(self) -> Dict[str, str]:
+        """Returns "loaded", "loading", "failed" or "not loaded" for every registered model."""
+        status = {}
+        for name in sorted(self._loaders):
+            if name in self._models:
+                status[name] = "loaded"
+            elif self._locks[name].locked():
+                status[name] = "loading"
+            elif name in self._failed:
+                status[name] = "failed"
+            else:
+                status[name] = "not loaded"
+        return status
+
+
+MODELS = ModelRegistry()
+MODELS.register("htdemucs", partial(load_demucs_model, "htdemucs"), stage="demucs_model_load")
+MODELS.register("htdemucs_6s", partial(load_demucs_model, "htdemucs_6s"), stage="demucs_model_load")
+MODELS.register("basic_pitch", _load_basic_pitch)
+MODELS.register("adtof", _load_adtof)
+
+
+def warm_models(names: Iterable[str]):
+    """Loads the models into the registry of the process running this, e.g. a pool worker."""
+    for name in names:
+        MODELS.get(name)
+
+
+def resolve_target(target: str) -> Callable:
+    """Imports and returns the function of a "package.module:function" job target."""
+    module_name, _, function_name = target.partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def call_target(target: str, *args, **kwargs):
+    """
+    Runs a job given as a "package.module:function" string. The module is imported by the
+    process running the job, so the server process does not import the ML frameworks.
+    """
+    return resolve_target(target)(*args, **kwargs)
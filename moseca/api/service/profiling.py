@@ -0,0 +1,142 @@
+import cProfile
+import hmac
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Optional
+
+# Requests are only profiled when they send this token in the X-Profile header
+PROFILING_ADMIN_TOKEN = os.environ.get("PROFILING_ADMIN_TOKEN")
+
+PROFILES_DIR = Path("data/profiles")
+
+# Seconds between two samples of the server process stacks
+SAMPLE_INTERVAL = float(os.environ.get("PROFILING_SAMPLE_INTERVAL", 0.005))
+
+_PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def profiling_allowed(token: Optional[str]) -> bool:
+    """Whether the token from a request enables profiling. Always False when no admin token is set."""
+    if not PROFILING_ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), PROFILING_ADMIN_TOKEN.encode())
+
+
+def profile_dir(profile_id: str) -> Optional[Path]:
+    """Returns the artifact directory of a profile, or None for an invalid or unknown ID."""
+    if not _PROFILE_ID.match(profile_id):
+        return None
+    path = PROFILES_DIR / profile_id
+    return path if path.is_dir() else None
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread of the process at a fixed interval, from a
+    background thread, and counts identical stacks. The overhead does not depend on
+    how many functions run, unlike deterministic profilers.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write_folded(self, path: Path):
+        """Writes the samples in the folded stack format read by flame graph tools."""
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfileSession:
+    """The profile of a single request: its artifact directory and the tags saved with it."""
+
+    def __init__(self, endpoint: str, method: str):
+        self.id = uuid.uuid4().hex
+        self.dir = PROFILES_DIR / self.id
+        self.dir.mkdir(parents=True)
+        self.meta = {
+            "id": self.id,
+            "endpoint": endpoint,
+            "method": method,
+            "parameters": {},
+            "input_duration": None,
+            "started_at": time.time(),
+        }
+        self._worker_profiles = 0
+        self._lock = threading.Lock()
+
+    def worker_profile_path(self, job_type: str) -> str:
+        """Returns a new path for the cProfile output of a job."""
+        with self._lock:
+            self._worker_profiles += 1
+            name = f"worker-{re.sub(r'[^A-Za-z0-9_.-]', '_', job_type)}-{self._worker_profiles}.prof"
+        return str(self.dir / name)
+
+    def finish(self, sampler: SamplingProfiler, status_code: int):
+        sampler.write_folded(self.dir / "main.folded")
+        self.meta["wall_seconds"] = time.time() - self.meta["started_at"]
+        self.meta["status"] = status_code
+        self.meta["artifacts"] = sorted(path.name for path in self.dir.iterdir()) + ["meta.json"]
+        with open(self.dir / "meta.json", "w") as f:
+            json.dump(self.meta, f, indent=2, default=str)
+
+
+# The profile of the request being handled, if it is profiled
+current_profile: ContextVar[Optional[ProfileSession]] = ContextVar("current_profile", default=None)
+
+
+def tag_profile(parameters: Optional[dict] = None, input_duration: Optional[float] = None):
+    """Saves the request parameters and input duration with the profile, if the request is profiled."""
+    session = current_profile.get()
+    if session is None:
+        return
+    if parameters:
+        session.meta["parameters"].update(parameters)
+    if input_duration is not None:
+        session.meta["input_duration"] = input_duration
+
+
+def call_profiled(output_path: str, fn: Callable, *args, **kwargs):
+    """Runs fn under cProfile, in the worker running the job, and saves the stats to output_path."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(output_path)
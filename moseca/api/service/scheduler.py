@@ -0,0 +1,155 @@
+import asyncio
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Executor
+from functools import partial
+from typing import Callable, Optional, Union
+
+from moseca.api.service.broker import Broker, run_remote
+from moseca.api.service.metrics import call_with_timings, observe_timings, queue_wait_seconds
+from moseca.api.service.models import call_target
+from moseca.api.service.profiling import call_profiled, current_profile
+
+# Estimated seconds of work per second of audio for every job type, used to estimate
+# job costs from the probed duration before the job starts
+JOB_COST_FACTORS = {
+    "separation:htdemucs": 1.0,
+    "separation:htdemucs_6s": 1.5,
+    "transcription:basic_pitch": 0.3,
+    "transcription:adtof": 0.3,
+}
+
+# Cost of a job type that is not in JOB_COST_FACTORS, per second of audio
+DEFAULT_COST_FACTOR = 1.0
+
+
+def estimate_cost(job_type: str, duration: Optional[float]) -> float:
+    """
+    Estimates the seconds of work of a job from the duration of its input audio.
+
+    Args:
+        job_type (str): The job type, like "separation:htdemucs".
+        duration (float, optional): The duration of the input audio in seconds, if known.
+
+    Returns:
+        float: The estimated cost, 0 when the duration is unknown.
+    """
+    if duration is None:
+        return 0.0
+    return duration * JOB_COST_FACTORS.get(job_type, DEFAULT_COST_FACTOR)
+
+
+class SchedulerBusy(Exception):
+    """Raised when a job is not admitted because too much work is already pending."""
+
+
+class JobScheduler:
+    """
+    Runs blocking jobs on executors without blocking the event loop, and keeps track
+    of the jobs in flight by type and of the estimated cost of the pending work.
+
+    When `max_pending_cost` is set, jobs that would take the pending cost over it are
+    rejected with SchedulerBusy before they start, instead of queueing behind hours of work.
+    Jobs sent to a broker fail with JobFailed when they do not finish within `job_timeout`
+    seconds, so requests do not wait forever when no worker takes them.
+    """
+
+    def __init__(self, executor: Optional[Executor] = None, max_pending_cost: Optional[float] = None,
+                 broker: Optional[Broker] = None, job_timeout: Optional[float] = None):
+        self.executor = executor
+        self.max_pending_cost = max_pending_cost
+        self.broker = broker
+        self.job_timeout = job_timeout
+        self.pending_cost = 0.0
+        self.in_flight = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _has_room(self, cost: float) -> bool:
+        # A job is always admitted when nothing is pending, however large it is
+        return self.max_pending_cost is None or self.pending_cost <= 0 \
+            or self.pending_cost + cost <= self.max_pending_cost
+
+    def can_admit(self, cost: float) -> bool:
+        """Whether a job of this cost would be admitted now, to reject requests before preprocessing."""
+        with self._lock:
+            return self._has_room(cost)
+
+    def _admit(self, job_type: str, cost: float):
+        with self._lock:
+            if not self._has_room(cost):
+                raise SchedulerBusy("The server is busy. Please try again in a few minutes.")
+            self.pending_cost += cost
+            self.in_flight[job_type] += 1
+
+    def _release(self, job_type: str, cost: float):
+        with self._lock:
+            self.pending_cost -= cost
+            self.in_flight[job_type] -= 1
+
+    async def run(self, job_type: str, fn: Union[Callable, str], *args, cost: float = 0.0,
+                  executor: Optional[Executor] = None, **kwargs):
+        """
+        Runs fn(*args, **kwargs) on the executor and returns its result. With a broker, jobs
+        given as targets are enqueued instead, and run by the workers consuming the broker.
+
+        Args:
+            job_type (str): The job type, for accounting.
+            fn (Callable or str): The blocking function to run, or a "package.module:function"
+                target imported by the worker when the job runs. It must be picklable for process pools.
+            cost (float): The estimated cost of the job, see estimate_cost.
+            executor (Executor, optional): The executor to use instead of the default one.
+                None uses the scheduler's executor, or the event loop's thread pool.
+
+        Raises:
+            SchedulerBusy: If the job is not admitted.
+            JobFailed: If a job sent to the broker failed or timed out.
+        """
+        remote = self.broker is not None and isinstance(fn, str)
+        if isinstance(fn, str) and not remote:
+            fn, args = call_target, (fn, *args)
+
+        # Jobs of profiled requests run under cProfile in the worker, unless they run remotely
+        session = current_profile.get()
+        if session is not None and not remote:
+            fn, args = call_profiled, (session.worker_profile_path(job_type), fn, *args)
+
+        self._admit(job_type, cost)
+        try:
+            submitted_at = time.time()
+            if remote:
+                result, timings, started_at = await run_remote(
+                    self.broker, job_type, fn, args, kwargs, timeout=self.job_timeout
+                )
+            else:
+                loop = asyncio.get_running_loop()
+                result, timings, started_at = await loop.run_in_executor(
+                    executor or self.executor, partial(call_with_timings, fn, *args, **kwargs)
+                )
+        finally:
+            self._release(job_type, cost)
+
+        # Stage timings recorded in the worker are reported in this process
+        queue_wait_seconds.observe(max(0.0, started_at - submitted_at), job_type=job_type)
+        observe_timings(timings)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending_cost": self.pending_cost,
+                "in_flight": {job_type: count for job_type, count in self.in_flight.items() if count},
+            }
+
+
+def max_pending_cost_from_env() -> Optional[float]:
+    """Reads the admission limit from MAX_PENDING_JOB_SECONDS, 0 or unset meaning no limit."""
+    value = float(os.environ.get("MAX_PENDING_JOB_SECONDS", 0))
+    return value or None
+
+
+def job_timeout_from_env() -> Optional[float]:
+    """Reads the seconds to wait for a job of the broker from JOB_TIMEOUT_SECONDS (default 3600, 0 for no limit)."""
+    value = float(os.environ.get("JOB_TIMEOUT_SECONDS", 3600))
+    return value or None
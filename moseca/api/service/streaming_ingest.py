@@ -0,0 +1,113 @@
+import http.client
+import os
+import subprocess
+import threading
+import urllib.request
+from typing import Optional, Tuple
+
+import numpy as np
+from loguru import logger as log
+
+from moseca.api.align_audio import ANALYSIS_SAMPLE_RATE
+
+# Bytes read from the source and fed to the decoder at a time
+CHUNK_SIZE = 1 << 16
+
+
+class StreamingDecoder:
+    """
+    Decodes an audio stream incrementally with ffmpeg, to a mono float signal at the
+    beat tracking sample rate. Bytes are fed as they arrive, and the decoded samples
+    are collected by a reader thread, so decoding overlaps with the transfer.
+    """
+
+    def __init__(self, sample_rate: int = ANALYSIS_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self._chunks = []
+        self._process = subprocess.Popen(
+            ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+             '-f', 'f32le', '-ac', '1', '-ar', str(sample_rate), 'pipe:1'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        )
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        for chunk in iter(lambda: self._process.stdout.read(CHUNK_SIZE), b''):
+            self._chunks.append(chunk)
+
+    def feed(self, data: bytes):
+        self._process.stdin.write(data)
+
+    def close(self) -> np.ndarray:
+        """Waits for the decoder to finish and returns the decoded signal."""
+        self._process.stdin.close()
+        self._reader.join()
+        if self._process.wait() != 0:
+            raise RuntimeError("ffmpeg could not decode the audio stream.")
+        data = b''.join(self._chunks)
+        return np.frombuffer(data[:len(data) - len(data) % 4], dtype='<f4')
+
+    def abort(self):
+        self._process.kill()
+        self._reader.join()
+
+
+def stream_to_file(url: str, destination: str, headers: Optional[dict] = None,
+                   analyze: bool = True) -> Tuple[str, Optional[np.ndarray]]:
+    """
+    Downloads a URL to a file while decoding it for beat tracking.
+
+    Any URL supported by urllib works, including file:// URLs for local sources. A
+    download shorter than its announced length is removed and raises IncompleteRead.
+
+    Args:
+        url (str): The URL of the audio stream.
+        destination (str): The path to save the downloaded file to.
+        headers (dict, optional): HTTP headers to send with the request.
+        analyze (bool): Whether to decode the stream while downloading it.
+
+    Returns:
+        Tuple[str, np.ndarray]: The destination path, and the decoded mono signal at
+        ANALYSIS_SAMPLE_RATE, or None if it could not be decoded.
+    """
+    decoder = None
+    if analyze:
+        try:
+            decoder = StreamingDecoder()
+        except OSError as e:
+            log.warning(f"Cannot start the streaming decoder, downloading only: {e}")
+
+    request = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request) as response, open(destination, 'wb') as f:
+            expected = response.headers.get('Content-Length')
+            received = 0
+            for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                f.write(chunk)
+                received += len(chunk)
+                if decoder is not None:
+                    try:
+                        decoder.feed(chunk)
+                    except OSError as e:
+                        # The decoder gave up on the stream, keep downloading
+                        log.warning(f"Streaming decoder stopped: {e}")
+                        decoder.abort()
+                        decoder = None
+            # Reads end quietly when the connection closes early, so check the length
+            if expected is not None and received < int(expected):
+                raise http.client.IncompleteRead(b'', int(expected) - received)
+    except Exception:
+        if decoder is not None:
+            decoder.abort()
+        if os.path.exists(destination):
+            os.remove(destination)
+        raise
+
+    if decoder is None:
+        return destination, None
+    try:
+        return destination, decoder.close()
+    except RuntimeError as e:
+        log.warning(str(e))
+        return destination, None
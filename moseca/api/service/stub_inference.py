@@ -0,0 +1,128 @@
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import List, Optional
+
+import mido
+
+from moseca.api.service.audio_probe import AudioProbeError, probe_audio
+from moseca.api.service.metrics import timed
+from moseca.api.service.scheduler import JOB_COST_FACTORS
+
+# Multiplier of the calibrated job costs, e.g. 0.1 for stubs ten times faster than the models
+STUB_INFERENCE_SCALE = float(os.environ.get("STUB_INFERENCE_SCALE", 1.0))
+
+# Share of the stub run time spent burning CPU, the rest is spent sleeping
+STUB_INFERENCE_CPU_SHARE = float(os.environ.get("STUB_INFERENCE_CPU_SHARE", 0.5))
+
+# Duration assumed for inputs whose duration is not in their headers
+FALLBACK_DURATION = 30.0
+
+# Sources of each Demucs model, in the order the model outputs them
+MODEL_SOURCES = {
+    "htdemucs": ["drums", "bass", "other", "vocals"],
+    "htdemucs_6s": ["drums", "bass", "other", "vocals", "guitar", "piano"],
+}
+
+
+def stub_inference_enabled() -> bool:
+    """Whether STUB_INFERENCE is set, to replace the models by stubs in load tests."""
+    return os.environ.get("STUB_INFERENCE", "").lower() in ("1", "true", "yes")
+
+
+def _input_duration(path: Path) -> float:
+    try:
+        duration = probe_audio(str(path))["duration"]
+    except AudioProbeError:
+        duration = None
+    return duration if duration is not None else FALLBACK_DURATION
+
+
+def simulate_work(seconds: float, cpu_share: float = STUB_INFERENCE_CPU_SHARE):
+    """Burns CPU for cpu_share of the given seconds and sleeps for the rest."""
+    deadline = time.perf_counter() + seconds * cpu_share
+    value = 0
+    while time.perf_counter() < deadline:
+        for i in range(10_000):
+            value += i * i
+    time.sleep(seconds * (1 - cpu_share))
+
+
+def _simulate_job(job_type: str, input_path: Path) -> float:
+    """Works for the calibrated time of a job on the input, and returns the input duration."""
+    duration = _input_duration(input_path)
+    simulate_work(duration * JOB_COST_FACTORS.get(job_type, 1.0) * STUB_INFERENCE_SCALE)
+    return duration
+
+
+def _write_midi(path: Path, duration: float, drums: bool):
+    """Writes a MIDI file with one note per 8th note at 120 BPM, like a dense transcription."""
+    midi = mido.MidiFile(ticks_per_beat=480)
+    track = mido.MidiTrack()
+    midi.tracks.append(track)
+    track.append(mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(120), time=0))
+    channel = 9 if drums else 0
+    notes = [36, 42, 38, 42] if drums else [60, 64, 67, 72]
+    for i in range(int(duration * 4)):
+        note = notes[i % len(notes)]
+        track.append(mido.Message("note_on", channel=channel, note=note, velocity=90, time=0))
+        track.append(mido.Message("note_off", channel=channel, note=note, velocity=0, time=240))
+    midi.save(str(path))
+
+
+def separator(
+    tracks: List[Path],
+    out: Path,
+    model: str,
+    shifts: int = 1,
+    overlap: float = 0.25,
+    stem: str = None,
+    *args,
+    **kwargs,
+):
+    """
+    Stands in for the Demucs separator, with the same arguments and output layout. It
+    works for the calibrated time and writes copies of the input as stems, so that the
+    rest of the request (like zipping) handles files of realistic sizes.
+    """
+    out_dir = out / model
+    sources = MODEL_SOURCES.get(model, MODEL_SOURCES["htdemucs"])
+    stems = [stem, "no_" + stem] if stem is not None else sources
+    for track in tracks:
+        if not track.exists():
+            continue
+        with timed("demucs_inference"):
+            _simulate_job(f"separation:{model}", track)
+        track_dir = out_dir / track.name.rsplit(".", 1)[0]
+        track_dir.mkdir(parents=True, exist_ok=True)
+        with timed("stem_encode"):
+            for name in stems:
+                shutil.copyfile(track, track_dir / f"{name}.mp3")
+
+
+def transcribe_pitched(
+    input_file_path: Path,
+    output_directory: Path,
+    onset_threshold: float,
+    frame_threshold: float,
+    minimum_note_length: float,
+    minimum_frequency: Optional[float],
+    maximum_frequency: Optional[float],
+    tempo: int,
+) -> Path:
+    """Stands in for basic-pitch transcription, writing a MIDI file at the same path."""
+    midi_path = output_directory / (input_file_path.stem + "_basic_pitch.mid")
+    with timed("basic_pitch_inference"):
+        duration = _simulate_job("transcription:basic_pitch", input_file_path)
+        _write_midi(midi_path, duration, drums=False)
+    return midi_path
+
+
+def transcribe_drums(input_file_path: Path, output_directory: Path) -> Path:
+    """Stands in for ADTOF drum transcription, writing a MIDI file at the same path."""
+    midi_path = output_directory / (input_file_path.name + ".mid")
+    with timed("adtof_inference"):
+        duration = _simulate_job("transcription:adtof", input_file_path)
+        _write_midi(midi_path, duration, drums=True)
+    return midi_path
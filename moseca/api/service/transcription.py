@@ -0,0 +1,61 @@
+from pathlib import Path
+from typing import Optional
+
+from moseca.api.service.metrics import timed
+from moseca.api.service.models import MODELS
+
+
+def transcribe_pitched(
+    input_file_path: Path,
+    output_directory: Path,
+    onset_threshold: float,
+    frame_threshold: float,
+    minimum_note_length: float,
+    minimum_frequency: Optional[float],
+    maximum_frequency: Optional[float],
+    tempo: int,
+) -> Path:
+    """
+    Transcribes pitched instruments to MIDI with basic-pitch.
+
+    Returns:
+        Path: The path of the generated MIDI file, which may not exist if transcription failed.
+    """
+    # TensorFlow is imported with the model on first use, not when the server starts
+    from basic_pitch.inference import predict_and_save
+
+    model = MODELS.get("basic_pitch")
+    with timed("basic_pitch_inference"):
+        predict_and_save(
+            audio_path_list=[input_file_path],
+            output_directory=output_directory,
+            save_midi=True,
+            sonify_midi=False,
+            save_model_outputs=False,
+            save_notes=False,
+            model_or_model_path=model,
+            onset_threshold=onset_threshold,
+            frame_threshold=frame_threshold,
+            minimum_note_length=minimum_note_length,
+            minimum_frequency=minimum_frequency,
+            maximum_frequency=maximum_frequency,
+            midi_tempo=tempo,
+        )
+
+    # Construct the MIDI file path
+    return output_directory / (input_file_path.stem + "_basic_pitch.mid")
+
+
+def transcribe_drums(input_file_path: Path, output_directory: Path) -> Path:
+    """
+    Transcribes drums to MIDI with ADTOF. The MIDI is written at 120 BPM.
+
+    Returns:
+        Path: The path of the generated MIDI file, which may not exist if transcription failed.
+    """
+    model, hparams = MODELS.get("adtof")
+
+    # Perform transcription
+    with timed("adtof_inference"):
+        model.predictFolder(str(input_file_path), str(output_directory), **hparams)
+    return output_directory / (input_file_path.name + ".mid")
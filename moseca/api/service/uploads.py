@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from pathlib import Path
+
+from fastapi import UploadFile
+
+from moseca.api.service.audio_probe import AudioProbeError, AudioTooLong, check_audio
+from moseca.api.service.metrics import timed
+from moseca.api.service.profiling import tag_profile
+
+# Largest accepted upload, checked while the upload is written
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 200 * 1024 ** 2))
+
+# Bytes read from the upload and written at a time
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+
+class UploadRejected(Exception):
+    """Raised when an upload is not accepted, with the HTTP status code to respond with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class UploadTooLarge(UploadRejected):
+    """Raised when an upload exceeds the maximum size."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File is too large. Please upload a file no larger than {max_bytes // 1024 ** 2} MB.", 413)
+        self.max_bytes = max_bytes
+
+
+def new_workspace(root: str = "data/temp") -> Path:
+    """
+    Creates a directory for the files of a single request, so concurrent requests
+    never see or clean up each other's files.
+
+    Args:
+        root (str): The directory to create the workspace in.
+
+    Returns:
+        Path: The new, empty directory.
+    """
+    workspace = Path(root) / uuid.uuid4().hex
+    workspace.mkdir(parents=True)
+    return workspace
+
+
+async def save_upload(upload: UploadFile, destination: Path, max_bytes: int = MAX_UPLOAD_BYTES) -> str:
+    """
+    Writes an upload to disk in chunks without blocking the event loop, hashing it on the way.
+
+    Args:
+        upload (UploadFile): The uploaded file.
+        destination (Path): The path to write the file to.
+        max_bytes (int): The maximum size of the file in bytes.
+
+    Returns:
+        str: The SHA-256 hex digest of the file content, like file_sha256.
+
+    Raises:
+        UploadTooLarge: If the file is larger than max_bytes. Nothing is left at destination.
+    """
+    # The multipart parser already knows the size of spooled uploads
+    if getattr(upload, "size", None) is not None and upload.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    digest = hashlib.sha256()
+    size = 0
+    f = await asyncio.to_thread(open, destination, "wb")
+    try:
+        while True:
+            chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            digest.update(chunk)
+            await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        await asyncio.to_thread(f.close)
+        destination.unlink(missing_ok=True)
+        raise
+    await asyncio.to_thread(f.close)
+    return digest.hexdigest()
+
+
+async def receive_audio_upload(upload: UploadFile, workspace: Path, file_name: str = None):
+    """
+    Saves an uploaded audio file into a workspace and probes its headers, so uploads that
+    are too large, too long or not audio are rejected before any decoding.
+
+    Args:
+        upload (UploadFile): The uploaded file.
+        workspace (Path): The request workspace to save the file in.
+        file_name (str, optional): The file name to use instead of the uploaded one.
+
+    Returns:
+        Tuple[Path, str, dict]: The saved file, its SHA-256 hex digest and its probe_audio result.
+
+    Raises:
+        UploadRejected: With status 413 for files that are too large or too long,
+            and 415 for files that are not audio.
+    """
+    destination = workspace / (file_name or Path(upload.filename).name)
+    with timed("upload_write"):
+        audio_hash = await save_upload(upload, destination)
+    try:
+        with timed("probe"):
+            probe = await asyncio.to_thread(check_audio, str(destination))
+    except AudioTooLong as e:
+        raise UploadRejected(str(e), 413)
+    except AudioProbeError as e:
+        raise UploadRejected(str(e), 415)
+    tag_profile(input_duration=probe['duration'])
+    return destination, audio_hash, probe
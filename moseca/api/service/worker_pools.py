@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+# The framework of every job type and model. ADTOF runs on TensorFlow, like basic-pitch.
+JOB_FRAMEWORKS = {
+    "separation:htdemucs": "torch",
+    "separation:htdemucs_6s": "torch",
+    "transcription:basic_pitch": "tensorflow",
+    "transcription:adtof": "tensorflow",
+}
+MODEL_FRAMEWORKS = {
+    "htdemucs": "torch",
+    "htdemucs_6s": "torch",
+    "basic_pitch": "tensorflow",
+    "adtof": "tensorflow",
+}
+
+# Environment variables read by the thread pools of the native libraries
+_THREAD_VARIABLES = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+
+def init_worker(framework: str, threads: int):
+    """
+    Sets the thread settings of a worker process before it runs any job, so that the
+    workers of both pools together do not use more threads than there are cores.
+    """
+    for variable in _THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    if framework == "torch":
+        try:
+            import torch
+        except ImportError:
+            return
+        torch.set_num_threads(threads)
+    elif framework == "tensorflow":
+        os.environ["TF_NUM_INTRAOP_THREADS"] = str(threads)
+        os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+        try:
+            import tensorflow as tf
+        except ImportError:
+            return
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+class WorkerPools:
+    """
+    Separate process pools for PyTorch and TensorFlow jobs, so that each worker process
+    hosts a single framework and its thread pools and allocators do not compete with the
+    other's. Jobs and results go through the pools' multiprocessing queues.
+
+    The TensorFlow workers are spawned, since TensorFlow is not fork-safe. The PyTorch
+    workers are forked by default, which lets them share the models preloaded by the
+    pre-fork server; the API process itself imports neither framework.
+    """
+
+    def __init__(self, torch_workers: int, torch_threads: int, tf_workers: int, tf_threads: int,
+                 torch_start_method: str = "fork", tf_start_method: str = "spawn"):
+        self.settings = {
+            "torch": {"workers": torch_workers, "threads": torch_threads, "start_method": torch_start_method},
+            "tensorflow": {"workers": tf_workers, "threads": tf_threads, "start_method": tf_start_method},
+        }
+        self.torch = self._make_pool("torch")
+        self.tensorflow = self._make_pool("tensorflow")
+
+    def _make_pool(self, framework: str) -> ProcessPoolExecutor:
+        settings = self.settings[framework]
+        return ProcessPoolExecutor(
+            max_workers=settings["workers"],
+            mp_context=multiprocessing.get_context(settings["start_method"]),
+            initializer=init_worker,
+            initargs=(framework, settings["threads"]),
+        )
+
+    @classmethod
+    def from_env(cls) -> "WorkerPools":
+        """
+        Reads the pool sizes from TORCH_WORKERS (default 2) and TF_WORKERS (default 1), and
+        the threads per worker from TORCH_THREADS and TF_THREADS (default: the cores divided
+        among all workers). TORCH_START_METHOD and TF_START_METHOD set how workers start.
+        """
+        torch_workers = int(os.environ.get("TORCH_WORKERS", 2))
+        tf_workers = int(os.environ.get("TF_WORKERS", os.environ.get("TRANSCRIPTION_WORKERS", 1)))
+        default_threads = max(1, (os.cpu_count() or 1) // (torch_workers + tf_workers))
+        return cls(
+            torch_workers=torch_workers,
+            torch_threads=int(os.environ.get("TORCH_THREADS", default_threads)),
+            tf_workers=tf_workers,
+            tf_threads=int(os.environ.get("TF_THREADS", default_threads)),
+            torch_start_method=os.environ.get("TORCH_START_METHOD", "fork"),
+            tf_start_method=os.environ.get("TF_START_METHOD", "spawn"),
+        )
+
+    def for_job(self, job_type: str) -> ProcessPoolExecutor:
+        return self.tensorflow if JOB_FRAMEWORKS.get(job_type) == "tensorflow" else self.torch
+
+    def for_model(self, name: str) -> ProcessPoolExecutor:
+        return self.tensorflow if MODEL_FRAMEWORKS.get(name) == "tensorflow" else self.torch
+
+    def shutdown(self, wait: bool = True):
+        self.torch.shutdown(wait=wait)
+        self.tensorflow.shutdown(wait=wait)
+
+    def stats(self) -> dict:
+        return {framework: dict(settings) for framework, settings in self.settings.items()}
@@ -2,12 +2,16 @@ import logging
 import os
 import re
 import string
-from typing import List
+from typing import List, Optional
 
 from loguru import logger as log
 import yt_dlp
 from pytube import Search
 
+from moseca.api.service.cache import DiskCache
+from moseca.api.service.metrics import timed
+from moseca.api.service.streaming_ingest import stream_to_file
+
 # Configure logging
 logger = logging.getLogger("pytube")
 logger.setLevel(logging.ERROR)
@@ -20,16 +24,30 @@ def _sanitize_filename(filename):
     safe_filename = re.sub(f"[^{safe_chars}]", "_", filename)
     return safe_filename.strip()
 
-def download_audio_from_youtube(url, output_path):
+def _extract_info(url):
+    """Resolves the video and its best audio format, and checks the duration."""
+    with yt_dlp.YoutubeDL({"quiet": True, "format": "bestaudio/best"}) as ydl:
+        info_dict = ydl.extract_info(url, download=False)
+
+    if info_dict.get("duration", 0) > 360:
+        raise ValueError("Song is too long. Please use a song no longer than 6 minutes.")
+
+    return info_dict
+
+def download_audio_from_youtube(url, output_path, cache: Optional[DiskCache] = None, transcode: bool = True):
     """
-    Downloads audio from a YouTube URL and saves it as an MP3 file.
+    Downloads audio from a YouTube URL and saves it as an MP3 file, or in its native
+    codec (usually Opus in WebM, or AAC in M4A) when transcoding is turned off.
 
     Args:
         url (str): The YouTube video URL.
         output_path (str): The directory where the audio file will be saved.
+        cache (DiskCache, optional): Cache of downloaded files, keyed by video ID.
+        transcode (bool): Whether to transcode the audio to MP3. Turn it off when the
+            file is decoded anyway, e.g. before source separation.
 
     Returns:
-        str: The filename of the downloaded MP3 file.
+        str: The filename of the downloaded audio file.
 
     Raises:
         ValueError: If the video duration exceeds 6 minutes.
@@ -37,11 +55,16 @@ def download_audio_from_youtube(url, output_path):
     if not os.path.exists(output_path):
         os.makedirs(output_path)
 
-    with yt_dlp.YoutubeDL({"quiet": True}) as ydl:
-        info_dict = ydl.extract_info(url, download=False)
+    info_dict = _extract_info(url)
 
-    if info_dict.get("duration", 0) > 360:
-        raise ValueError("Song is too long. Please use a song no longer than 6 minutes.")
+    # Different URLs of the same video share the canonical video ID
+    video_id = info_dict.get("id")
+    cache_key = video_id if transcode else f"{video_id}.native"
+    if cache is not None and video_id:
+        cached_path = cache.get_into(cache_key, output_path)
+        if cached_path is not None:
+            log.info(f"Using cached audio for YouTube video {video_id}")
+            return cached_path.name
 
     video_title = info_dict.get("title", None)
     video_title = _sanitize_filename(video_title)
@@ -51,23 +74,78 @@ def download_audio_from_youtube(url, output_path):
         "Accept-Encoding": "gzip, deflate, br",
         "Connection": "keep-alive",
         "format": "bestaudio/best",
-        "postprocessors": [
+        "outtmpl": os.path.join(output_path, f"{video_title}.%(ext)s"),
+        "quiet": True,
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+                      "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    }
+    if transcode:
+        ydl_opts["postprocessors"] = [
             {
                 "key": "FFmpegExtractAudio",
                 "preferredcodec": "mp3",
                 "preferredquality": "192",
             }
-        ],
-        "outtmpl": os.path.join(output_path, video_title),
-        "quiet": True,
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                      "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-    }
+        ]
+
+    # Download from the info extracted above instead of resolving the URL again
+    with timed("youtube_download"), yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        result = ydl.process_ie_result(info_dict, download=True)
+
+    if transcode:
+        audio_filename = f"{video_title}.mp3"
+    else:
+        downloads = result.get("requested_downloads") or [result]
+        audio_filename = os.path.basename(downloads[0].get("filepath") or ydl.prepare_filename(result))
+
+    if cache is not None and video_id:
+        cache.put(cache_key, os.path.join(output_path, audio_filename))
+
+    return audio_filename
+
+def stream_audio_from_youtube(url, output_path, cache: Optional[DiskCache] = None):
+    """
+    Downloads audio from a YouTube URL in its native codec, decoding it for beat
+    tracking while the download is in progress.
+
+    Args:
+        url (str): The YouTube video URL.
+        output_path (str): The directory where the audio file will be saved.
+        cache (DiskCache, optional): Cache of downloaded files, keyed by video ID.
+
+    Returns:
+        Tuple[str, np.ndarray]: The filename of the downloaded audio file, and its mono
+        signal at ANALYSIS_SAMPLE_RATE, or None when it was not decoded while downloading.
+
+    Raises:
+        ValueError: If the video duration exceeds 6 minutes.
+    """
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    info_dict = _extract_info(url)
+
+    video_id = info_dict.get("id")
+    cache_key = f"{video_id}.native"
+    if cache is not None and video_id:
+        cached_path = cache.get_into(cache_key, output_path)
+        if cached_path is not None:
+            log.info(f"Using cached audio for YouTube video {video_id}")
+            return cached_path.name, None
+
+    # Segmented streams (HLS, DASH) cannot be read as a single response
+    if info_dict.get("protocol") not in ("http", "https") or not info_dict.get("url"):
+        return download_audio_from_youtube(url, output_path, cache, transcode=False), None
+
+    audio_filename = f"{_sanitize_filename(info_dict.get('title'))}.{info_dict.get('ext', 'webm')}"
+    destination = os.path.join(output_path, audio_filename)
+    with timed("youtube_download"):
+        _, analysis_signal = stream_to_file(info_dict["url"], destination, info_dict.get("http_headers"))
 
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([url])
+    if cache is not None and video_id:
+        cache.put(cache_key, destination)
 
-    return f"{video_title}.mp3"
+    return audio_filename, analysis_signal
 
 def query_youtube(query: str) -> Search:
     """
@@ -0,0 +1,136 @@
+"""
+Standalone worker running separation and transcription jobs from a job broker, so that
+the API nodes only receive requests and the worker capacity scales on its own.
+
+Usage: python -m moseca.api.worker --broker http://broker-host:8100 [--framework torch]
+           [--threads 8] [--warm] [--poll-interval 1]
+
+The broker is a broker server (see moseca.api.broker_server) for workers on other hosts than
+the API, with its token in JOB_BROKER_TOKEN, or sqlite:///data/jobs.db on the API host.
+"""
+import argparse
+import os
+import pickle
+import shutil
+import socket
+import threading
+import time
+import traceback
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+from moseca.api.service.broker import (
+    Broker, JobInput, JobOutputDir, JobOutputPath, broker_from_url
+)
+from moseca.api.service.metrics import call_with_timings
+from moseca.api.service.models import call_target, warm_models
+from moseca.api.service.worker_pools import JOB_FRAMEWORKS, MODEL_FRAMEWORKS, init_worker
+
+
+class JobWorker:
+    """Claims jobs from a broker one at a time, runs them in this process and publishes their outputs."""
+
+    def __init__(self, broker: Broker, job_types: Optional[List[str]] = None,
+                 workspace_root: str = "data/worker", poll_interval: float = 1.0):
+        self.broker = broker
+        self.job_types = job_types
+        self.workspace_root = Path(workspace_root)
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def _materialize(self, value, workspace: Path):
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._materialize(item, workspace) for item in value)
+        if isinstance(value, JobInput):
+            return workspace / "inputs" / value.name
+        if isinstance(value, JobOutputDir):
+            path = workspace / "outputs" / str(value.index)
+            path.mkdir(parents=True, exist_ok=True)
+            return path
+        return value
+
+    def _pack_result(self, value, workspace: Path):
+        if isinstance(value, (list, tuple)):
+            return type(value)(self._pack_result(item, workspace) for item in value)
+        if isinstance(value, Path):
+            try:
+                index, *relative = value.relative_to(workspace / "outputs").parts
+            except ValueError:
+                return value
+            return JobOutputPath(int(index), "/".join(relative))
+        return value
+
+    def run_job(self, job_id: str, payload: bytes):
+        job = pickle.loads(payload)
+        workspace = self.workspace_root / job_id
+        try:
+            self.broker.download_files(job_id, "input", lambda name: workspace / "inputs" / name)
+            args = self._materialize(job["args"], workspace)
+            kwargs = {key: self._materialize(value, workspace) for key, value in job["kwargs"].items()}
+            result, timings, started_at = call_with_timings(call_target, job["target"], *args, **kwargs)
+
+            outputs = workspace / "outputs"
+            output_files = {
+                path.relative_to(outputs).as_posix(): str(path) for path in outputs.rglob("*") if path.is_file()
+            }
+            packed = pickle.dumps((self._pack_result(result, workspace), timings, started_at))
+            self.broker.complete(job_id, packed, output_files)
+        except Exception as e:
+            traceback.print_exc()
+            self.broker.fail(job_id, f"{type(e).__name__}: {e}")
+        finally:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    def run_once(self) -> bool:
+        """Runs the next job, if any, and returns whether there was one."""
+        claimed = self.broker.claim(self.worker_id, self.job_types)
+        if claimed is None:
+            return False
+        job_id, job_type, payload = claimed
+        print(f"Running job {job_id} ({job_type})")
+        start = time.perf_counter()
+        self.run_job(job_id, payload)
+        print(f"Finished job {job_id} in {time.perf_counter() - start:.1f}s")
+        return True
+
+    def run_forever(self, stop: Optional[threading.Event] = None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            if not self.run_once():
+                stop.wait(self.poll_interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run separation and transcription jobs from a job broker.")
+    parser.add_argument("--broker", default=os.environ.get("JOB_BROKER"), help="Broker URL, like http://broker-host:8100 or sqlite:///data/jobs.db.")
+    parser.add_argument("--framework", choices=["torch", "tensorflow", "all"], default="all",
+                        help="Only run the jobs of one framework, to keep one framework per process.")
+    parser.add_argument("--job-types", help="Comma-separated job types to run, instead of --framework.")
+    parser.add_argument("--threads", type=int, default=os.cpu_count(), help="Threads of the framework.")
+    parser.add_argument("--warm", action="store_true", help="Load the models of the job types before the first job.")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between checks for new jobs.")
+    args = parser.parse_args()
+
+    broker = broker_from_url(args.broker)
+    if broker is None or args.broker == "memory":
+        parser.error("a shared broker is needed, like --broker http://broker-host:8100")
+
+    if args.job_types:
+        job_types = [job_type.strip() for job_type in args.job_types.split(",") if job_type.strip()]
+    elif args.framework != "all":
+        job_types = [job_type for job_type, framework in JOB_FRAMEWORKS.items() if framework == args.framework]
+    else:
+        job_types = None
+
+    if args.framework != "all":
+        init_worker(args.framework, args.threads)
+    if args.warm:
+        warm_models([name for name, framework in MODEL_FRAMEWORKS.items()
+                     if args.framework in ("all", framework)])
+
+    print(f"Worker running {', '.join(job_types) if job_types else 'all jobs'} from {args.broker}")
+    try:
+        JobWorker(broker, job_types, poll_interval=args.poll_interval).run_forever()
+    except KeyboardInterrupt:
+        pass
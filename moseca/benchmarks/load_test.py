@@ -0,0 +1,242 @@
+"""
+Load test of the API with calibrated stub models (see moseca/api/service/stub_inference.py),
+to measure what the API layer handles on its own: uploads, file handling, zipping and scheduling.
+
+The server runs in this process with uvicorn, unless --url points to a running server.
+Workers send requests in a closed loop, picking endpoints at random by the weights of --mix.
+
+Usage: python -m moseca.benchmarks.load_test [--concurrency 8] [--requests 200]
+           [--mix align-audio=3,beat-grid=2,split-audio=1] [--stub-scale 0.1] [--output load.json]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import socket
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from moseca.benchmarks.synthetic_audio import (
+    band_mixture, chord_mixture, click_track, drum_noise, write_audio
+)
+
+TEMPO = 120
+
+DEFAULT_MIX = "split-audio=1,align-audio=3,beat-grid=2,audio-to-midi=2,audio-to-midi-drums=1,metrics=1"
+
+# Endpoints downloading from YouTube, only in the mix when --youtube-url is given
+YOUTUBE_ENDPOINTS = ("yt-to-mp3", "split-yt-audio")
+
+
+def make_inputs(duration: float) -> dict:
+    """Encodes the synthetic inputs as WAV files in memory."""
+    inputs = {}
+    for name, y in (
+        ('band', band_mixture(TEMPO, duration)),
+        ('click', click_track(TEMPO, duration)),
+        ('chords', chord_mixture(duration)),
+        ('drums', drum_noise(TEMPO, duration)),
+    ):
+        buffer = io.BytesIO()
+        buffer.name = f"{name}.wav"
+        write_audio(buffer, y)
+        inputs[name] = buffer.getvalue()
+    return inputs
+
+
+def _unique(payload: bytes, request_number: int) -> bytes:
+    # Overwrite the last sample frame, so every upload has a new hash and misses the caches
+    return payload[:-4] + request_number.to_bytes(4, 'little')
+
+
+def _upload(session, url, name, payload, data):
+    return session.post(url, files={'audio_file': (f"{name}.wav", payload, 'audio/wav')}, data=data)
+
+
+def _endpoints(youtube_url=None) -> dict:
+    """Returns the request of every endpoint as fn(session, base_url, payloads)."""
+    return {
+        'split-audio': lambda s, base, p: _upload(
+            s, f"{base}/split-audio", 'band', p('band'), {'separation_mode': 'Small Band', 'tempo': TEMPO}),
+        'align-audio': lambda s, base, p: _upload(
+            s, f"{base}/align-audio", 'click', p('click'), {'tempo': TEMPO, 'start_time': 2, 'end_time': 12}),
+        'beat-grid': lambda s, base, p: _upload(
+            s, f"{base}/beat-grid", 'click', p('click'), {'tempo': TEMPO}),
+        'audio-to-midi': lambda s, base, p: _upload(
+            s, f"{base}/audio-to-midi", 'chords', p('chords'), {'tempo': TEMPO}),
+        'audio-to-midi-drums': lambda s, base, p: _upload(
+            s, f"{base}/audio-to-midi", 'drums', p('drums'), {'tempo': TEMPO, 'percussion': True}),
+        'metrics': lambda s, base, p: s.get(f"{base}/metrics"),
+        'yt-to-mp3': lambda s, base, p: s.post(f"{base}/yt-to-mp3", data={'youtube_url': youtube_url}),
+        'split-yt-audio': lambda s, base, p: s.post(f"{base}/split-yt-audio", data={
+            'youtube_url': youtube_url, 'separation_mode': 'Duet', 'tempo': TEMPO}),
+    }
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for item in filter(None, mix.split(',')):
+        name, _, weight = item.partition('=')
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def run_load(base_url: str, inputs: dict, mix: dict, concurrency: int, total_requests: int,
+             unique_inputs: bool = True, youtube_url=None, seed: int = 0) -> dict:
+    """
+    Sends total_requests requests from `concurrency` workers and returns the latencies
+    and statuses by endpoint, with the wall time of the run.
+    """
+    endpoints = _endpoints(youtube_url)
+    names, weights = list(mix), list(mix.values())
+    counter = iter(range(total_requests))
+    counter_lock = threading.Lock()
+    results = defaultdict(list)
+    results_lock = threading.Lock()
+
+    def worker(worker_id):
+        rng = random.Random(seed + worker_id)
+        with requests.Session() as session:
+            while True:
+                with counter_lock:
+                    request_number = next(counter, None)
+                if request_number is None:
+                    return
+                name = rng.choices(names, weights)[0]
+
+                def payload(kind):
+                    return _unique(inputs[kind], request_number) if unique_inputs else inputs[kind]
+
+                start = time.perf_counter()
+                try:
+                    response = endpoints[name](session, base_url, payload)
+                    status = response.status_code
+                except requests.RequestException:
+                    status = 'connection error'
+                latency = time.perf_counter() - start
+                with results_lock:
+                    results[name].append((latency, status))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    return {'wall_seconds': time.perf_counter() - start, 'results': dict(results)}
+
+
+def summarize(samples) -> dict:
+    latencies = np.array([latency for latency, _ in samples]) * 1000
+    statuses = Counter(str(status) for _, status in samples)
+    errors = sum(count for status, count in statuses.items() if not status.startswith('2'))
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': errors / len(samples),
+        'statuses': dict(statuses),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_ms': float(latencies.mean()),
+    }
+
+
+def report(run: dict) -> dict:
+    endpoints = {name: summarize(samples) for name, samples in sorted(run['results'].items())}
+    all_samples = [sample for samples in run['results'].values() for sample in samples]
+    total = summarize(all_samples)
+    total['throughput_rps'] = len(all_samples) / run['wall_seconds']
+    for name, summary in endpoints.items():
+        summary['throughput_rps'] = summary['requests'] / run['wall_seconds']
+    return {'wall_seconds': run['wall_seconds'], 'total': total, 'endpoints': endpoints}
+
+
+def print_report(summary: dict):
+    print(f"{'endpoint':>20} {'reqs':>6} {'errors':>7} {'req/s':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    rows = list(summary['endpoints'].items()) + [('total', summary['total'])]
+    for name, s in rows:
+        print(f"{name:>20} {s['requests']:>6} {s['error_rate']:>6.1%} {s['throughput_rps']:>7.2f} "
+              f"{s['p50_ms']:>9.1f} {s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f}")
+    for name, s in rows:
+        if s['errors']:
+            print(f"{name}: statuses {s['statuses']}")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server():
+    """Starts the API with uvicorn in a background thread, and returns the server and its URL."""
+    import uvicorn
+    from moseca.api.main import app
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("The server failed to start.")
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{port}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the API with stub models.")
+    parser.add_argument('--url', help="Base URL of a running server, instead of an in-process one.")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients.")
+    parser.add_argument('--requests', type=int, default=200, help="Total requests to send.")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Comma-separated endpoint=weight pairs.")
+    parser.add_argument('--duration', type=float, default=15.0, help="Seconds of audio of every upload.")
+    parser.add_argument('--stub-scale', type=float, default=None,
+                        help="Multiplier of the stub run times, see STUB_INFERENCE_SCALE.")
+    parser.add_argument('--real-models', action='store_true', help="Run the real models in the in-process server.")
+    parser.add_argument('--allow-cache-hits', action='store_true',
+                        help="Upload identical files, so repeated requests can hit the caches.")
+    parser.add_argument('--youtube-url', help="Video to request from the YouTube endpoints.")
+    parser.add_argument('--output', help="Path of the JSON report.")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    if args.youtube_url is None:
+        mix = {name: weight for name, weight in mix.items() if name not in YOUTUBE_ENDPOINTS}
+    unknown = [name for name in mix if name not in _endpoints()]
+    if unknown or not mix:
+        parser.error(f"unknown or empty endpoint mix: {', '.join(unknown)}")
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        # The API reads the stub settings when it is imported
+        if not args.real_models:
+            os.environ['STUB_INFERENCE'] = '1'
+        if args.stub_scale is not None:
+            os.environ['STUB_INFERENCE_SCALE'] = str(args.stub_scale)
+        server, thread, base_url = start_server()
+
+    try:
+        run = run_load(base_url.rstrip('/'), make_inputs(args.duration), mix, args.concurrency,
+                       args.requests, not args.allow_cache_hits, args.youtube_url)
+    finally:
+        if server is not None:
+            server.should_exit = True
+            thread.join()
+
+    summary = report(run)
+    summary['config'] = {
+        'concurrency': args.concurrency, 'requests': args.requests, 'mix': mix,
+        'audio_seconds': args.duration, 'stub_inference': args.url is None and not args.real_models,
+        'stub_scale': args.stub_scale, 'unique_inputs': not args.allow_cache_hits,
+    }
+    print_report(summary)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Report saved to {args.output}")
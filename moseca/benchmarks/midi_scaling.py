@@ -0,0 +1,48 @@
+"""
+Scaling benchmark for the MIDI post-processing stages on synthetic drum MIDI.
+
+Usage: python -m moseca.benchmarks.midi_scaling [stage] [max_events]
+"""
+import contextlib
+import io
+import sys
+import time
+from functools import partial
+
+from moseca.api.prettyify import prettyify_events
+from moseca.api.quantize_midi import quantize_events
+from moseca.api.tempo_chunking import chunk_tempo_events
+from moseca.benchmarks.synthetic_midi import drum_events
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+
+STAGES = {
+    'quantize_midi': partial(quantize_events, bpm=120),
+    'tempo_chunking': partial(chunk_tempo_events, bpm=120),
+    'prettyify': prettyify_events,
+}
+
+
+def run(stage, sizes=SIZES, repeats: int = 3):
+    results = []
+    for num_events in sizes:
+        events = drum_events(num_events)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                stage(events)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        results.append({'events': len(events), 'seconds': best, 'ns_per_event': best / len(events) * 1e9})
+    return results
+
+
+if __name__ == '__main__':
+    stage_names = [sys.argv[1]] if len(sys.argv) > 1 else list(STAGES)
+    max_events = int(sys.argv[2]) if len(sys.argv) > 2 else SIZES[-1]
+    for name in stage_names:
+        print(name)
+        print(f"{'events':>10} {'seconds':>10} {'ns/event':>10}")
+        for result in run(STAGES[name], [size for size in SIZES if size <= max_events]):
+            print(f"{result['events']:>10} {result['seconds']:>10.4f} {result['ns_per_event']:>10.1f}")
@@ -0,0 +1,209 @@
+"""
+Benchmark of every pipeline stage on deterministic synthetic audio and MIDI.
+
+Every case runs in a fresh process, so its peak RSS is not inflated by earlier cases.
+Stages whose dependencies are not installed (Demucs, basic-pitch) are reported as skipped.
+
+Usage: python -m moseca.benchmarks.pipeline [--stages align_audio,detect_key_fast]
+           [--variants short,long] [--repeats 3] [--output benchmark_results.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from moseca.benchmarks.synthetic_audio import (
+    VARIANTS, band_mixture, chord_mixture, click_track, drum_noise, write_audio
+)
+from moseca.benchmarks.synthetic_midi import drum_events
+
+TEMPO = 120
+
+# Note events per second of synthetic drum MIDI, a busy 16th-note groove at TEMPO
+MIDI_EVENTS_PER_SECOND = 8
+
+
+def make_inputs(input_dir: Path, duration: float) -> dict:
+    """Writes the synthetic inputs of one variant and returns their paths by kind."""
+    inputs = {
+        'click': write_audio(str(input_dir / 'click.wav'), click_track(TEMPO, duration)),
+        'chords': write_audio(str(input_dir / 'chords.wav'), chord_mixture(duration)),
+        'drums': write_audio(str(input_dir / 'drums.wav'), drum_noise(TEMPO, duration)),
+        'band': write_audio(str(input_dir / 'band.wav'), band_mixture(TEMPO, duration)),
+    }
+    midi_path = str(input_dir / 'drums.mid')
+    drum_events(int(duration * MIDI_EVENTS_PER_SECOND)).to_midi().save(midi_path)
+    inputs['midi'] = midi_path
+    return inputs
+
+
+def _align_audio(inputs, output_dir):
+    from moseca.api.align_audio import align_audio
+    align_audio(inputs['click'], TEMPO, str(output_dir))
+
+
+def _align_audio_excerpt(inputs, output_dir):
+    from moseca.api.align_audio import align_audio, get_audio_duration
+    duration = get_audio_duration(inputs['click'])
+    align_audio(inputs['click'], TEMPO, str(output_dir), duration / 3, duration / 3 + 10)
+
+
+def _detect_key(fast):
+    def run(inputs, output_dir):
+        from moseca.api.get_key_signature import detect_key
+        detect_key(inputs['chords'], fast=fast)
+    return run
+
+
+def _separator(model_name, stem):
+    def run(inputs, output_dir):
+        from moseca.api.service.demucs_runner import separator
+        # Same arguments as process_audio_file
+        separator([Path(inputs['band'])], Path(output_dir), model_name, 1, 0.5, stem,
+                  False, False, "rescale", True, 320, False)
+    return run
+
+
+def _basic_pitch(inputs, output_dir):
+    from moseca.api.service.transcription import transcribe_pitched
+    transcribe_pitched(Path(inputs['chords']), Path(output_dir), 0.5, 0.3, 127.70, None, None, TEMPO)
+
+
+def _adtof(inputs, output_dir):
+    from moseca.api.service.transcription import transcribe_drums
+    transcribe_drums(Path(inputs['drums']), Path(output_dir))
+
+
+def _quantize_midi(inputs, output_dir):
+    from moseca.api.quantize_midi import quantize_midi
+    quantize_midi(inputs['midi'], TEMPO, str(output_dir))
+
+
+def _tempo_chunking(inputs, output_dir):
+    from moseca.api.tempo_chunking import tempo_chunking
+    tempo_chunking(inputs['midi'], TEMPO, str(output_dir))
+
+
+def _prettyify(inputs, output_dir):
+    from moseca.api.prettyify import prettyify
+    prettyify(inputs['midi'], str(output_dir))
+
+
+def _append_key_signature(inputs, output_dir):
+    from moseca.api.append_key_signature import append_key_signature
+    midi_path = os.path.join(output_dir, 'key.mid')
+    shutil.copyfile(inputs['midi'], midi_path)
+    append_key_signature(midi_path, 'C')
+
+
+STAGES = {
+    'align_audio': _align_audio,
+    'align_audio_excerpt': _align_audio_excerpt,
+    'detect_key_fast': _detect_key(True),
+    'detect_key': _detect_key(False),
+    'separator_duet': _separator('htdemucs', 'vocals'),
+    'separator_small_band': _separator('htdemucs', None),
+    'separator_full_band': _separator('htdemucs_6s', None),
+    'basic_pitch': _basic_pitch,
+    'adtof': _adtof,
+    'quantize_midi': _quantize_midi,
+    'tempo_chunking': _tempo_chunking,
+    'prettyify': _prettyify,
+    'append_key_signature': _append_key_signature,
+}
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+def _run_case(stage_name: str, inputs: dict, repeats: int) -> dict:
+    """Runs one stage in the current process, which is a fresh process for every case."""
+    stage = STAGES[stage_name]
+    timings = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        try:
+            for _ in range(repeats):
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    stage(inputs, output_dir)
+                timings.append(time.perf_counter() - start)
+        except ImportError as e:
+            return {'skipped': f"missing dependency: {e.name or e}"}
+    return {'seconds': min(timings), 'mean_seconds': sum(timings) / len(timings), 'peak_rss_mb': _peak_rss_mb()}
+
+
+def run(stage_names, variant_names, repeats: int = 3) -> list:
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as root:
+        for variant in variant_names:
+            duration = VARIANTS[variant]
+            input_dir = Path(root) / variant
+            input_dir.mkdir()
+            inputs = make_inputs(input_dir, duration)
+            for stage_name in stage_names:
+                with context.Pool(1) as pool:
+                    result = pool.apply(_run_case, (stage_name, inputs, repeats))
+                result = {'stage': stage_name, 'variant': variant, 'audio_seconds': duration, **result}
+                if 'seconds' in result:
+                    result['audio_seconds_per_wall_second'] = duration / result['seconds']
+                results.append(result)
+                print(_format_result(result), flush=True)
+    return results
+
+
+def _format_result(result: dict) -> str:
+    if 'skipped' in result:
+        return f"{result['stage']:>22} {result['variant']:>6}  skipped ({result['skipped']})"
+    return (f"{result['stage']:>22} {result['variant']:>6} {result['seconds']:>9.3f}s "
+            f"{result['audio_seconds_per_wall_second']:>9.1f}x {result['peak_rss_mb']:>8.0f} MB")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic audio.")
+    parser.add_argument('--stages', default=','.join(STAGES), help="Comma-separated stages to run.")
+    parser.add_argument('--variants', default=','.join(VARIANTS), help="Comma-separated input lengths.")
+    parser.add_argument('--repeats', type=int, default=3, help="Runs per case, the fastest is reported.")
+    parser.add_argument('--output', default='benchmark_results.json', help="Path of the JSON results.")
+    args = parser.parse_args()
+
+    stages = [name for name in args.stages.split(',') if name]
+    variants = [name for name in args.variants.split(',') if name]
+    unknown = [name for name in stages if name not in STAGES] + [name for name in variants if name not in VARIANTS]
+    if unknown:
+        parser.error(f"unknown stages or variants: {', '.join(unknown)}")
+
+    print(f"{'stage':>22} {'input':>6} {'wall':>10} {'audio/wall':>10} {'peak RSS':>11}")
+    report = {
+        'commit': _git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'repeats': args.repeats,
+        'results': run(stages, variants, args.repeats),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {args.output}")
@@ -0,0 +1,131 @@
+"""
+Startup-time benchmark of the API: the import time of moseca.api.main, the ML frameworks it
+imports, the time until uvicorn serves light traffic and the time until the models are warm.
+
+Usage: python -m moseca.benchmarks.startup [--repeats 3] [--warm-timeout 300]
+           [--importtime-top 15] [--output startup.json]
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+# Modules that should only be imported when a route needs them
+HEAVY_MODULES = ('torch', 'demucs', 'tensorflow', 'basic_pitch', 'adtof')
+
+_IMPORT_SCRIPT = f"""
+import json, sys, time
+start = time.perf_counter()
+import moseca.api.main
+print(json.dumps({{
+    'seconds': time.perf_counter() - start,
+    'heavy_modules': [name for name in {HEAVY_MODULES!r} if name in sys.modules],
+    'modules': len(sys.modules),
+}}))
+"""
+
+
+def measure_import() -> dict:
+    """Imports the API in a fresh interpreter and returns the import time and heavy modules loaded."""
+    result = subprocess.run([sys.executable, '-c', _IMPORT_SCRIPT], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list:
+    """Returns the modules with the largest cumulative import time, from python -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import moseca.api.main'],
+                            capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        imports.append({'module': name.strip(), 'cumulative_seconds': int(cumulative) / 1e6})
+    imports.sort(key=lambda item: item['cumulative_seconds'], reverse=True)
+    return imports[:top]
+
+
+def _get_status(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, OSError):
+        return None
+
+
+def measure_server(warm_timeout: float) -> dict:
+    """
+    Starts uvicorn in a subprocess and returns the seconds until /health/ready answers
+    (light traffic) and until /health/ready?models=true answers 200 (models warm).
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}/health/ready"
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'moseca.api.main:app', '--port', str(port), '--log-level', 'warning'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    result = {'light_traffic_seconds': None, 'models_warm_seconds': None}
+    try:
+        while time.perf_counter() - start < warm_timeout and process.poll() is None:
+            if result['light_traffic_seconds'] is None:
+                if _get_status(base_url) == 200:
+                    result['light_traffic_seconds'] = time.perf_counter() - start
+            elif _get_status(base_url + '?models=true') == 200:
+                result['models_warm_seconds'] = time.perf_counter() - start
+                break
+            time.sleep(0.05)
+    finally:
+        process.terminate()
+        process.wait()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of the API.")
+    parser.add_argument('--repeats', type=int, default=3, help="Fresh interpreters per measurement.")
+    parser.add_argument('--warm-timeout', type=float, default=300.0,
+                        help="Seconds to wait for the models to be warm.")
+    parser.add_argument('--importtime-top', type=int, default=15, help="Slowest imports to list.")
+    parser.add_argument('--output', help="Path of the JSON results.")
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.repeats)]
+    import_seconds = sorted(run['seconds'] for run in imports)
+    print(f"import moseca.api.main: {import_seconds[len(import_seconds) // 2]:.3f}s median "
+          f"(min {import_seconds[0]:.3f}s), heavy modules: {', '.join(imports[-1]['heavy_modules']) or 'none'}")
+
+    servers = [measure_server(args.warm_timeout) for _ in range(args.repeats)]
+    for i, server in enumerate(servers, 1):
+        light, warm = server['light_traffic_seconds'], server['models_warm_seconds']
+        light_text = f"light traffic after {light:.3f}s" if light is not None else "never ready"
+        warm_text = f"models warm after {warm:.3f}s" if warm is not None else "models not warm"
+        print(f"server {i}: {light_text}, {warm_text}")
+
+    slowest = slowest_imports(args.importtime_top)
+    print("Slowest imports (cumulative):")
+    for item in slowest:
+        print(f"  {item['cumulative_seconds']:>8.3f}s  {item['module']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'stub_inference': os.environ.get('STUB_INFERENCE'),
+                'warm_models': os.environ.get('WARM_MODELS'),
+                'imports': imports,
+                'servers': servers,
+                'slowest_imports': slowest,
+            }, f, indent=2)
+        print(f"Results saved to {args.output}")
@@ -0,0 +1,95 @@
+import numpy as np
+import soundfile as sf
+
+SAMPLE_RATE = 44100
+
+# Durations in seconds of the short and long variants of every input
+VARIANTS = {
+    'short': 15.0,
+    'long': 180.0,
+}
+
+# C major chord progression (I - V - vi - IV) as MIDI note numbers
+CHORD_PROGRESSION = [[60, 64, 67], [55, 59, 62, 67], [57, 60, 64], [53, 57, 60, 65]]
+
+
+def _midi_to_hz(note):
+    return 440.0 * 2.0 ** ((np.asarray(note) - 69) / 12.0)
+
+
+def click_track(tempo: float, duration: float, sr: int = SAMPLE_RATE, first_beat: float = 0.5,
+                seed: int = 0) -> np.ndarray:
+    """
+    Builds a click track with a louder, higher click on every downbeat, starting at
+    first_beat seconds after some low-level noise, like silence before a song starts.
+    """
+    rng = np.random.default_rng(seed)
+    y = rng.normal(0, 1e-3, int(duration * sr)).astype(np.float32)
+    click_length = int(0.03 * sr)
+    t = np.arange(click_length) / sr
+    envelope = np.exp(-t * 120)
+    beat_times = np.arange(first_beat, duration - 0.05, 60.0 / tempo)
+    for i, beat_time in enumerate(beat_times):
+        downbeat = i % 4 == 0
+        click = (0.9 if downbeat else 0.5) * envelope * np.sin(2 * np.pi * (1500 if downbeat else 1000) * t)
+        start = int(beat_time * sr)
+        y[start:start + click_length] += click[:len(y) - start]
+    return y
+
+
+def chord_mixture(duration: float, sr: int = SAMPLE_RATE, chord_seconds: float = 2.0,
+                  seed: int = 0) -> np.ndarray:
+    """Builds sine chords with a few harmonics, cycling through CHORD_PROGRESSION."""
+    rng = np.random.default_rng(seed)
+    num_samples = int(duration * sr)
+    y = np.zeros(num_samples, dtype=np.float32)
+    chord_samples = int(chord_seconds * sr)
+    t = np.arange(chord_samples) / sr
+    fade = np.minimum(1.0, np.minimum(t, t[::-1]) / 0.02)
+    for i, start in enumerate(range(0, num_samples, chord_samples)):
+        chord = CHORD_PROGRESSION[i % len(CHORD_PROGRESSION)]
+        segment = np.zeros(chord_samples)
+        for frequency in _midi_to_hz(chord):
+            phase = rng.uniform(0, 2 * np.pi)
+            for harmonic, gain in ((1, 1.0), (2, 0.4), (3, 0.2)):
+                segment += gain * np.sin(2 * np.pi * frequency * harmonic * t + phase)
+        segment *= 0.25 / len(chord) * fade
+        end = min(start + chord_samples, num_samples)
+        y[start:end] += segment[:end - start]
+    return y
+
+
+def drum_noise(tempo: float, duration: float, sr: int = SAMPLE_RATE, seed: int = 0) -> np.ndarray:
+    """Builds drum-like bursts: low thumps on beats 1 and 3, noise snares on 2 and 4, hats on 8ths."""
+    rng = np.random.default_rng(seed)
+    y = np.zeros(int(duration * sr), dtype=np.float32)
+    eighth = 30.0 / tempo
+
+    def add(start_time, burst):
+        start = int(start_time * sr)
+        if start < len(y):
+            y[start:start + len(burst)] += burst[:len(y) - start]
+
+    kick_t = np.arange(int(0.15 * sr)) / sr
+    kick = 0.8 * np.exp(-kick_t * 30) * np.sin(2 * np.pi * 60 * kick_t)
+    for i, start_time in enumerate(np.arange(0.0, duration, eighth)):
+        if i % 4 == 0:
+            add(start_time, kick)
+        elif i % 4 == 2:
+            add(start_time, 0.5 * np.exp(-kick_t * 25) * rng.normal(0, 1, len(kick_t)))
+        hat_length = int(0.04 * sr)
+        add(start_time, 0.15 * np.exp(-np.arange(hat_length) / sr * 90) * rng.normal(0, 1, hat_length))
+    return y
+
+
+def band_mixture(tempo: float, duration: float, sr: int = SAMPLE_RATE, seed: int = 0) -> np.ndarray:
+    """Mixes chords and drums into a stereo signal, as an input for source separation."""
+    mono = 0.6 * chord_mixture(duration, sr, seed=seed) + 0.5 * drum_noise(tempo, duration, sr, seed=seed)
+    return np.stack([mono, np.roll(mono, int(0.0005 * sr))], axis=1)
+
+
+def write_audio(path: str, y: np.ndarray, sr: int = SAMPLE_RATE) -> str:
+    """Writes a signal to a file, peak-normalized to avoid clipping."""
+    peak = np.max(np.abs(y))
+    sf.write(path, y / peak * 0.9 if peak > 0.9 else y, sr)
+    return path
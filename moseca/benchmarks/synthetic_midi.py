@@ -0,0 +1,43 @@
+import numpy as np
+from mido import MetaMessage
+from moseca.api.midi_events import EVENT_DTYPE, MidiEvents, NOTE_OFF, NOTE_ON
+
+
+def drum_events(num_events: int, ticks_per_beat: int = 480, seed: int = 0) -> MidiEvents:
+    """
+    Builds a deterministic drum track with num_events note events on Channel 10.
+
+    Hits sit on a 16th grid with some jitter, and every 8-measure chunk is randomly
+    offset by up to one 16th so that tempo_chunking has misalignments to correct.
+    """
+    rng = np.random.default_rng(seed)
+    ticks_per_16th = ticks_per_beat // 4
+    chunk_size = ticks_per_beat * 4 * 8
+    num_hits = max(1, num_events // 2)
+
+    # Hits on a 16th grid, one or two per 8th note, spread over the required number of chunks
+    grid_positions = np.sort(rng.integers(0, num_hits * 2, num_hits))
+    times = grid_positions * ticks_per_16th
+    chunk_offsets = rng.choice([0, 0, ticks_per_16th, -ticks_per_16th], times[-1] // chunk_size + 1)
+    times = times + chunk_offsets[times // chunk_size]
+    times = np.maximum(times + rng.integers(-ticks_per_16th // 3, ticks_per_16th // 3 + 1, num_hits), 0)
+    times.sort()
+
+    hits = np.zeros(num_hits, dtype=EVENT_DTYPE)
+    hits['time'] = times
+    hits['type'] = NOTE_ON
+    hits['channel'] = 9
+    hits['note'] = rng.choice([36, 38, 42, 46, 49], num_hits)
+    hits['velocity'] = rng.integers(40, 128, num_hits)
+    hits['ref'] = -1
+
+    releases = hits.copy()
+    releases['time'] += rng.integers(10, ticks_per_beat, num_hits)
+    releases['type'] = NOTE_OFF
+    releases['velocity'] = 0
+
+    array = np.concatenate([hits, releases])
+    array = array[np.argsort(array['time'], kind='stable')]
+
+    events = MidiEvents(array, [], ticks_per_beat, 1)
+    return events.with_meta(array, [MetaMessage('end_of_track', time=0)], array['time'][-1], 0, at_end=True)
@@ -0,0 +1,30 @@
+import importlib
+import os
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def api_workdir(tmp_path_factory):
+    """Working directory of the API under test, where it keeps its data/ directory."""
+    return tmp_path_factory.mktemp("api")
+
+
+@pytest.fixture(scope="session")
+def api_main(api_workdir):
+    """The API module, imported in its own working directory as it creates its caches on import."""
+    cwd = os.getcwd()
+    os.chdir(api_workdir)
+    try:
+        return importlib.import_module("moseca.api.main")
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def client(api_main, api_workdir, monkeypatch):
+    """A client of the API, without the startup events, so no worker pool is started."""
+    from fastapi.testclient import TestClient
+
+    monkeypatch.chdir(api_workdir)
+    return TestClient(api_main.app)
@@ -0,0 +1,145 @@
+"""
+Regression tests of the beat tracking of align_audio against its original full-rate path.
+
+Beats used to be tracked on the whole file at its own sample rate with librosa's defaults.
+They are now tracked on an 11025 Hz mono copy of a window around the excerpt, which must
+find the same beats and trim points within a few frames of the original analysis.
+"""
+import librosa
+import numpy as np
+import pytest
+import soundfile as sf
+
+from moseca.api import align_audio
+from moseca.api.align_audio import _make_grid, find_trim_points, get_beat_grid, get_trim_points
+
+SAMPLE_RATE = 44100
+DURATION = 30.0
+# Frames of the original analysis last 512 samples, 11.6 ms at 44100 Hz
+BASELINE_FRAME = 512 / SAMPLE_RATE
+# Largest accepted difference with the original analysis of a beat or trim point, in seconds.
+# The beat tracker of both moves single beats by up to four frames.
+TOLERANCE = 0.05
+# Excerpts to trim, in seconds
+EXCERPTS = [(None, None), (5.3, 12.1), (10.0, 20.0), (17.7, None)]
+
+
+def _click_track(path, bpm: int):
+    """Clicks on every beat from the start of the file, louder on downbeats, over a noise floor."""
+    signal = 0.01 * np.random.default_rng(0).standard_normal(int(DURATION * SAMPLE_RATE))
+    click = np.sin(2 * np.pi * 1000 * np.arange(441) / SAMPLE_RATE) * np.hanning(441)
+    for beat in range(int((DURATION - 0.1) * bpm / 60)):
+        position = int((0.05 + beat * 60 / bpm) * SAMPLE_RATE)
+        signal[position:position + len(click)] += click * (0.9 if beat % 4 == 0 else 0.5)
+    sf.write(path, np.stack([signal, signal], axis=1), SAMPLE_RATE, subtype="PCM_16")
+
+
+def _baseline_grid(path, bpm: int) -> dict:
+    """The beat grid of the original implementation, tracked on the whole file at its sample rate."""
+    y, sr = librosa.load(path, sr=None)
+    _, beat_frames = librosa.beat.beat_track(y=y, sr=sr, bpm=bpm, units="frames")
+    beat_times = librosa.frames_to_time(beat_frames, sr=sr)
+    return _make_grid(bpm, librosa.get_duration(y=y, sr=sr), 0.0, None, beat_times, beat_times[::4])
+
+
+@pytest.fixture(params=[90, 120, 140])
+def click_track(request, tmp_path):
+    path = tmp_path / f"clicks_{request.param}.wav"
+    _click_track(path, request.param)
+    return str(path), request.param
+
+
+def test_beats_match_full_rate_tracking(click_track):
+    path, bpm = click_track
+    baseline = _baseline_grid(path, bpm)["beat_times"]
+
+    beat_times = get_beat_grid(path, bpm)["beat_times"]
+
+    # Either may drop the last beats, as librosa trims weak beats at the end of the tracking
+    common = beat_times[beat_times <= baseline[-1] + TOLERANCE]
+    errors = np.array([beat - baseline[np.argmin(np.abs(baseline - beat))] for beat in common])
+    assert len(common) == len(baseline[baseline <= beat_times[-1] + TOLERANCE])
+    # No systematic delay, and no beat further than the tolerance from the original one
+    assert abs(np.median(errors)) <= BASELINE_FRAME
+    assert np.max(np.abs(errors)) <= TOLERANCE
+
+
+@pytest.mark.parametrize("start_time,end_time", EXCERPTS)
+def test_trim_points_match_full_rate_tracking(click_track, start_time, end_time):
+    path, bpm = click_track
+    expected_start, expected_end = find_trim_points(_baseline_grid(path, bpm), start_time, end_time)
+
+    # Excerpts only analyze a window around them
+    trim_start, trim_end = get_trim_points(path, bpm, start_time, end_time)
+
+    assert trim_start == pytest.approx(expected_start, abs=TOLERANCE)
+    if expected_end is None:
+        assert trim_end is None
+    else:
+        assert trim_end == pytest.approx(expected_end, abs=TOLERANCE)
+
+
+@pytest.fixture
+def analyses(monkeypatch):
+    """Counts the beat tracking runs, starting from an empty beat grid cache."""
+    calls = []
+
+    def analyze_window(*args):
+        calls.append(args)
+        return analyze(*args)
+
+    analyze = align_audio._analyze_window
+    monkeypatch.setattr(align_audio, "_analyze_window", analyze_window)
+    align_audio.beat_grid_cache.clear()
+    yield calls
+    align_audio.beat_grid_cache.clear()
+
+
+def test_beat_grid_cache(analyses, tmp_path):
+    path = str(tmp_path / "clicks.wav")
+    _click_track(path, 120)
+
+    grid = get_beat_grid(path, 120, audio_hash="song")
+    # Same audio and tempo, including excerpts within the analyzed range
+    assert get_beat_grid(path, 120, audio_hash="song") is grid
+    assert get_beat_grid(path, 120, 10.0, 20.0, audio_hash="song") is grid
+    assert len(analyses) == 1
+    # Another tempo, or other audio, is analyzed again
+    assert get_beat_grid(path, 90, audio_hash="song")["tempo"] == 90
+    get_beat_grid(path, 120, audio_hash="other")
+    assert len(analyses) == 3
+
+
+def test_beat_grid_cache_widens_excerpt_grids(analyses, tmp_path):
+    path = str(tmp_path / "clicks.wav")
+    _click_track(path, 120)
+
+    excerpt = get_beat_grid(path, 120, 10.0, 14.0, audio_hash="song")
+    # The whole file is not covered by the grid of the excerpt
+    grid = get_beat_grid(path, 120, audio_hash="song")
+
+    assert grid is not excerpt
+    assert get_beat_grid(path, 120, 10.0, 14.0, audio_hash="song") is grid
+    assert len(analyses) == 2
+
+
+def test_beat_grid_endpoint_uses_cache(client, analyses, tmp_path):
+    path = tmp_path / "clicks.wav"
+    _click_track(path, 120)
+
+    def post(tempo: int):
+        response = client.post(
+            "/beat-grid", files={"audio_file": ("clicks.wav", path.read_bytes())}, data={"tempo": tempo}
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    first = post(120)
+    hits = align_audio.beat_grid_cache.hits
+    # The upload is keyed by its content hash, so the same file is served from the cache
+    assert post(120) == first
+    assert align_audio.beat_grid_cache.hits == hits + 1
+    assert len(analyses) == 1
+    assert post(90)["tempo"] == 90
+    assert len(analyses) == 2
+    assert first["downbeat_times"] == first["beat_times"][::4]
@@ -0,0 +1,171 @@
+import io
+
+import pytest
+
+from moseca.api.service.artifacts import (
+    ArtifactStore, LocalArtifactStore, S3ArtifactStore, artifact_key, artifact_store_from_url
+)
+from moseca.api.service.cache import DiskCache
+
+
+class NotFound(Exception):
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeBody:
+    def __init__(self, data: bytes):
+        self._data = io.BytesIO(data)
+
+    def read(self) -> bytes:
+        return self._data.read()
+
+    def iter_chunks(self, chunk_size: int):
+        yield from iter(lambda: self._data.read(chunk_size), b"")
+
+
+class FakeS3Client:
+    """In-memory stand-in for the boto3 S3 client methods used by S3ArtifactStore."""
+
+    def __init__(self):
+        self.objects = {}
+        self.metadata = {}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise NotFound("NoSuchKey")
+        return {"Body": FakeBody(self.objects[Bucket, Key])}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[Bucket, Key] = Body
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise NotFound("404")
+        return {"Metadata": self.metadata.get((Bucket, Key), {})}
+
+    def upload_fileobj(self, f, Bucket, Key, ExtraArgs=None):
+        self.objects[Bucket, Key] = f.read()
+        self.metadata[Bucket, Key] = (ExtraArgs or {}).get("Metadata", {})
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+@pytest.fixture(params=["local", "s3"])
+def store(request, tmp_path):
+    if request.param == "local":
+        return LocalArtifactStore(str(tmp_path / "store"))
+    return S3ArtifactStore("bucket", "moseca", client=FakeS3Client())
+
+
+def _corrupt_blob(store, digest: str):
+    if isinstance(store, LocalArtifactStore):
+        store._blob_path(digest).write_bytes(b"garbage")
+    else:
+        store.client.objects["bucket", store._blob_key(digest)] = b"garbage"
+
+
+def test_put_and_get(store, tmp_path):
+    source = tmp_path / "song.mp3"
+    source.write_bytes(b"audio" * 1000)
+    (tmp_path / "out").mkdir()
+
+    digest = store.put("youtube/abc", str(source), "Song.mp3")
+    path = store.get("youtube/abc", str(tmp_path / "out"))
+
+    assert path == tmp_path / "out" / "Song.mp3"
+    assert path.read_bytes() == source.read_bytes()
+    assert store._has_blob(digest)
+    assert store.stats() == {"hits": 1, "misses": 0, "uploads": 1, "corrupted": 0, "errors": 0}
+
+
+def test_same_content_is_uploaded_once(store, tmp_path):
+    source = tmp_path / "song.mp3"
+    source.write_bytes(b"audio")
+
+    assert store.put("stems/a", str(source)) == store.put("stems/b", str(source))
+    assert store.uploads == 1
+
+
+def test_missing_key_is_a_miss(store, tmp_path):
+    assert store.get("midi/missing", str(tmp_path)) is None
+    assert store.stats()["misses"] == 1
+    assert store.stats()["errors"] == 0
+
+
+def test_digest_mismatch_deletes_blob_and_misses(store, tmp_path):
+    source = tmp_path / "song.mp3"
+    source.write_bytes(b"audio" * 1000)
+    digest = store.put("youtube/abc", str(source))
+    _corrupt_blob(store, digest)
+    (tmp_path / "out").mkdir()
+
+    assert store.get("youtube/abc", str(tmp_path / "out")) is None
+    assert not store._has_blob(digest)
+    assert list((tmp_path / "out").iterdir()) == []
+    stats = store.stats()
+    assert stats["corrupted"] == 1
+    assert stats["misses"] == 1
+    assert stats["hits"] == 0
+
+
+def test_backend_errors_are_misses(tmp_path):
+    def get_object(Bucket, Key):
+        raise NotFound("AccessDenied")
+
+    client = FakeS3Client()
+    client.get_object = get_object
+    store = S3ArtifactStore("bucket", client=client)
+
+    assert store.get("midi/abc", str(tmp_path)) is None
+    assert store.stats()["errors"] == 1
+    assert store.stats()["misses"] == 1
+
+
+def test_store_needs_every_backend_operation():
+    with pytest.raises(TypeError):
+        ArtifactStore()
+
+
+def test_disk_cache_writes_back_and_reads_through(store, tmp_path):
+    source = tmp_path / "song.mp3"
+    source.write_bytes(b"audio" * 1000)
+    key = artifact_key("youtube", "abc")
+    writer = DiskCache(str(tmp_path / "replica-1" / "youtube"), max_bytes=1 << 20, store=store)
+    reader = DiskCache(str(tmp_path / "replica-2" / "youtube"), max_bytes=1 << 20, store=store)
+
+    writer.put(key, str(source), "Song.mp3")
+    path = reader.get(key)
+
+    assert path.parent.parent == tmp_path / "replica-2" / "youtube"
+    assert path.name == "Song.mp3"
+    assert path.read_bytes() == source.read_bytes()
+    assert reader.stats()["store_hits"] == 1
+    # The entry is now local, so it is not downloaded again
+    assert reader.get(key) == path
+    assert store.hits == 1
+    # No download directory is left behind
+    assert list((tmp_path / "replica-2" / "youtube").glob(".*.download")) == []
+
+
+def test_disk_cache_corrupted_artifact_is_a_miss(store, tmp_path):
+    source = tmp_path / "song.mp3"
+    source.write_bytes(b"audio" * 1000)
+    digest = store.put("youtube/abc", str(source))
+    _corrupt_blob(store, digest)
+    cache = DiskCache(str(tmp_path / "cache" / "youtube"), max_bytes=1 << 20, store=store)
+
+    assert cache.get("abc") is None
+    assert len(cache) == 0
+    assert cache.stats()["misses"] == 1
+    assert list((tmp_path / "cache" / "youtube").glob("[!.]*")) == []
+
+
+def test_artifact_store_from_url(tmp_path):
+    assert artifact_store_from_url(None) is None
+    assert isinstance(artifact_store_from_url(str(tmp_path / "a")), LocalArtifactStore)
+    assert isinstance(artifact_store_from_url(f"file://{tmp_path}/b"), LocalArtifactStore)
+    with pytest.raises(ValueError):
+        artifact_store_from_url("ftp://host/artifacts")
@@ -0,0 +1,162 @@
+"""
+Tests of the lossless cuts of /align-audio against reference cuts made by FFmpeg.
+
+The reference of a cut is the input decoded by FFmpeg, which skips the encoder delay and
+padding of the LAME header, trimmed with atrim to the samples where cut_audio reports the
+cut lands. FFmpeg decodes the cut MP3 files through their rebuilt LAME header the same way.
+"""
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from moseca.api.audio_cut import MAX_LAME_DELAY, MAX_RESERVOIR_FRAMES, MP3_DECODER_DELAY, _scan_mp3, cut_audio
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+
+SAMPLE_RATE = 44100
+DURATION = 3.0
+# Encoder options of the MP3 files, by name
+MP3_ENCODINGS = {"cbr": ["-b:a", "128k"], "vbr": ["-q:a", "5"]}
+# Requested cuts, in seconds
+CUTS = [(0.5, 2.0), (0.0, 1.0), (1.234, None), (2.5, 10.0)]
+
+
+def _signal() -> np.ndarray:
+    """A chirp with noise, different in both channels, so a cut at the wrong sample does not match."""
+    t = np.arange(int(DURATION * SAMPLE_RATE)) / SAMPLE_RATE
+    noise = np.random.default_rng(0).standard_normal(len(t))
+    left = 0.3 * np.sin(2 * np.pi * (220 + 200 * t) * t) + 0.05 * noise
+    return np.stack([left, left[::-1]], axis=1)
+
+
+def _decode(audio_file, start: int = None, end: int = None) -> np.ndarray:
+    """Decodes a file with FFmpeg to stereo float samples, from sample start to sample end."""
+    command = ["ffmpeg", "-v", "error", "-i", str(audio_file)]
+    if start is not None:
+        command += ["-af", f"atrim=start_sample={start}" + (f":end_sample={end}" if end is not None else "")]
+    output = subprocess.run(command + ["-f", "f32le", "-ac", "2", "-"], capture_output=True, check=True).stdout
+    return np.frombuffer(output, dtype=np.float32).reshape(-1, 2)
+
+
+@pytest.fixture(scope="module")
+def sources(tmp_path_factory) -> dict:
+    directory = tmp_path_factory.mktemp("sources")
+    sources = {"wav": directory / "song.wav"}
+    sf.write(sources["wav"], _signal(), SAMPLE_RATE, subtype="PCM_16")
+    for name, options in MP3_ENCODINGS.items():
+        sources[name] = directory / f"{name}.mp3"
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-i", str(sources["wav"]), "-c:a", "libmp3lame", *options, str(sources[name])],
+            check=True,
+        )
+    return sources
+
+
+def _assert_matches_reference(source, output, start: float, end: float):
+    """Checks that the decoded cut is the decoded source between start and end."""
+    first = round(start * SAMPLE_RATE)
+    last = round(DURATION * SAMPLE_RATE) if end is None else round(end * SAMPLE_RATE)
+    decoded = _decode(output)
+
+    assert len(decoded) == last - first
+    np.testing.assert_array_equal(decoded, _decode(source, first, last))
+
+
+@pytest.mark.parametrize("trim_start,trim_end", CUTS)
+def test_wav_cut_is_sample_exact(sources, tmp_path, trim_start, trim_end):
+    output = tmp_path / "cut.wav"
+
+    mode, start, end = cut_audio(str(sources["wav"]), str(output), trim_start, trim_end)
+
+    assert mode == "exact"
+    # Rounded to samples
+    assert start == pytest.approx(trim_start, abs=0.5 / SAMPLE_RATE)
+    assert end == (None if trim_end is None else min(trim_end, DURATION))
+    _assert_matches_reference(sources["wav"], output, start, end)
+    # Integer samples are copied as they are
+    expected, _ = sf.read(sources["wav"], dtype="int16", start=round(start * SAMPLE_RATE),
+                          stop=None if end is None else round(end * SAMPLE_RATE))
+    np.testing.assert_array_equal(sf.read(output, dtype="int16")[0], expected)
+
+
+@pytest.mark.parametrize("trim_start,trim_end", CUTS)
+@pytest.mark.parametrize("encoding", MP3_ENCODINGS)
+def test_mp3_cut_matches_reference(sources, tmp_path, encoding, trim_start, trim_end):
+    output = tmp_path / "cut.mp3"
+
+    mode, start, end = cut_audio(str(sources[encoding]), str(output), trim_start, trim_end)
+
+    assert mode == "frame"
+    # The cut only starts earlier when the bit reservoir needs it, by a few frames at most
+    assert trim_start - MAX_RESERVOIR_FRAMES * 1152 / SAMPLE_RATE <= start <= trim_start
+    assert end == (None if trim_end is None else min(trim_end, DURATION))
+    _assert_matches_reference(sources[encoding], output, start, end)
+
+
+@pytest.mark.parametrize("trim_start,trim_end", CUTS)
+@pytest.mark.parametrize("encoding", MP3_ENCODINGS)
+def test_mp3_cut_lame_header(sources, tmp_path, encoding, trim_start, trim_end):
+    output = tmp_path / "cut.mp3"
+    _, _, source_info, _ = _scan_mp3(str(sources[encoding]))
+
+    _, start, end = cut_audio(str(sources[encoding]), str(output), trim_start, trim_end)
+    _, first, info, frames = _scan_mp3(str(output))
+
+    assert info["lame"] is not None
+    assert 0 <= info["delay"] <= MAX_LAME_DELAY
+    assert 0 <= info["padding"] <= MAX_LAME_DELAY
+    # The frames decode to the skipped delay, the cut and the padding
+    last = DURATION if end is None else end
+    assert len(frames) * first["samples"] - info["delay"] - info["padding"] == round((last - start) * SAMPLE_RATE)
+    if start == 0:
+        # Nothing is dropped before the first frame, so the delay of the encoder is kept
+        assert info["delay"] == source_info["delay"]
+    else:
+        # The frames before the start decoders need to warm up are kept
+        assert info["delay"] + MP3_DECODER_DELAY >= first["samples"]
+    if end is None:
+        assert info["padding"] == source_info["padding"]
+
+
+def _click_track(path, bpm: int = 120):
+    # A noise floor keeps the bit reservoir of the VBR encoding from reaching back over many frames
+    clicks = 0.01 * np.random.default_rng(0).standard_normal(int(DURATION * 2 * SAMPLE_RATE))
+    click = np.sin(2 * np.pi * 1000 * np.arange(441) / SAMPLE_RATE) * np.hanning(441)
+    for beat in range(int(DURATION * 2 * bpm / 60)):
+        position = int(beat * 60 / bpm * SAMPLE_RATE) + SAMPLE_RATE // 4
+        clicks[position:position + 441] += click * (0.9 if beat % 4 == 0 else 0.5)
+    sf.write(path, np.stack([clicks, clicks], axis=1), SAMPLE_RATE, subtype="PCM_16")
+
+
+@pytest.mark.parametrize("encoding", ["wav", *MP3_ENCODINGS])
+def test_align_audio_lossless_trim_headers(client, tmp_path, encoding):
+    source = tmp_path / "clicks.wav"
+    _click_track(source)
+    if encoding != "wav":
+        encoded = tmp_path / f"clicks.{encoding}.mp3"
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-i", str(source), "-c:a", "libmp3lame", *MP3_ENCODINGS[encoding], str(encoded)],
+            check=True,
+        )
+        source = encoded
+
+    with open(source, "rb") as f:
+        response = client.post(
+            "/align-audio",
+            files={"audio_file": (source.name, f)},
+            data={"tempo": 120, "start_time": 0, "end_time": 4, "lossless": "true"},
+        )
+
+    assert response.status_code == 200
+    assert response.headers["X-Cut-Mode"] == ("exact" if encoding == "wav" else "frame")
+    output = tmp_path / f"cut{source.suffix}"
+    output.write_bytes(response.content)
+    # The headers say where in the input the returned audio is, to the sample
+    first = round(float(response.headers["X-Trim-Start"]) * SAMPLE_RATE)
+    last = round(float(response.headers["X-Trim-End"]) * SAMPLE_RATE)
+    decoded = _decode(output)
+    assert len(decoded) == last - first > 0
+    np.testing.assert_array_equal(decoded, _decode(source, first, last))
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from moseca.api.service.audio_probe import AudioProbeError, AudioTooLong, check_audio, probe_audio
+
+
+@pytest.fixture
+def wav_file(tmp_path):
+    path = tmp_path / "song.wav"
+    sf.write(path, np.zeros((44100 * 2, 2)), 44100)
+    return str(path)
+
+
+@pytest.fixture
+def text_file(tmp_path):
+    path = tmp_path / "song.mp3"
+    path.write_text("This is not audio, whatever its extension says.\n" * 100)
+    return str(path)
+
+
+def test_probe_reads_headers(wav_file):
+    probe = probe_audio(wav_file)
+
+    assert probe["duration"] == pytest.approx(2.0)
+    assert probe["samplerate"] == 44100
+    assert probe["channels"] == 2
+    assert probe["format"] == "WAV"
+
+
+def test_probe_rejects_non_audio(text_file):
+    with pytest.raises(AudioProbeError):
+        probe_audio(text_file)
+
+
+def test_check_audio_rejects_long_audio(wav_file):
+    assert check_audio(wav_file, max_seconds=3)["duration"] == pytest.approx(2.0)
+    with pytest.raises(AudioTooLong):
+        check_audio(wav_file, max_seconds=1)
+
+
+def test_upload_of_non_audio_is_rejected(client, api_workdir, text_file):
+    with open(text_file, "rb") as f:
+        response = client.post("/beat-grid", files={"audio_file": ("song.mp3", f)}, data={"tempo": 120})
+
+    assert response.status_code == 415
+    assert "error" in response.json()
+    # The upload is removed with its workspace
+    assert list((api_workdir / "data" / "temp").glob("*/song.mp3")) == []
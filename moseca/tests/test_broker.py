@@ -0,0 +1,197 @@
+import asyncio
+import pickle
+import socket
+import threading
+import time
+import urllib.error
+from pathlib import Path
+
+import pytest
+import uvicorn
+
+from moseca.api.broker_server import create_broker_app
+from moseca.api.service.broker import (
+    MAX_ATTEMPTS, Broker, HTTPBroker, InProcessBroker, JobFailed, SQLiteBroker, broker_from_url, run_remote
+)
+from moseca.api.worker import JobWorker
+
+
+def copy_upper(input_path: Path, output_dir: Path) -> Path:
+    """Job target writing the upper-cased input to the output directory."""
+    output_path = output_dir / "nested" / "upper.txt"
+    output_path.parent.mkdir(parents=True)
+    output_path.write_text(input_path.read_text().upper())
+    return output_path
+
+
+def fail_job(input_path: Path):
+    raise ValueError("bad input")
+
+
+@pytest.fixture
+def broker_server(tmp_path):
+    """Serves a SQLite broker over HTTP in a thread, and returns its URL."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    app = create_broker_app(SQLiteBroker(str(tmp_path / "server" / "jobs.db")), "secret")
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{sock.getsockname()[1]}"
+    server.should_exit = True
+    thread.join()
+    sock.close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "http"])
+def broker(request, tmp_path):
+    if request.param == "memory":
+        return InProcessBroker()
+    if request.param == "http":
+        return HTTPBroker(request.getfixturevalue("broker_server"), token="secret")
+    return SQLiteBroker(str(tmp_path / "jobs.db"))
+
+
+def test_enqueue_claim_complete(broker, tmp_path):
+    input_path = tmp_path / "in.txt"
+    input_path.write_bytes(b"audio")
+    job_id = broker.enqueue("separation:htdemucs", b"payload", {"0/in.txt": str(input_path)})
+    assert broker.poll(job_id) == ("queued", None, None)
+
+    assert broker.claim("worker-1") == (job_id, "separation:htdemucs", b"payload")
+    assert broker.poll(job_id)[0] == "running"
+    assert broker.claim("worker-2") is None
+
+    names = broker.download_files(job_id, "input", lambda name: tmp_path / "worker" / name)
+    assert names == ["0/in.txt"]
+    assert (tmp_path / "worker" / "0" / "in.txt").read_bytes() == b"audio"
+
+    output_path = tmp_path / "out.mid"
+    output_path.write_bytes(b"midi")
+    broker.complete(job_id, b"result", {"0/out.mid": str(output_path)})
+    assert broker.poll(job_id) == ("done", b"result", None)
+    broker.download_files(job_id, "output", lambda name: tmp_path / "api" / name)
+    assert (tmp_path / "api" / "0" / "out.mid").read_bytes() == b"midi"
+
+    broker.delete(job_id)
+    assert broker.poll(job_id) == ("missing", None, None)
+
+
+def test_claim_oldest_job_of_requested_types(broker):
+    torch_job = broker.enqueue("separation:htdemucs", b"1", {})
+    tf_job = broker.enqueue("transcription:basic_pitch", b"2", {})
+    later_tf_job = broker.enqueue("transcription:adtof", b"3", {})
+
+    tf_types = ["transcription:basic_pitch", "transcription:adtof"]
+    assert broker.claim("tf", tf_types)[0] == tf_job
+    assert broker.claim("tf", tf_types)[0] == later_tf_job
+    assert broker.claim("tf", tf_types) is None
+    assert broker.claim("torch", ["separation:htdemucs"])[0] == torch_job
+
+
+def test_expired_lease_is_taken_over_then_failed(broker):
+    job_id = broker.enqueue("separation:htdemucs", b"payload", {})
+    for _ in range(MAX_ATTEMPTS):
+        # A lease in the past expires at once, as if the worker died
+        assert broker.claim("worker", lease_seconds=-1)[0] == job_id
+    assert broker.claim("worker") is None
+    status, _, error = broker.poll(job_id)
+    assert status == "failed"
+    assert "lost" in error
+
+
+def test_fail(broker):
+    job_id = broker.enqueue("transcription:adtof", b"payload", {})
+    broker.claim("worker")
+    broker.fail(job_id, "ValueError: bad input")
+    assert broker.poll(job_id) == ("failed", None, "ValueError: bad input")
+
+
+def test_sqlite_broker_is_shared_by_instances(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    job_id = SQLiteBroker(path).enqueue("separation:htdemucs", b"payload", {})
+    assert SQLiteBroker(path).claim("worker")[0] == job_id
+
+
+def test_broker_from_url(tmp_path):
+    assert broker_from_url(None) is None
+    assert isinstance(broker_from_url("memory"), InProcessBroker)
+    assert isinstance(broker_from_url(f"sqlite:///{tmp_path}/jobs.db"), SQLiteBroker)
+    assert isinstance(broker_from_url("http://broker:8100"), HTTPBroker)
+    with pytest.raises(ValueError):
+        broker_from_url("redis://localhost")
+
+
+def _run_with_worker(broker, tmp_path, coroutine):
+    stop = threading.Event()
+    worker = JobWorker(broker, workspace_root=str(tmp_path / "worker"), poll_interval=0.01)
+    thread = threading.Thread(target=worker.run_forever, args=(stop,))
+    thread.start()
+    try:
+        return asyncio.run(coroutine)
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_worker_runs_remote_job(broker, tmp_path):
+    input_path = tmp_path / "in.txt"
+    input_path.write_text("notes")
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+
+    result, timings, started_at = _run_with_worker(broker, tmp_path, run_remote(
+        broker, "transcription:basic_pitch", f"{__name__}:copy_upper", (input_path, output_dir), {},
+        poll_interval=0.01,
+    ))
+
+    assert result == output_dir / "nested" / "upper.txt"
+    assert result.read_text() == "NOTES"
+    assert isinstance(timings, list)
+    assert started_at > 0
+    # The job and the worker workspace are removed once the result is downloaded
+    assert list((tmp_path / "worker").iterdir()) == []
+
+
+def test_worker_reports_failed_job(broker, tmp_path):
+    input_path = tmp_path / "in.txt"
+    input_path.write_text("notes")
+
+    with pytest.raises(JobFailed, match="ValueError: bad input"):
+        _run_with_worker(broker, tmp_path, run_remote(
+            broker, "transcription:adtof", f"{__name__}:fail_job", (input_path,), {}, poll_interval=0.01,
+        ))
+
+
+def test_worker_only_claims_its_job_types(tmp_path):
+    broker = InProcessBroker()
+    job_id = broker.enqueue("separation:htdemucs", pickle.dumps({}), {})
+    worker = JobWorker(broker, job_types=["transcription:adtof"], workspace_root=str(tmp_path))
+    assert not worker.run_once()
+    assert broker.poll(job_id)[0] == "queued"
+
+
+def test_broker_needs_every_operation():
+    with pytest.raises(TypeError):
+        Broker()
+
+
+def test_http_broker_needs_the_token(broker_server):
+    with pytest.raises(urllib.error.HTTPError) as e:
+        HTTPBroker(broker_server, token="wrong").claim("worker")
+    assert e.value.code == 401
+
+
+def test_run_remote_times_out_without_worker(broker, tmp_path):
+    input_path = tmp_path / "in.txt"
+    input_path.write_text("notes")
+
+    with pytest.raises(JobFailed, match="did not finish within 0.2 seconds while queued"):
+        asyncio.run(run_remote(
+            broker, "transcription:adtof", f"{__name__}:copy_upper", (input_path, tmp_path), {},
+            poll_interval=0.01, timeout=0.2,
+        ))
+    # The job is removed, so no worker runs it later
+    assert broker.claim("worker") is None
@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+import time
+
+from moseca.api.service.cache import DiskCache, LRUCache
+
+
+def _write(path, size: int) -> str:
+    path.write_bytes(os.urandom(size))
+    return str(path)
+
+
+def _disk_usage(directory) -> int:
+    return sum(path.stat().st_size for path in directory.glob("[!.]*/*"))
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disk_cache_put_get_and_restart(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=1000)
+    path = cache.put("video/1", _write(tmp_path / "song.mp3", 100), "Song.mp3")
+
+    assert path.read_bytes() == (tmp_path / "song.mp3").read_bytes()
+    assert cache.get("video/1") == path
+    assert cache.get("video/2") is None
+    assert DiskCache(str(tmp_path / "cache"), max_bytes=1000).get("video/1") == path
+
+
+def test_disk_cache_replaces_stale_file(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=1000)
+    cache.put("song", _write(tmp_path / "old.mp3", 100))
+    path = cache.put("song", _write(tmp_path / "new.mp3", 100))
+
+    assert [entry.name for entry in path.parent.iterdir()] == ["new.mp3"]
+    assert cache.get("song") == path
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=250)
+    for name in "abc":
+        cache.put(name, _write(tmp_path / f"{name}.mp3", 100))
+        # Modification times order the entries
+        time.sleep(0.01)
+
+    assert "a" not in cache
+    assert cache.get("a") is None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size_bytes"] == 200
+
+
+def test_disk_cache_keeps_pinned_entries(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=250)
+    cache.pin("a")
+    for name in "abc":
+        cache.put(name, _write(tmp_path / f"{name}.mp3", 100))
+        time.sleep(0.01)
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+
+
+def test_disk_cache_budget_is_shared_by_instances(tmp_path):
+    # Two server processes using the same directory, each with its own index
+    first = DiskCache(str(tmp_path / "cache"), max_bytes=250)
+    second = DiskCache(str(tmp_path / "cache"), max_bytes=250)
+
+    first.put("a", _write(tmp_path / "a.mp3", 100))
+    time.sleep(0.01)
+    second.put("b", _write(tmp_path / "b.mp3", 100))
+    time.sleep(0.01)
+    # An entry added by the other instance is a hit, and becomes the most recently used
+    assert second.get("a") is not None
+    time.sleep(0.01)
+    first.put("c", _write(tmp_path / "c.mp3", 100))
+
+    assert _disk_usage(tmp_path / "cache") == 200
+    assert first.get("b") is None
+    assert second.get("b") is None
+    assert second.get("c") is not None
+
+
+def _fill(directory: str, worker: int, sources: list):
+    cache = DiskCache(directory, max_bytes=1000)
+    for index, source in enumerate(sources):
+        cache.put(f"{worker}-{index}", source)
+
+
+def test_disk_cache_budget_holds_across_processes(tmp_path):
+    sources = [_write(tmp_path / f"{index}.mp3", 100) for index in range(20)]
+    directory = str(tmp_path / "cache")
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_fill, args=(directory, worker, sources)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert all(process.exitcode == 0 for process in processes)
+    assert _disk_usage(tmp_path / "cache") <= 1000
+    assert len(DiskCache(directory, max_bytes=1000)) == 10
+    # No copy in progress is left behind
+    assert list((tmp_path / "cache").glob(".*.tmp")) == []
+
+
+def test_disk_cache_get_into(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=1000)
+    cache.put("song", _write(tmp_path / "song.mp3", 100))
+    (tmp_path / "workspace").mkdir()
+
+    path = cache.get_into("song", str(tmp_path / "workspace"))
+
+    assert path == tmp_path / "workspace" / "song.mp3"
+    assert path.read_bytes() == (tmp_path / "song.mp3").read_bytes()
+    assert cache.get_into("other", str(tmp_path / "workspace")) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disk_cache_get_into_after_eviction_is_a_miss(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache"), max_bytes=150)
+    cache.put("old", _write(tmp_path / "old.mp3", 100))
+    time.sleep(0.01)
+    # Another process evicts the entry, which this process still has in its index
+    DiskCache(str(tmp_path / "cache"), max_bytes=150).put("new", _write(tmp_path / "new.mp3", 100))
+    (tmp_path / "workspace").mkdir()
+
+    assert cache.get_into("old", str(tmp_path / "workspace")) is None
+    assert list((tmp_path / "workspace").iterdir()) == []
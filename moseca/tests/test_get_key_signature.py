@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from moseca.api.get_key_signature import KeyDetectionError, detect_key
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_missing_file_raises(tmp_path, fast):
+    with pytest.raises(KeyDetectionError):
+        detect_key(str(tmp_path / "missing.wav"), fast=fast)
+
+
+def test_empty_file_raises(tmp_path):
+    path = tmp_path / "empty.wav"
+    sf.write(path, np.zeros(0), 22050)
+    with pytest.raises(KeyDetectionError):
+        detect_key(str(path), fast=True)
+
@@ -0,0 +1,77 @@
+import json
+import os
+import time
+
+from moseca.api.service.cache import link_or_copy
+from moseca.api.service.janitor import Janitor
+
+
+def _workspace(root, name, size):
+    workspace = root / name
+    (workspace / "output").mkdir(parents=True)
+    (workspace / "output" / "stem.mp3").write_bytes(b"x" * size)
+    return workspace
+
+
+def test_removes_workspaces_unchanged_for_max_age(tmp_path):
+    first = _workspace(tmp_path / "temp", "first", 100)
+    second = _workspace(tmp_path / "temp", "second", 100)
+    janitor = Janitor([str(tmp_path / "temp")], max_age_seconds=60, max_bytes=None)
+    assert janitor.sweep() == 0
+    assert first.exists() and second.exists()
+
+    # A negative age limit makes every workspace stale
+    janitor.max_age_seconds = -60
+    assert janitor.sweep() == 200
+    assert not first.exists() and not second.exists()
+    assert janitor.stats()["reclaimed_bytes"] == {"age": 200, "budget": 0}
+    assert janitor.stats()["removed_workspaces"] == 2
+
+
+def test_hard_linked_cache_file_keeps_workspace_alive(tmp_path):
+    # A cache entry downloaded two hours ago, linked into the workspace of a new request
+    cached = tmp_path / "cache" / "video" / "song.webm"
+    cached.parent.mkdir(parents=True)
+    cached.write_bytes(b"x" * 100)
+    two_hours_ago = time.time() - 7200
+    os.utime(cached, (two_hours_ago, two_hours_ago))
+
+    workspace = tmp_path / "temp" / "request"
+    workspace.mkdir(parents=True)
+    link_or_copy(str(cached), str(workspace))
+    os.utime(workspace, (two_hours_ago, two_hours_ago))
+
+    janitor = Janitor([str(tmp_path / "temp")], max_age_seconds=3600, max_bytes=None)
+    janitor.sweep()
+    assert (workspace / "song.webm").exists()
+
+
+def test_budget_removes_least_recently_changed_first(tmp_path):
+    for name in ("first", "second", "third"):
+        _workspace(tmp_path / "temp", name, 100)
+        time.sleep(0.01)
+    janitor = Janitor([str(tmp_path / "temp")], max_age_seconds=3600, max_bytes=150, min_age_seconds=-60)
+
+    assert janitor.sweep() == 200
+    assert sorted(os.listdir(tmp_path / "temp")) == ["third"]
+    assert janitor.stats()["reclaimed_bytes"] == {"age": 0, "budget": 200}
+    assert janitor.stats()["usage_bytes"] == 100
+
+
+def test_budget_keeps_recent_workspaces(tmp_path):
+    _workspace(tmp_path / "temp", "busy", 100)
+    janitor = Janitor([str(tmp_path / "temp")], max_age_seconds=3600, max_bytes=10, min_age_seconds=900)
+    assert janitor.sweep() == 0
+    assert (tmp_path / "temp" / "busy").exists()
+
+
+def test_keeps_sample_songs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("PREPARE_SAMPLES", "1")
+    (tmp_path / "sample_songs.json").write_text(json.dumps({"sample": "https://example.com/sample.mp3"}))
+    _workspace(tmp_path / "temp", "sample", 100)
+    _workspace(tmp_path / "temp", "request", 100)
+
+    janitor = Janitor(["temp"], max_age_seconds=-60, max_bytes=None)
+    assert janitor.sweep() == 100
+    assert os.listdir(tmp_path / "temp") == ["sample"]
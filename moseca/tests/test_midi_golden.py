@@ -0,0 +1,160 @@
+"""
+Equivalence tests of the MIDI post-processing stages against golden files.
+
+The inputs in golden/midi are a synthetic drum track, from the generator of the
+benchmarks, and a synthetic transcription with spread chords and a drum part. The
+expected outputs were written by the original file-by-file implementations of the
+stages, before the events moved to a NumPy array, so any change of the output of the
+in-memory stages fails here.
+
+The tempo remap of /audio-to-midi used to truncate every delta time, so its output lags
+the exact rescale by up to a tick per message. The remap_pipeline files were written by
+the original multi-pass conversion from drums.mid at four times its resolution, where the
+rescale to 90 and 60 BPM is exact, so the single pass must give the same files.
+"""
+from functools import partial
+from pathlib import Path
+
+import mido
+import pytest
+from mido import MidiFile
+
+from moseca.api.midi_events import MidiEvents
+from moseca.api.midi_pipeline import MidiPipeline, remap_tempo
+from moseca.api.prettyify import prettyify, prettyify_events
+from moseca.api.quantize_midi import quantize_events, quantize_midi
+from moseca.api.tempo_chunking import chunk_tempo_events, tempo_chunking
+
+GOLDEN_DIR = Path(__file__).parent / "golden" / "midi"
+INPUTS = ["drums", "melody"]
+TEMPOS = [120, 90]
+
+
+def _messages(mid: MidiFile):
+    return mid.type, mid.ticks_per_beat, [list(track) for track in mid.tracks]
+
+
+def _assert_matches_golden(mid: MidiFile, name: str):
+    assert _messages(mid) == _messages(MidiFile(GOLDEN_DIR / f"{name}.mid"))
+
+
+def _process(name: str, stages) -> MidiFile:
+    events = MidiEvents.from_midi(MidiFile(GOLDEN_DIR / f"{name}.mid"))
+    return MidiPipeline(stages).process(events).to_midi()
+
+
+@pytest.mark.parametrize("bpm", TEMPOS)
+@pytest.mark.parametrize("name", INPUTS)
+def test_quantize_matches_golden(name, bpm):
+    _assert_matches_golden(_process(name, [partial(quantize_events, bpm=bpm)]), f"{name}.quantize_{bpm}")
+
+
+@pytest.mark.parametrize("bpm", TEMPOS)
+@pytest.mark.parametrize("name", INPUTS)
+def test_tempo_chunking_matches_golden(name, bpm):
+    _assert_matches_golden(_process(name, [partial(chunk_tempo_events, bpm=bpm)]), f"{name}.tempo_chunking_{bpm}")
+
+
+@pytest.mark.parametrize("name", INPUTS)
+def test_prettyify_matches_golden(name):
+    _assert_matches_golden(_process(name, [prettyify_events]), f"{name}.prettyify")
+
+
+@pytest.mark.parametrize("bpm", TEMPOS)
+@pytest.mark.parametrize("name", INPUTS)
+def test_pipeline_matches_golden(name, bpm):
+    # The stages of the MIDI conversion endpoints after the tempo remap, in one pass
+    stages = [partial(quantize_events, bpm=bpm), partial(chunk_tempo_events, bpm=bpm), prettyify_events]
+    _assert_matches_golden(_process(name, stages), f"{name}.pipeline_{bpm}")
+
+
+def test_file_stages_match_golden(tmp_path):
+    # The command line entry points load and save a file per stage
+    quantized = quantize_midi(str(GOLDEN_DIR / "melody.mid"), 120, str(tmp_path))
+    _assert_matches_golden(MidiFile(quantized), "melody.quantize_120")
+    adjusted = tempo_chunking(str(GOLDEN_DIR / "drums.mid"), 90, str(tmp_path))
+    _assert_matches_golden(MidiFile(adjusted), "drums.tempo_chunking_90")
+    prettified = prettyify(str(GOLDEN_DIR / "melody.mid"), str(tmp_path))
+    _assert_matches_golden(MidiFile(prettified), "melody.prettyify")
+
+
+def _baseline_remap(mid: MidiFile, bpm: int) -> MidiFile:
+    """The tempo remap of the original /audio-to-midi endpoint, which truncated every delta time."""
+    scaling_factor = bpm / 120
+    remapped = MidiFile(ticks_per_beat=mid.ticks_per_beat)
+    for track in mid.tracks:
+        new_track = mido.MidiTrack()
+        remapped.tracks.append(new_track)
+        new_track.append(mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(bpm), time=0))
+        for msg in track:
+            new_track.append(msg.copy(time=int(msg.time * scaling_factor)))
+    return remapped
+
+
+def _absolute(track):
+    """The messages of a track with absolute times."""
+    now = 0
+    for msg in track:
+        now += msg.time
+        yield now, msg.copy(time=0)
+
+
+def _finer(mid: MidiFile, factor: int = 4) -> MidiFile:
+    """The same MIDI file with `factor` times more ticks per beat."""
+    finer = MidiFile(type=mid.type, ticks_per_beat=mid.ticks_per_beat * factor)
+    for track in mid.tracks:
+        finer.tracks.append(mido.MidiTrack(msg.copy(time=msg.time * factor) for msg in track))
+    return finer
+
+
+@pytest.mark.parametrize("bpm", [120, 90, 60, 140])
+def test_remap_tempo_against_baseline(bpm):
+    source = MidiFile(GOLDEN_DIR / "drums.mid")
+    scaling_factor = bpm / 120
+
+    remapped = MidiPipeline([partial(remap_tempo, bpm=bpm)]).process(MidiEvents.from_midi(source)).to_midi()
+    baseline = _baseline_remap(source, bpm)
+
+    for track, remapped_track, baseline_track in zip(source.tracks, remapped.tracks, baseline.tracks):
+        source_times = [time for time, _ in _absolute(track)]
+        remapped_track, baseline_track = list(_absolute(remapped_track)), list(_absolute(baseline_track))
+        # The same messages in the same order, after the tempo message
+        assert [msg for _, msg in remapped_track] == [msg for _, msg in baseline_track]
+        assert remapped_track[0][1] == mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(bpm))
+        for index, (time, (remapped_time, _), (baseline_time, _)) in enumerate(
+            zip(source_times, remapped_track[1:], baseline_track[1:])
+        ):
+            # Rounded once, so never more than half a tick from the exact time
+            assert abs(remapped_time - time * scaling_factor) <= 0.5
+            # The truncated delta times lag by less than a tick per message before
+            assert 0 <= remapped_time - baseline_time <= index + 1
+    if bpm == 120:
+        assert _messages(remapped) == _messages(baseline)
+
+
+@pytest.mark.parametrize("bpm", [90, 60])
+def test_remap_pipeline_matches_baseline_golden(bpm):
+    # The stages of percussion /audio-to-midi, where the original truncation lost nothing
+    events = MidiEvents.from_midi(_finer(MidiFile(GOLDEN_DIR / "drums.mid")))
+    stages = [
+        partial(remap_tempo, bpm=bpm, source_bpm=120), partial(quantize_events, bpm=bpm),
+        partial(chunk_tempo_events, bpm=bpm), prettyify_events,
+    ]
+
+    _assert_matches_golden(MidiPipeline(stages).process(events).to_midi(), f"drums.remap_pipeline_{bpm}")
+
+
+def test_stages_leave_their_input_unchanged():
+    events = MidiEvents.from_midi(MidiFile(GOLDEN_DIR / "melody.mid"))
+    messages, array = list(events.messages), events.array.copy()
+    stages = [
+        partial(remap_tempo, bpm=90), partial(quantize_events, bpm=90),
+        partial(chunk_tempo_events, bpm=90), prettyify_events,
+    ]
+
+    first = MidiPipeline(stages).process(events).to_midi()
+
+    assert events.messages == messages
+    assert (events.array == array).all()
+    # The same input events can be processed again, with the same result
+    assert _messages(MidiPipeline(stages).process(events).to_midi()) == _messages(first)
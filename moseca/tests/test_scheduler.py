@@ -0,0 +1,55 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from moseca.api.service.scheduler import JobScheduler, SchedulerBusy, estimate_cost
+
+
+def test_estimate_cost():
+    assert estimate_cost("separation:htdemucs_6s", 100) == 150
+    assert estimate_cost("unknown", 100) == 100
+    assert estimate_cost("separation:htdemucs", None) == 0
+
+
+def test_can_admit_until_max_pending_cost():
+    executor = ThreadPoolExecutor(max_workers=2)
+    scheduler = JobScheduler(executor, max_pending_cost=10)
+    started, release = threading.Event(), threading.Event()
+
+    def job():
+        started.set()
+        release.wait(5)
+        return "done"
+
+    async def main():
+        # A job larger than the limit is admitted when nothing is pending
+        assert scheduler.can_admit(50)
+        running = asyncio.ensure_future(scheduler.run("separation:htdemucs", job, cost=8))
+        await asyncio.to_thread(started.wait, 5)
+
+        assert scheduler.stats() == {"pending_cost": 8, "in_flight": {"separation:htdemucs": 1}}
+        assert scheduler.can_admit(2)
+        assert not scheduler.can_admit(3)
+        with pytest.raises(SchedulerBusy):
+            await scheduler.run("separation:htdemucs", job, cost=3)
+
+        release.set()
+        assert await running == "done"
+        # The cost of the job is released once it finished
+        assert scheduler.can_admit(50)
+        assert scheduler.stats() == {"pending_cost": 0, "in_flight": {}}
+
+    try:
+        asyncio.run(main())
+    finally:
+        release.set()
+        executor.shutdown()
+
+
+def test_can_admit_without_limit():
+    scheduler = JobScheduler()
+    scheduler.pending_cost = 1e9
+
+    assert scheduler.can_admit(1e9)
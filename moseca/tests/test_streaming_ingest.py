@@ -0,0 +1,113 @@
+import http.client
+import shutil
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from moseca.api.align_audio import ANALYSIS_SAMPLE_RATE
+from moseca.api.service.streaming_ingest import CHUNK_SIZE, stream_to_file
+
+pytestmark = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+
+DURATION = 2.0
+
+
+class AudioHandler(BaseHTTPRequestHandler):
+    """Serves the body of the server, announcing `length` bytes when it is set."""
+
+    def do_GET(self):
+        body = self.server.body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(self.server.length or len(body)))
+        self.end_headers()
+        # Send in pieces smaller than the chunks read, like a slow source
+        for start in range(0, len(body), CHUNK_SIZE // 4):
+            self.wfile.write(body[start:start + CHUNK_SIZE // 4])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def serve(body: bytes, length: int = None) -> str:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), AudioHandler)
+        server.body = body
+        server.length = length
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}/song.wav"
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def wav_bytes(tmp_path) -> bytes:
+    sample_rate = 44100
+    t = np.arange(int(DURATION * sample_rate)) / sample_rate
+    tone = 0.5 * np.sin(2 * np.pi * 440 * t)
+    path = tmp_path / "source.wav"
+    sf.write(path, np.stack([tone, tone], axis=1), sample_rate)
+    return path.read_bytes()
+
+
+def test_stream_to_file_downloads_and_decodes(serve, wav_bytes, tmp_path):
+    destination = tmp_path / "song.wav"
+
+    path, signal = stream_to_file(serve(wav_bytes), str(destination))
+
+    assert path == str(destination)
+    assert destination.read_bytes() == wav_bytes
+    assert signal.dtype == np.float32
+    assert abs(len(signal) - DURATION * ANALYSIS_SAMPLE_RATE) <= 1
+    # The tone is decoded at its frequency
+    spectrum = np.abs(np.fft.rfft(signal))
+    assert np.argmax(spectrum) * ANALYSIS_SAMPLE_RATE / len(signal) == pytest.approx(440, abs=1)
+
+
+def test_stream_to_file_file_url(wav_bytes, tmp_path):
+    source = tmp_path / "source.wav"
+    destination = tmp_path / "song.wav"
+
+    _, signal = stream_to_file(source.as_uri(), str(destination))
+
+    assert destination.read_bytes() == wav_bytes
+    assert abs(len(signal) - DURATION * ANALYSIS_SAMPLE_RATE) <= 1
+
+
+def test_stream_to_file_keeps_download_when_decoding_fails(serve, tmp_path):
+    body = np.random.default_rng(0).bytes(4 * CHUNK_SIZE)
+    destination = tmp_path / "song.wav"
+
+    path, signal = stream_to_file(serve(body), str(destination))
+
+    assert signal is None
+    assert destination.read_bytes() == body
+
+
+def test_stream_to_file_without_analysis(serve, wav_bytes, tmp_path):
+    destination = tmp_path / "song.wav"
+
+    _, signal = stream_to_file(serve(wav_bytes), str(destination), analyze=False)
+
+    assert signal is None
+    assert destination.read_bytes() == wav_bytes
+
+
+def test_stream_to_file_removes_truncated_download(serve, wav_bytes, tmp_path):
+    destination = tmp_path / "song.wav"
+    url = serve(wav_bytes[:len(wav_bytes) // 2], length=len(wav_bytes))
+
+    with pytest.raises(http.client.IncompleteRead):
+        stream_to_file(url, str(destination))
+
+    assert not destination.exists()
@@ -0,0 +1,64 @@
+import asyncio
+import hashlib
+import io
+import os
+
+import pytest
+from fastapi import UploadFile
+
+from moseca.api.service import uploads
+from moseca.api.service.cache import file_sha256
+from moseca.api.service.uploads import UploadTooLarge, new_workspace, save_upload
+
+
+def _workspaces(directory) -> list:
+    return sorted(path.name for path in (directory / "data" / "temp").glob("*"))
+
+
+def test_new_workspace(tmp_path):
+    first = new_workspace(str(tmp_path / "temp"))
+    second = new_workspace(str(tmp_path / "temp"))
+
+    assert first != second
+    assert first.is_dir() and list(first.iterdir()) == []
+
+
+def test_save_upload_hashes_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_SIZE", 1000)
+    data = os.urandom(10_500)
+    destination = tmp_path / "song.wav"
+
+    digest = asyncio.run(save_upload(UploadFile(io.BytesIO(data), filename="song.wav"), destination))
+
+    assert digest == hashlib.sha256(data).hexdigest()
+    # The same key as for files hashed on disk
+    assert digest == file_sha256(str(destination))
+    assert destination.read_bytes() == data
+
+
+def test_save_upload_rejects_large_upload(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_CHUNK_SIZE", 1000)
+    destination = tmp_path / "song.wav"
+    # The size of the upload is not known in advance, so the limit is checked while writing
+    upload = UploadFile(io.BytesIO(os.urandom(5000)), filename="song.wav")
+
+    with pytest.raises(UploadTooLarge) as excinfo:
+        asyncio.run(save_upload(upload, destination, max_bytes=4000))
+
+    assert excinfo.value.status_code == 413
+    assert not destination.exists()
+
+
+def test_request_over_size_limit_is_rejected_before_reading(client, api_main, api_workdir, monkeypatch):
+    monkeypatch.setattr(api_main, "MAX_UPLOAD_BYTES", 1000)
+    workspaces = _workspaces(api_workdir)
+
+    # The declared length is over the limit and the margin for the other form fields
+    response = client.post(
+        "/beat-grid", files={"audio_file": ("song.wav", os.urandom(2 << 20))}, data={"tempo": 120}
+    )
+
+    assert response.status_code == 413
+    assert "too large" in response.json()["error"]
+    # The endpoint did not run, so no workspace was created for the upload
+    assert _workspaces(api_workdir) == workspaces
@@ -1,7 +1,6 @@
 import json
 import os
 import random
-import time
 from base64 import b64encode
 from io import BytesIO
 from pathlib import Path
@@ -123,26 +122,3 @@ def _get_files_to_not_delete():
             except Exception as e:
                 log.warning(f"Error reading file {filename}: {e}")
     return not_delete
-
-
-def _remove_file_older_than(file_path: str, max_age_limit: float):
-    # If the file is older than the age limit, delete it
-    if os.path.getmtime(file_path) < max_age_limit:
-        try:
-            log.info(f"Deleting {file_path}")
-            os.remove(file_path)
-        except OSError as e:
-            log.warning(f"Error: Could not delete {file_path}. Reason: {e.strerror}")
-
-
-def delete_old_files(directory: str, age_limit_seconds: int):
-    files_to_not_delete = _get_files_to_not_delete()
-    age_limit = time.time() - age_limit_seconds
-
-    # Walk through the directory
-    # for dirpath, dirnames, filenames in os.walk(directory):
-    #     if os.path.basename(dirpath) not in files_to_not_delete:
-    #         for filename in filenames:
-    #             if filename.split(".")[0] not in files_to_not_delete:
-    #                 file_path = os.path.join(dirpath, filename)
-    #                 _remove_file_older_than(file_path, age_limit)